@@ -14,12 +14,12 @@ def compute_cost_of_action(action, cost_type):
         return cost
 
 
-def compute_rl_reward(action, qos_reward, visualize=False):
+def compute_rl_reward(action, qos_reward, visualize=False, prbs=PRBs):
     cost_of_action = compute_cost_of_action(action, type_of_cost)
     round_cost = cost_of_action + (1 - qos_reward) * QoS_cost_violation
     round_reward = -round_cost
-    max_cost = PRBs[-1] + QoS_cost_violation
-    min_cost = PRBs[0]
+    max_cost = prbs[-1] + QoS_cost_violation
+    min_cost = prbs[0]
     min_reward = -max_cost
     max_reward = -min_cost
     round_reward = (round_reward - min_reward) / (max_reward - min_reward)
@@ -28,10 +28,10 @@ def compute_rl_reward(action, qos_reward, visualize=False):
     return round_reward
 
 
-def compute_qos_reward(action, RL_reward):
+def compute_qos_reward(action, RL_reward, prbs=PRBs):
     cost_of_action = compute_cost_of_action(action, type_of_cost)
-    max_cost = PRBs[-1] + QoS_cost_violation
-    min_cost = PRBs[0]
+    max_cost = prbs[-1] + QoS_cost_violation
+    min_cost = prbs[0]
     min_reward = -max_cost
     max_reward = -min_cost
     round_reward = RL_reward * (max_reward - min_reward) + min_reward
@@ -42,11 +42,11 @@ def compute_qos_reward(action, RL_reward):
 
 # Find most pulled arm for the policy of the second episode
 # noinspection PyTypeChecker
-def find_most_used_arm(trajectory_file, last_rounds):
+def find_most_used_arm(trajectory_file, last_rounds, prbs=PRBs):
     context_vs_arms = defaultdict(list)
     with open(trajectory_file, 'r') as f:
         data = [x.strip().split('\t') for x in f]
-    data.pop(0)     # 0:BW - 1:Users - 2:MCS - 3:BSR - 4:QoS - 5:Reward
+    data.pop(0)     # 0:BW - 1:Users - 2:MCS - 3:BSR - 4:QoS - 5:Reward - 6:UEsAge - 7:Actuation
     data = np.array(data).astype(float)
 
     last_rounds = np.array(last_rounds).astype(int)
@@ -54,7 +54,7 @@ def find_most_used_arm(trajectory_file, last_rounds):
 
     for t in last_rounds:
         actual_arm = data[t, 0]
-        arm = PRBs.index(actual_arm)
+        arm = prbs.index(actual_arm)
 
         users = data[t, 1]
         mcs = data[t, 2]
@@ -75,27 +75,27 @@ def find_most_used_arm(trajectory_file, last_rounds):
 
 
 # second policy is the first epsilon-soft policy
-def second_policy(state, context_vs_most_used_arm):
-    arms = list(range(num_arms))
-    high_prob = 1 - epsilon + epsilon / num_arms
-    low_prob = epsilon / num_arms
-    probabilities = num_arms*[low_prob]
+def second_policy(state, context_vs_most_used_arm, prbs=PRBs):
+    arms = list(range(len(prbs)))
+    high_prob = 1 - epsilon + epsilon / len(prbs)
+    low_prob = epsilon / len(prbs)
+    probabilities = len(prbs)*[low_prob]
     if state in context_vs_most_used_arm.keys():
         best_action = context_vs_most_used_arm[state]
     else:
         # if state did not occur, be optimistic and choose the smallest arm
         best_action = 0
     probabilities[best_action] = high_prob
-    print(f"[RL] Second policy: Actions {PRBs} drawn using pmf {probabilities}")
+    print(f"[RL] Second policy: Actions {prbs} drawn using pmf {probabilities}")
     selected_action = np.random.choice(arms, 1, True, probabilities)
-    selected_action = int(selected_action)
+    selected_action = int(selected_action[0])
     return selected_action
 
 
-def policy_iteration(trajectory_file, last_rounds, Q, returns):
+def policy_iteration(trajectory_file, last_rounds, Q, returns, prbs=PRBs):
     with open(trajectory_file, 'r') as f:
         data = [x.strip().split('\t') for x in f]
-    data.pop(0)     # 0:BW - 1:Users - 2:MCS - 3:BSR - 4:QoS - 5:Reward
+    data.pop(0)     # 0:BW - 1:Users - 2:MCS - 3:BSR - 4:QoS - 5:Reward - 6:UEsAge - 7:Actuation
     data = np.array(data).astype(float)
 
     last_rounds = np.array(last_rounds).astype(int)
@@ -107,7 +107,7 @@ def policy_iteration(trajectory_file, last_rounds, Q, returns):
     for t in last_rounds:
         actual_action = data[t, 0]
         actual_state = [data[t, 1], data[t, 2], data[t, 3]]
-        action = PRBs.index(actual_action)
+        action = prbs.index(actual_action)
         state = indexify_context(actual_state)
         state_action = tuple([state[0], state[1], state[2], action])
         if state_action not in first_times.keys():
@@ -120,7 +120,7 @@ def policy_iteration(trajectory_file, last_rounds, Q, returns):
         for t in last_rounds:
             if t < first_times[key]:
                 continue
-            round_reward = compute_rl_reward(data[t, 0], data[t, 5])
+            round_reward = compute_rl_reward(data[t, 0], data[t, 5], prbs=prbs)
             G += gamma ** k * round_reward
             k += 1
             mean_round_reward += round_reward
@@ -138,11 +138,11 @@ def policy_iteration(trajectory_file, last_rounds, Q, returns):
     return Q, returns
 
 
-def epsilon_soft_policy(state, Q):
+def epsilon_soft_policy(state, Q, prbs=PRBs):
     best_action_candidates = []
     candidate_Q_values = []
     state = tuple(state)
-    for action in range(num_arms):
+    for action in range(len(prbs)):
         state_action = state + (action,)
         if state_action in Q.keys():
             best_action_candidates.append(action)
@@ -161,21 +161,23 @@ def epsilon_soft_policy(state, Q):
         best_action_index = candidate_Q_values.index(Q_max)  # returns smallest action in case of ties
         best_action = best_action_candidates[best_action_index]
 
-    high_prob = 1 - epsilon + epsilon / num_arms
-    low_prob = epsilon / num_arms
+    high_prob = 1 - epsilon + epsilon / len(prbs)
+    low_prob = epsilon / len(prbs)
 
-    probabilities = num_arms*[low_prob]
+    probabilities = len(prbs)*[low_prob]
     probabilities[best_action] = high_prob
-    selected_action = np.random.choice(list(range(num_arms)), 1, True, probabilities)
-    selected_action = int(selected_action)
-    print(f"[RL] Actions {PRBs} drawn using pmf {probabilities}")
+    selected_action = np.random.choice(list(range(len(prbs))), 1, True, probabilities)
+    selected_action = int(selected_action[0])
+    print(f"[RL] Actions {prbs} drawn using pmf {probabilities}")
     return selected_action
 
 
-def update_transition_matrix(trajectory_file, last_rounds, state_transition_count):
+def update_transition_matrix(trajectory_file, last_rounds, state_transition_count, prbs=PRBs, shared_count=None):
+    # shared_count: transition counts of the same grid observed elsewhere
+    # (e.g., on other testbeds), pooled with the own ones for P only
     with open(trajectory_file, 'r') as f:
         data = [x.strip().split('\t') for x in f]
-    data.pop(0)     # 0:BW - 1:Users - 2:MCS - 3:BSR - 4:QoS - 5:Reward
+    data.pop(0)     # 0:BW - 1:Users - 2:MCS - 3:BSR - 4:QoS - 5:Reward - 6:UEsAge - 7:Actuation
     data = np.array(data).astype(float)
 
     last_rounds = np.array(last_rounds).astype(int)
@@ -186,7 +188,7 @@ def update_transition_matrix(trajectory_file, last_rounds, state_transition_coun
 
         # find the state_action (s,a)
         actual_action = data[t, 0]
-        action = indexify_bandwidth(actual_action)
+        action = prbs.index(actual_action)
         actual_state = [data[t, 1], data[t, 2], data[t, 3]]
         state = indexify_context(actual_state)
         state.pop(0)    # remove number of users
@@ -194,7 +196,7 @@ def update_transition_matrix(trajectory_file, last_rounds, state_transition_coun
 
         # find the newstate_reward (s',r)
         QoS_reward = data[t, 5]
-        RL_reward = compute_rl_reward(actual_action, QoS_reward)
+        RL_reward = compute_rl_reward(actual_action, QoS_reward, prbs=prbs)
 
         actual_newstate = [data[t + 1, 1], data[t + 1, 2], data[t + 1, 3]]
         newstate = indexify_context(actual_newstate)
@@ -204,22 +206,26 @@ def update_transition_matrix(trajectory_file, last_rounds, state_transition_coun
         tuple_of_two_tuples = (state_action, newstate_reward)
         state_transition_count[tuple_of_two_tuples] += 1
 
-    fake_state_transition_count = state_transition_count.copy()
+    pooled_count = state_transition_count.copy()
+    for key, count in (shared_count or {}).items():
+        pooled_count[key] += count
+
+    fake_state_transition_count = pooled_count.copy()
     # Extend transition counts by exploiting arm correlations
-    for key in state_transition_count.keys():
+    for key in pooled_count.keys():
         state_action = key[0]
         newstate_reward = key[1]
 
         # Find QoS reward
         RL_reward = newstate_reward[2]
-        bandwidth = PRBs[state_action[2]]
-        QoS_reward = compute_qos_reward(bandwidth, RL_reward)
+        bandwidth = prbs[state_action[2]]
+        QoS_reward = compute_qos_reward(bandwidth, RL_reward, prbs=prbs)
 
         # begin extending
-        current_count = state_transition_count[key]
+        current_count = pooled_count[key]
         if QoS_reward == 1:
             # assume that all higher bandwidths would also meet QoS, result to same newMCS and slightly better newBSR
-            for action in range(state_action[2] + 1, len(PRBs)):
+            for action in range(state_action[2] + 1, len(prbs)):
                 # new considered state action pair is the same but with different action
                 state_action_new = list(key[0])
                 state_action_new[2] = action
@@ -227,7 +233,7 @@ def update_transition_matrix(trajectory_file, last_rounds, state_transition_coun
                 # new newstate_reward is the same but with smaller BSR and reward that reflects the action reward
                 newstate_reward_new = list(key[1])
                 newstate_reward_new[1] = max(key[1][1] - 1, 0)
-                RL_reward_new = compute_rl_reward(PRBs[action], 1)
+                RL_reward_new = compute_rl_reward(prbs[action], 1, prbs=prbs)
                 newstate_reward_new[2] = RL_reward_new
 
                 state_action_new = tuple(state_action_new)
@@ -244,7 +250,7 @@ def update_transition_matrix(trajectory_file, last_rounds, state_transition_coun
                 # new newstate_reward is the same but with larger BSR and reward that reflects the action reward
                 newstate_reward_new = list(key[1])
                 newstate_reward_new[1] = min(key[1][1] + 1, len(BSRs) - 1)
-                RL_reward_new = compute_rl_reward(PRBs[action], 0)
+                RL_reward_new = compute_rl_reward(prbs[action], 0, prbs=prbs)
                 newstate_reward_new[2] = RL_reward_new
 
                 state_action_new = tuple(state_action_new)
@@ -261,13 +267,13 @@ def update_transition_matrix(trajectory_file, last_rounds, state_transition_coun
     # fill up the fake_state_transition_count matrix in the places where a whole row is empty
     for mcs in range(len(MCSs)):
         for bsr in range(len(BSRs)):
-            for w in range(len(PRBs)):
+            for w in range(len(prbs)):
                 state_action = tuple([mcs, bsr, w])
                 # if this state_action pair did not receive value, then whole row is empty so fill it up
                 if fake_state_action_count[state_action] == 0:
                     # be optimistic and assign P(mcs', bsr', r | mcs, bsr, a) = 1 if mcs'=mcs bsr'= 0 and r = rmax(a)
                     # to do simply put count = 1 only for the above state_action , newstate_reward pair
-                    optimistic_reward = compute_rl_reward(PRBs[w], 1)
+                    optimistic_reward = compute_rl_reward(prbs[w], 1, prbs=prbs)
                     newstate_reward = tuple([mcs, 0, optimistic_reward])
                     tuple_of_two_tuples = tuple([state_action, newstate_reward])
                     fake_state_transition_count[tuple_of_two_tuples] += 1
@@ -282,14 +288,14 @@ def update_transition_matrix(trajectory_file, last_rounds, state_transition_coun
     # # Check if probability matrix rows sum to 1 as it should be the case for every stochastic matrix
     # for mcs in range(len(MCSs)):
     #     for bsr in range(len(BSRs)):
-    #         for w in range(len(PRBs)):
+    #         for w in range(len(prbs)):
     #             s = 0
     #             state_action = tuple([mcs, bsr, w])
     #             for new_mcs in range(len(MCSs)):
     #                 for new_bsr in range(len(BSRs)):
     #                     # The possible rewards are only two
-    #                     reward1 = compute_rl_reward(PRBs[w], 1)
-    #                     reward2 = compute_rl_reward(PRBs[w], 0)
+    #                     reward1 = compute_rl_reward(prbs[w], 1, prbs=prbs)
+    #                     reward2 = compute_rl_reward(prbs[w], 0, prbs=prbs)
     #
     #                     newstate_reward1 = tuple([new_mcs, new_bsr, reward1])
     #                     newstate_reward2 = tuple([new_mcs, new_bsr, reward2])
@@ -304,14 +310,14 @@ def update_transition_matrix(trajectory_file, last_rounds, state_transition_coun
     #             if s != 1:
     #                 print(f"[RL] Error! The sum of a row of the transition matrix is {s}!")
     #
-    # total_elements = len(MCSs)*len(BSRs)*len(PRBs)*len(MCSs)*len(BSRs)*2
+    # total_elements = len(MCSs)*len(BSRs)*len(prbs)*len(MCSs)*len(BSRs)*2
     # if len(probability_matrix) != total_elements:
     #     print(f"[RL] Error! The len of probability_matrix is {len(probability_matrix)} instead of {total_elements}")
     # print(f"[RL] The probability_matrix is {probability_matrix}")
     return probability_matrix, state_transition_count
 
 
-def value_iteration(P):
+def value_iteration(P, prbs=PRBs):
     theta = 0.5
     state_values = defaultdict(float)
     max_deviation = theta + 1
@@ -326,14 +332,14 @@ def value_iteration(P):
                 candidate_values = []
 
                 # for each state scan all actions
-                for w in range(len(PRBs)):
+                for w in range(len(prbs)):
                     total = 0
                     for new_mcs in range(len(MCSs)):
                         for new_bsr in range(len(BSRs)):
                             for qos_reward in range(2):
                                 state_action = tuple([mcs, bsr, w])
 
-                                RL_reward = compute_rl_reward(PRBs[w], qos_reward)
+                                RL_reward = compute_rl_reward(prbs[w], qos_reward, prbs=prbs)
                                 newstate = tuple([new_mcs, new_bsr])
                                 newstate_reward = tuple([new_mcs, new_bsr, RL_reward])
 
@@ -355,14 +361,14 @@ def value_iteration(P):
             candidate_values = []
 
             # for each state scan all actions
-            for w in range(len(PRBs)):
+            for w in range(len(prbs)):
                 total = 0
                 for new_mcs in range(len(MCSs)):
                     for new_bsr in range(len(BSRs)):
                         for qos_reward in range(2):
                             state_action = tuple([mcs, bsr, w])
 
-                            RL_reward = compute_rl_reward(PRBs[w], qos_reward)
+                            RL_reward = compute_rl_reward(prbs[w], qos_reward, prbs=prbs)
                             newstate = tuple([new_mcs, new_bsr])
                             newstate_reward = tuple([new_mcs, new_bsr, RL_reward])
 
@@ -378,15 +384,15 @@ def value_iteration(P):
     return best_action
 
 
-def epsilon_soft_policy_select(best_action):
-    print(f"[RL] Best action is: {PRBs[best_action]} PRBs")
-    high_prob = 1 - epsilon + epsilon / num_arms
-    low_prob = epsilon / num_arms
+def epsilon_soft_policy_select(best_action, prbs=PRBs):
+    print(f"[RL] Best action is: {prbs[best_action]} PRBs")
+    high_prob = 1 - epsilon + epsilon / len(prbs)
+    low_prob = epsilon / len(prbs)
 
-    probabilities = num_arms*[low_prob]
+    probabilities = len(prbs)*[low_prob]
     probabilities[best_action] = high_prob
-    selected_action = np.random.choice(list(range(num_arms)), 1, True, probabilities)
-    selected_action = int(selected_action)
+    selected_action = np.random.choice(list(range(len(prbs))), 1, True, probabilities)
+    selected_action = int(selected_action[0])
     return selected_action
 
 
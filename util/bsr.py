@@ -0,0 +1,124 @@
+import re
+import sys
+import time
+import numpy as np
+from datetime import datetime
+from .parameters import bsr_list
+from .logindex import window_ms
+from .logcolumns import parse_log_columns, LAYER_MAC, DIR_NONE, DIR_UL
+
+# All b= indices of a header: one for short (SBSR: lcg=3 b=26), one per
+# logical channel group for long BSRs (LBSR: b=0 0 0 0)
+bsr_values_pattern = re.compile(rb' b=(\d+(?: \d+)*)')
+
+# Set the threshold time difference in milliseconds (window size)
+threshold_ms = 1000
+
+def bsr_bytes(indices):
+    # Buffer size of a BSR: sum of its logical channel groups' queue sizes
+    return sum(bsr_list[min(index, len(bsr_list) - 1)] for index in indices)
+
+class BsrTracker:
+    # Latest UL/DL BSR per ue_id, kept up to date from the MAC header records
+    # as they are parsed. It is fed like the log consumers, so that a round's
+    # scan of the UEbox log updates it in passing; sum_ul_bsr() then takes
+    # O(#UEs) instead of re-parsing the headers.
+    def __init__(self):
+        # (ue_id, direction) -> (epoch ms, b= indices, bytes)
+        self.latest = {}
+        # Most recent MAC record of the current scan, None if none yet
+        self.newest_ms = None
+        self.start_time = None
+        self.records = 0
+
+    def watch(self, start_time):
+        # Take the records from start_time on at the next scan
+        self.start_time = start_time
+        self.newest_ms = None
+        return self
+
+    def window(self):
+        return (self.start_time, None) if self.start_time else None
+
+    def feed(self, columns, filename_date, is_ip):
+        start_ms, _ = window_ms(filename_date, self.start_time, None) if self.start_time else (0, None)
+        mask = (columns.layer == LAYER_MAC) & (columns.direction != DIR_NONE) & \
+               (columns.bsr >= 0) & (columns.ue_id >= 0) & (columns.ts >= start_ms)
+        records = np.flatnonzero(mask)
+        if not len(records):
+            return
+        day_ms = time.mktime(time.strptime(filename_date, "%Y%m%d")) * 1000
+
+        # Latest record per ue_id and direction (records are in log order)
+        keys = columns.ue_id[records].astype(np.int64) * 2 + columns.direction[records]
+        _, latest = np.unique(keys[::-1], return_index=True)
+        latest = set(records[::-1][latest].tolist())
+        positions, matches = columns.field_positions(bsr_values_pattern)
+        indices = {i: match.group(1) for i, match in zip(positions.tolist(), matches) if i in latest}
+        for i in sorted(latest):
+            values = [int(value) for value in indices[i].split()] if i in indices else [int(columns.bsr[i])]
+            key = (int(columns.ue_id[i]), int(columns.direction[i]))
+            self.latest[key] = (day_ms + int(columns.ts[i]), values, bsr_bytes(values))
+        self.newest_ms = max(self.newest_ms or 0, day_ms + int(columns.ts[records[-1]]))
+        self.records += len(records)
+
+    def feed_headers(self, mac_headers):
+        # Feed MAC header lines given in decreasing time, e.g., those taken
+        # from a round's log snapshot; dated today, as only their order matters
+        self.watch(None)
+        lines = (line if line.endswith("\n") else line + "\n" for line in reversed(mac_headers))
+        self.feed(parse_log_columns("".join(lines).encode()), datetime.now().strftime("%Y%m%d"), None)
+
+    def current(self, ue_id, direction):
+        # Latest entry of ue_id within the threshold of the scan's newest record
+        entry = self.latest.get((ue_id, direction))
+        if entry is None or self.newest_ms is None or entry[0] < self.newest_ms - threshold_ms:
+            return None
+        return entry
+
+    def bsr(self, active_users):
+        # Same as last_bsr(): [DL, UL] b= index per active user, 0 if none;
+        # the first logical channel group's index for long BSRs
+        return [[entry[1][0] if entry else 0 for entry in (self.current(ue_id, direction) for direction in (0, 1))]
+                for ue_id in active_users]
+
+    def sum_ul_bsr(self, active_users):
+        # Total UL buffer size (bytes) of the active users, O(#UEs); users
+        # without a recent BSR are assumed to be recently inactive
+        return sum(entry[2] for entry in (self.current(ue_id, DIR_UL) for ue_id in active_users) if entry)
+
+if __name__ == "__main__":
+    # Compare with last_bsr() over the MAC headers of generated logs; the
+    # tracker is fed the columns the round's scan parses anyway, e.g.:
+    # python3 -m util.bsr 10 100 500
+    import tempfile
+    from .loggen import write_log_pair
+    from .logflatten import extract_entries_from_file, log_file_date
+    from .e2estats import last_bsr
+    for num_ues in [int(value) for value in sys.argv[1:]] or [10, 100, 500]:
+        with tempfile.TemporaryDirectory() as directory:
+            paths, (start_time, end_time), _, _ = write_log_pair(directory, num_ues, packet_rate=5, duration=2,
+                                                                 mac_rate=50)
+            filepath = paths["ue0"][-1]
+            _, headers = extract_entries_from_file("ue0", filepath, start_time, None)
+            mac_headers = list(reversed(headers))
+            active_users = list(range(1, num_ues + 1))
+            with open(filepath, 'rb') as file:
+                columns = parse_log_columns(file.read())
+
+            start = time.time()
+            bsr = last_bsr(mac_headers, active_users)
+            former = sum(bsr_list[direct[1]] for direct in bsr)
+            former_time = time.time() - start
+
+            tracker = BsrTracker().watch(start_time)
+            start = time.time()
+            tracker.feed(columns, log_file_date("ue0", filepath), None)
+            fed = time.time()
+            total = tracker.sum_ul_bsr(active_users)
+            queried = time.time()
+            long_bsr = sum(1 for entry in tracker.latest.values() if len(entry[1]) > 1)
+            print(f"[bsr] {num_ues} UEs, {len(mac_headers)} MAC headers: last_bsr {former_time * 1000:.1f} ms, "
+                  f"tracker feed {(fed - start) * 1000:.1f} ms + sum_ul_bsr {(queried - fed) * 1e6:.0f} us; "
+                  f"same indices: {tracker.bsr(active_users) == bsr}, sum_ul_bsr {total} bytes "
+                  f"({long_bsr} users on long BSRs) vs {former} bytes from first indices")
@@ -2,68 +2,53 @@ import sys
 import time
 import numpy as np
 import paramiko
-from statistics import mean
 from .liveness import ue_ip_addresses
-from .logflatten import remote_params
+from .logflatten import ssh_pool
+from .e2estats import user_packet_delays
+from .sketch import user_sketches
+from .probe import ProbeAgent, ssh_agent_runner, ssh_agent_installer
 from .parameters import *
 
 estimated_dl_delay = 15  # in ms
 
+# Probe agent on the Callbox, started at the first round
+probe_agent = ProbeAgent(ssh_agent_runner('mme'), ssh_agent_installer('mme'), offset=estimated_dl_delay)
+
 def log_packet_delays(ips):
+    if probe_backend == "agent":
+        probe_agent.start(ips)
+        return
+
     packet_size = udp_payload
 
     try:
-        # Create an SSH client
-        ssh_client = paramiko.SSHClient()
-
-        _, _, _, remote_host, remote_username, remote_auth_key, _ = remote_params('mme')
-
-        # Load the private key for authentication
-        private_key = paramiko.Ed25519Key(filename=remote_auth_key)
-
-        # Auto-add the remote server's host key (this is insecure, and you should verify the host key in production)
-        ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-
-        # Connect to the remote server
-        ssh_client.connect(remote_host, username=remote_username, pkey=private_key)
+        # Reuse the pooled connection to the Callbox
+        ssh_client = ssh_pool.client('mme')
 
         for ip_address in ips:
             # Execute the remote script in the background
             command = f'/root/rtt.sh {ip_address} {packet_size} > /dev/null 2>&1 &'
             _, _, _ = ssh_client.exec_command(command)
 
-        # Close the SSH connection
-        ssh_client.close()
-
         return
 
     except paramiko.AuthenticationException as auth_exception:
         print(f"Authentication failed: {auth_exception}")
     except paramiko.SSHException as ssh_exception:
         print(f"SSH connection failed: {ssh_exception}")
+        ssh_pool.close('mme')
     except Exception as e:
         print(f"An error occurred: {e}")
-    finally:
-        # Close the SSH connection if it's still open
-        if ssh_client.get_transport() is not None:
-            ssh_client.close()
 
 
 def fetch_packet_delays_and_stop_logging(ip_addresses):
-    try:
-        # Create an SSH client
-        ssh_client = paramiko.SSHClient()
-
-        _, _, _, remote_host, remote_username, remote_auth_key, _ = remote_params('mme')
-
-        # Load the private key for authentication
-        private_key = paramiko.Ed25519Key(filename=remote_auth_key)
+    if probe_backend == "agent":
+        # Delays of the round, as samples or sketches, with a single message
+        return probe_agent.stop(ip_addresses)
 
-        # Auto-add the remote server's host key (this is insecure, and you should verify the host key in production)
-        ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-
-        # Connect to the remote server
-        ssh_client.connect(remote_host, username=remote_username, pkey=private_key)
+    try:
+        # Reuse the pooled connection to the Callbox
+        ssh_client = ssh_pool.client('mme')
 
         # Terminate BS to UE ping
         _, _, _ = ssh_client.exec_command('/usr/bin/killall -15 ping')
@@ -77,9 +62,6 @@ def fetch_packet_delays_and_stop_logging(ip_addresses):
             output = stdout.read().decode().splitlines()
             output_list.append([float(val) - estimated_dl_delay for val in output])
 
-        # Close the SSH connection
-        ssh_client.close()
-
         # Return the RTT delays (list of floats)
         return output_list
 
@@ -87,15 +69,14 @@ def fetch_packet_delays_and_stop_logging(ip_addresses):
         print(f"Authentication failed: {auth_exception}")
     except paramiko.SSHException as ssh_exception:
         print(f"SSH connection failed: {ssh_exception}")
+        ssh_pool.close('mme')
     except Exception as e:
         print(f"An error occurred: {e}")
-    finally:
-        # Close the SSH connection if it's still open
-        if ssh_client.get_transport() is not None:
-            ssh_client.close()
 
 
 def evaluate_qos(packet_delays_lists):
+    # Per user delays are given as lists or as DelaySketch objects; tail
+    # delay is taken from the sketches, within qos_sketch_accuracy
     if not packet_delays_lists:
         print(f"[calculate_reward] No ping responses received, packet delays set to a very high value")
         QoS_metric = round_interval * 1000
@@ -103,16 +84,17 @@ def evaluate_qos(packet_delays_lists):
         return QoS_metric, r
 
     # Per user processing
-    num_of_users = len(packet_delays_lists)
+    sketches = user_sketches(packet_delays_lists)
+    num_of_users = len(sketches)
     user_metrics = []
     for u in range(num_of_users):
-        user_packet_delays = packet_delays_lists[u]
-        if user_packet_delays:
+        user_sketch = sketches[u]
+        if user_sketch.count:
             if desired_QoS == "avg_packet_delay":
-                user_metric = mean(user_packet_delays)
+                user_metric = user_sketch.mean()
                 user_metrics.append(user_metric)
             elif desired_QoS == "tail_packet_delay":
-                user_metric = np.percentile(user_packet_delays, 90)
+                user_metric = user_sketch.quantile(0.9)
                 user_metrics.append(user_metric)
         else:
             print(f"[calculate_reward] No ping responses received for user {u}, packet delays set to a very high value")
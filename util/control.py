@@ -0,0 +1,211 @@
+import sys
+import time
+from .parameters import callbox_ip, uebox_ip, debug_mode, ws_ack_deadline, ws_confirm_deadline, ws_confirm_interval
+from .wsclient import ws_pool
+
+def bandwidth_config(total_rb, first_rb=5, cell="1"):
+    # config_set of a fixed UL allocation of total_rb PRBs from first_rb on
+    return cells_config({cell: (first_rb, total_rb)})
+
+def cells_config(allocations):
+    # config_set of the fixed UL allocations {cell: (first_rb, total_rb)}
+    return {
+        "message": "config_set",
+        "cells": {
+            cell: {
+                "pusch_fixed_rb_alloc": True,
+                "pusch_fixed_rb_start": first_rb,
+                "pusch_fixed_l_crb": total_rb
+            } for cell, (first_rb, total_rb) in allocations.items()
+        }
+    }
+
+def applied_rb(response, cell="1"):
+    # pusch_fixed_l_crb of a config_get response, None if not reported
+    cells = response.get("cells") if isinstance(response, dict) else None
+    if isinstance(cells, dict) and isinstance(cells.get(cell), dict):
+        return cells[cell].get("pusch_fixed_l_crb")
+    return None
+
+class Actuation:
+    # Outcome of a PRB allocation update of a cell, timed from its request
+    def __init__(self, total_rb, cell="1", requested_at=None):
+        self.total_rb = total_rb
+        self.cell = cell
+        self.requested_at = time.time() if requested_at is None else requested_at
+        self.acknowledged = False
+        self.ack_latency = None
+        # True once the Callbox reports the new allocation, False if it
+        # still did not at the deadline, None if it does not report it
+        self.confirmed = None
+        self.applied_rb = None
+        # Seconds until the allocation was confirmed (acknowledged, if it
+        # cannot be confirmed), None if neither happened
+        self.latency = None
+        self.ue_get = None
+        self.status_latency = None
+        self.error = None
+
+    def __str__(self):
+        if self.error:
+            return f"{self.total_rb} PRBs not actuated: {self.error}"
+        state = {True: "confirmed", False: f"not confirmed (Callbox at {self.applied_rb} PRBs)",
+                 None: "acknowledged"}[self.confirmed]
+        latency = f" after {self.latency * 1000:.1f} ms" if self.latency is not None else ""
+        return f"{self.total_rb} PRBs {state}{latency}"
+
+class ControlPlane:
+    # Concurrent actuation and status retrieval over the persistent API
+    # connections: config_set to the Callbox and ue_get to the UEbox are in
+    # flight together, and their acknowledgements are awaited with deadlines
+    def __init__(self, pool=ws_pool, callbox=f"{callbox_ip}:9001", uebox=f"{uebox_ip}:9002",
+                 ack_deadline=ws_ack_deadline, confirm_deadline=ws_confirm_deadline,
+                 confirm_interval=ws_confirm_interval):
+        self.pool = pool
+        self.callbox = callbox
+        self.uebox = uebox
+        self.ack_deadline = ack_deadline
+        self.confirm_deadline = confirm_deadline
+        self.confirm_interval = confirm_interval
+
+    def actuate(self, total_rb, status=False, cell="1", first_rb=5):
+        # Allocate total_rb PRBs and, if status, get the UEs' status at the
+        # same time; return the Actuation, with the ue_get response if any
+        return self.actuate_cells({cell: (first_rb, total_rb)}, status)[0]
+
+    def actuate_cells(self, allocations, status=False):
+        # Apply the allocations {cell: (first_rb, total_rb)} with one
+        # config_set; return an Actuation per cell, in the given order
+        requested_at = time.time()
+        actuations = [Actuation(total_rb, cell, requested_at) for cell, (_, total_rb) in allocations.items()]
+        errors, ue_get, status_latency = None, None, None
+        acknowledged_at = None
+        pending = {}
+        try:
+            pending["config_set"] = self.pool.send(self.callbox, cells_config(allocations))
+        except (OSError, ConnectionError, TimeoutError) as e:
+            errors = f"config_set failed: {e}"
+        if status:
+            try:
+                pending["ue_get"] = self.pool.send(self.uebox, {"message": "ue_get"})
+            except (OSError, ConnectionError, TimeoutError) as e:
+                print(f"[control] ue_get failed: {e}")
+
+        for message, (client, slot) in pending.items():
+            try:
+                response = client.wait(slot, self.ack_deadline)
+            except (ConnectionError, TimeoutError) as e:
+                if message == "config_set":
+                    errors = f"config_set not acknowledged: {e}"
+                else:
+                    print(f"[control] ue_get failed: {e}")
+                continue
+            if message == "ue_get":
+                ue_get, status_latency = response, time.time() - requested_at
+            elif "error" in response:
+                errors = f"config_set refused: {response['error']}"
+            else:
+                acknowledged_at = time.time()
+
+        for actuation in actuations:
+            actuation.error = errors
+            actuation.ue_get = ue_get
+            actuation.status_latency = status_latency
+            if acknowledged_at is not None:
+                actuation.acknowledged = True
+                actuation.ack_latency = acknowledged_at - requested_at
+        if acknowledged_at is not None:
+            self.confirm(actuations)
+        if debug_mode:
+            for actuation in actuations:
+                print(f"[control] Cell {actuation.cell}: {actuation}")
+        return actuations
+
+    def confirm(self, actuations):
+        # Read the allocations back until they are the requested ones or the deadline passes
+        deadline = actuations[0].requested_at + self.confirm_deadline
+        unconfirmed = list(actuations)
+        while unconfirmed:
+            try:
+                response = self.pool.request(self.callbox, {"message": "config_get"},
+                                             max(deadline - time.time(), self.confirm_interval))
+            except (OSError, ConnectionError, TimeoutError) as e:
+                response = None
+                if debug_mode: print(f"[control] config_get failed: {e}")
+            for actuation in list(unconfirmed):
+                reported = applied_rb(response, actuation.cell)
+                if response is not None and reported is None:
+                    # The allocation is not reported back: acknowledged only
+                    actuation.latency = actuation.ack_latency
+                    unconfirmed.remove(actuation)
+                    continue
+                actuation.applied_rb = reported
+                if reported == actuation.total_rb:
+                    actuation.confirmed = True
+                    actuation.latency = time.time() - actuation.requested_at
+                    unconfirmed.remove(actuation)
+            if unconfirmed and time.time() + self.confirm_interval > deadline:
+                for actuation in unconfirmed:
+                    actuation.confirmed = False
+                break
+            if unconfirmed:
+                time.sleep(self.confirm_interval)
+        return actuations
+
+# Control plane of the testbed
+control_plane = ControlPlane()
+
+if __name__ == "__main__":
+    # Time a config_set followed by a ue_get, one after the other as the
+    # rounds did, against both in flight at once, with the new allocation
+    # confirmed; against local stand-ins of the Callbox and the UEbox that
+    # answer after rtt seconds and apply a config_set after apply_delay, e.g.:
+    # python3 -m util.control 0.005 0.05
+    import os
+    import json
+    import statistics
+    from .wsclient import StandInServer, WebSocketPool
+    rtt = float(sys.argv[1]) if len(sys.argv) > 1 else 0.005
+    apply_delay = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ws.out')) as file:
+        output = file.read()
+    ue_get = json.loads(output[output.find('{'):])
+
+    cell = {"pusch_fixed_rb_alloc": True, "pusch_fixed_rb_start": 5, "pusch_fixed_l_crb": 90}
+    scheduled = []  # (time, PRBs) of the config_sets not applied yet
+
+    def config_set(message):
+        scheduled.append((time.time() + apply_delay, message["cells"]["1"]["pusch_fixed_l_crb"]))
+        return {}
+
+    def config_get(message):
+        while scheduled and scheduled[0][0] <= time.time():
+            cell["pusch_fixed_l_crb"] = scheduled.pop(0)[1]
+        return {"cells": {"1": dict(cell)}}
+
+    callbox = StandInServer({"config_set": config_set, "config_get": config_get}, delay=rtt, name="ENB")
+    uebox = StandInServer({"ue_get": ue_get}, delay=rtt)
+    pool = WebSocketPool()
+    control = ControlPlane(pool, callbox.address, uebox.address)
+    control.actuate(90, status=True)
+
+    sequential, concurrent, latencies = [], [], []
+    for total_rb in [10, 25, 50, 75, 90] * 4:
+        start = time.time()
+        pool.request(callbox.address, bandwidth_config(total_rb))
+        pool.request(uebox.address, {"message": "ue_get"})
+        sequential.append(time.time() - start)
+        start = time.time()
+        actuation = control.actuate(100 - total_rb, status=True)
+        concurrent.append(max(actuation.ack_latency, actuation.status_latency))
+        latencies.append(actuation.latency)
+        if not actuation.confirmed or actuation.ue_get is None:
+            print(f"[control] Unexpected outcome: {actuation}")
+    print(f"[control] config_set then ue_get: median {statistics.median(sequential) * 1000:.1f} ms; "
+          f"both in flight: median {statistics.median(concurrent) * 1000:.1f} ms to both acknowledgements")
+    print(f"[control] Allocation in effect after median {statistics.median(latencies) * 1000:.1f} ms, "
+          f"max {max(latencies) * 1000:.1f} ms (apply delay {apply_delay * 1000:.0f} ms, "
+          f"poll interval {control.confirm_interval * 1000:.0f} ms)")
+    pool.close_all()
+    callbox.close()
+    uebox.close()
@@ -1,15 +1,20 @@
 import re
 import time
 import sys
-import random
 import paramiko
 from statistics import mean, stdev
 from datetime import datetime
+from collections import defaultdict
+import numpy as np
 from .logflatten import *
+from .logcolumns import parse_log_columns, LAYER_MAC, DIR_NONE
+from .matcher import PacketMatcher
+from .packets import decode_ip_packets
 from .parameters import *
 
 class BSTree:
-    # binary search (BS) tree
+    # binary search (BS) tree; superseded by matcher.PacketMatcher and
+    # kept as a benchmark baseline
     def __init__(self, value=None):
         self.left = None
         self.right = None
@@ -215,6 +220,7 @@ def log_load(unit, filename):
     return ip_lines, list(reversed(mac_headers))
 
 def parse_ip_packet_cluster(ip_lines):
+    # Superseded by packets.decode_ip_packets(); kept as a benchmark baseline
     # max number of bytes per line is 16
     numFields = 16
     timestamps = []
@@ -255,7 +261,7 @@ def parse_ip_packet_cluster(ip_lines):
 
     return ip_packets
 
-def parse_ue (time_intervals_dt):
+def parse_ue (time_intervals_dt, snapshot=None):
     # Bitwise hex digit concatenation of packet payload
     # Collect data with timestamp >= start_time_str
 
@@ -263,35 +269,28 @@ def parse_ue (time_intervals_dt):
     # start_time = datetime.strptime(start_time_str, "%Y%m%d.%H:%M:%S")
     # print (time_intervals_dt)
     start_time = time.time()
-    ip_lines_clusters, mac_headers = extract_ue_entries_within_intervals(time_intervals_dt)
+    if snapshot is None:
+        ip_lines_clusters, mac_headers = extract_ue_entries_within_intervals(time_intervals_dt)
+    else:
+        consumer = snapshot.register("ue0", IntervalConsumer(time_intervals_dt))
+        snapshot.scan("ue0")
+        ip_lines_clusters, mac_headers = consumer.result()
+        mac_headers = list(reversed(mac_headers))
     end_time = time.time()
     time_taken = end_time - start_time
     if debug_mode: print(f"[e2estats] extract_ue_entries_within_intervals took: {time_taken:.3f} seconds")
     # print (unit + " - " + str(len(ip_lines)))
 
-    # Initialize list of trees as empty list
-    tree_cluster = []
-    packet_windows = []
+    # Index the Tx packets of all windows at once; no trees, no shuffling
     start_time = time.time()
-    for ip_lines in ip_lines_clusters:
-        ip_packets = parse_ip_packet_cluster(ip_lines)
-        random.shuffle(ip_packets)
-        # (i) Use BS tree for Tx packets OR
-        data = BSTree () # AVLTree () #
-        packet_per_cluster = 0
-        for packet in ip_packets:
-            data.insert(packet)
-            packet_per_cluster += 1
-
-        packet_windows.append(packet_per_cluster)
-        tree_cluster.append(data)
+    data_tx = PacketMatcher([decode_ip_packets(ip_lines) for ip_lines in ip_lines_clusters])
     end_time = time.time()
     time_taken = end_time - start_time
-    if debug_mode: print(f"[e2estats] parse_ip_packet_cluster[ue] took: {time_taken:.3f} seconds")
-    if debug_mode: print(f"[e2estats] {len(packet_windows)} samples from Rx logs are sought for amongst their respective amount of packets at Tx logs {packet_windows}")
-    return tree_cluster, mac_headers
+    if debug_mode: print(f"[e2estats] decode_ip_packets[ue] took: {time_taken:.3f} seconds")
+    if debug_mode: print(f"[e2estats] {len(data_tx.window_sizes)} samples from Rx logs are sought for amongst their respective amount of packets at Tx logs {data_tx.window_sizes}")
+    return data_tx, mac_headers
 
-def parse_mme(start_time_str, num_samples):
+def parse_mme(start_time_str, num_samples, snapshot=None, tolerance_seconds=sampling_window/2):
     start_time_dt = datetime.strptime(start_time_str, "%Y%m%d.%H:%M:%S")
     end_time_dt = datetime.now()
 
@@ -301,16 +300,21 @@ def parse_mme(start_time_str, num_samples):
 
     start_time = time.time()
     # Update coarse timestamps with actual ones
-    ip_lines, samples_dt = extract_sample_mme_entries(start_time_dt, samples_dt)
+    if snapshot is None:
+        ip_lines, samples_dt = extract_sample_mme_entries(start_time_dt, samples_dt)
+    else:
+        consumer = snapshot.register("mme", SampleConsumer(samples_dt, tolerance_seconds=tolerance_seconds))
+        snapshot.scan("mme")
+        ip_lines, samples_dt, _ = consumer.result()
     end_time = time.time()
     time_taken = end_time - start_time
     if debug_mode: print(f"[e2estats] extract_sample_mme_entries took: {time_taken:.3f} seconds")
 
     start_time = time.time()
-    ip_packets = parse_ip_packet_cluster(ip_lines)
+    ip_packets = decode_ip_packets(ip_lines)
     end_time = time.time()
     time_taken = end_time - start_time
-    if debug_mode: print(f"[e2estats] parse_ip_packet_cluster[mme] took: {time_taken:.3f} seconds")
+    if debug_mode: print(f"[e2estats] decode_ip_packets[mme] took: {time_taken:.3f} seconds")
 
     time_intervals_dt = [(sample - timedelta(seconds=window_size), sample) for sample in samples_dt]
     random_samples_str = [sample.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3] for sample in samples_dt]
@@ -337,26 +341,50 @@ def parse_bsr (filename, unit, start_time_str):
 def e2e_stats(data_tx, data_rx):
     # Calculate end-to-end delays by searching
     # for received packets in transmitted logs
-    lost_packets = 0
-    e2e_delay = []
-    for i in range(0, len(data_rx)):
-        if not data_tx[i]:
-            lost_packets += 1
-            continue
-        mapper = data_tx[i].find(data_rx[i][0])  # Reversed the roles of data_tx and data_rx
+    matched, delays = data_tx.delays(data_rx)  # Reversed the roles of data_tx and data_rx
+    lost_packets = int(np.count_nonzero(~matched))
 
-        if mapper:
-            tx_time = mapper.value[1]  # Reversed the roles of data_tx and data_rx
-            rx_time = data_rx[i][1]  # Reversed the roles of data_tx and data_rx
-            e2e_delay.append(rx_time - tx_time)
-        else:
-            # for packets not received within a predefined window
-            lost_packets += 1
-            e2e_delay.append(max_delay)
+    # for packets not received within a predefined window
+    e2e_delay = np.where(matched, delays, max_delay).tolist()
 
     print(f'[e2estats] {len(e2e_delay)} packets taken into account for end-to-end delay, of which {lost_packets} are unmatched')
     return lost_packets, e2e_delay
 
+def user_packet_delays(start_time_str, num_samples=qos_sample_budget, snapshot=None, by_user=False):
+    # Ping-free counterpart of fetch_packet_delays_and_stop_logging(): the UL
+    # end-to-end delays (ms) of num_samples packets sampled from the Callbox
+    # log since start_time_str, as one list per UE (by_user: a dict keyed by
+    # UEbox ue_id). A sample is attributed to the UE of its matched Tx packet;
+    # an unmatched one counts as max_delay for the UE its Callbox ue_id is
+    # matched to, or else for an unidentified UE ("mme", Callbox ue_id).
+    if snapshot is None:
+        snapshot = LogSnapshot()
+    tolerance_seconds = round_interval / num_samples / 2
+    start_time = datetime.strptime(start_time_str, "%Y%m%d.%H:%M:%S") - timedelta(seconds=tolerance_seconds)
+    snapshot.prefetch({"mme": start_time, "ue0": start_time - timedelta(milliseconds=max_delay)})
+
+    data_rx, time_intervals_dt = parse_mme(start_time_str, num_samples, snapshot, tolerance_seconds)
+    data_tx, _ = parse_ue(time_intervals_dt, snapshot)
+    matched, delays, tx_ue_ids = data_tx.match(data_rx)
+
+    # Callbox and UEbox number UEs independently; map them by matched packets
+    rx_ue_ids = data_rx[3].tolist()
+    ue_map = {rx_ue_id: tx_ue_id for rx_ue_id, tx_ue_id, found
+              in zip(rx_ue_ids, tx_ue_ids.tolist(), matched.tolist()) if found}
+    delays_per_ue = defaultdict(list)
+    for rx_ue_id, delay, found in zip(rx_ue_ids, delays.tolist(), matched.tolist()):
+        if found:
+            delays_per_ue[ue_map[rx_ue_id]].append(delay)
+        elif rx_ue_id in ue_map:
+            delays_per_ue[ue_map[rx_ue_id]].append(max_delay)
+        else:
+            delays_per_ue[("mme", rx_ue_id)].append(max_delay)
+
+    if debug_mode: snapshot.report()
+    print(f"[e2estats] {len(rx_ue_ids)} sampled packets of {len(delays_per_ue)} users taken into account "
+          f"for end-to-end delay, of which {len(rx_ue_ids) - int(np.count_nonzero(matched))} are unmatched")
+    return dict(delays_per_ue) if by_user else list(delays_per_ue.values())
+
 # Function to extract the timestamp from the line
 def extract_timestamp(line):
     timestamp_str = line.split(' ')[0]
@@ -367,95 +395,60 @@ def calculate_time_difference(timestamp1, timestamp2):
     return (timestamp2 - timestamp1).total_seconds()
 
 def last_bsr(mac_headers, active_users):
-    # define a regex for matching MAC UL/DL BSR logs for active users
-    ue_ids = '|'.join([format(ue_id, '04x') for ue_id in active_users])
-    pattern = r'\[MAC\].*?(DL|UL).*?(' + ue_ids + r').*?b=(\d+)'
+    # MAC header logs are given in decreasing time; parse them in log order
+    lines = (line if line.endswith("\n") else line + "\n" for line in reversed(mac_headers))
+    columns = parse_log_columns("".join(lines).encode())
+    return last_bsr_columns(columns, active_users)
 
+def last_bsr_columns(columns, active_users):
     # Define a list of DL/UL buffer length tuples
-    bsr = [[None, None] for _ in range(len(active_users))]
-
-    # index tuples by directionality
-    dirmap = {"DL": 0, "UL": 1, }
-
-    # Set the threshold time difference in seconds (window size)
-    threshold_seconds = 1
-
-    if mac_headers:
-        # Extract the timestamp from the first line
-        first_timestamp = extract_timestamp(mac_headers[0])
-
-    # traverse the MAC header logs in decreasing time
-    for line in mac_headers:
-        current_timestamp = extract_timestamp(line)
-        time_difference = calculate_time_difference(first_timestamp, current_timestamp)
-        # Loop through the subsequent lines and compare their timestamps
-        if time_difference > threshold_seconds:
-            break
-
-        match = re.search(pattern, line)
-        if match:
-            # Direction is DL/UL or 0/1
-            direction = match.group(1)
-            try:
-                # UE ID is provided by input list active_users
-                ue_id = active_users.index(int(match.group(2), 16))
-                # BSR value is the RHS of b equals
-                bsr_value = int(match.group(3))
-            except ValueError:
-                # Handle the case where the hexadecimal conversion failed
-                continue
-
-            except IndexError:
-                # Handle the case where the value is not found in the active_users list
-                continue
-
-            # update BSR values with the earliest enountered
-            if  bsr[ue_id][dirmap[direction]] is None:
-                bsr[ue_id][dirmap[direction]] = bsr_value
-                # Count the number of missing values (None) in the list
-                if 0 == sum(item.count(None) for item in bsr):
-                    break
-
-    # If after checking all the UL relevant logs, BSR for a user
-    # is not found, assume the user has been recenty inactive, therefore b=0
-    bsr = [[0 if value is None else value for value in user_bsr] for user_bsr in bsr]
-    return bsr
-
-def scp_file(remote_file_path, local_file_path, ssh_key_path, ssh_username, ssh_host):
-    ssh = paramiko.SSHClient()
-    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-
-    # Load the private key
-    private_key = paramiko.Ed25519Key(filename=ssh_key_path)
-
+    bsr = np.zeros((len(active_users), 2), dtype=int)
+
+    # Set the threshold time difference in milliseconds (window size)
+    threshold_ms = 1000
+
+    # MAC UL/DL BSR logs of active users...
+    active = np.array(active_users, dtype=np.int32)
+    mask = (columns.layer == LAYER_MAC) & (columns.direction != DIR_NONE) & \
+           (columns.bsr >= 0) & np.isin(columns.ue_id, active)
+    # ...within the window preceding the most recent log
+    if len(columns):
+        mask &= columns.ts >= columns.ts.max() - threshold_ms
+    records = np.flatnonzero(mask)
+    if not len(records):
+        return bsr.tolist()
+
+    # Position of each record's UE in active_users and its direction (DL/UL or 0/1)
+    sorter = np.argsort(active)
+    users = sorter[np.searchsorted(active, columns.ue_id[records], sorter=sorter)]
+    keys = users * 2 + columns.direction[records]
+
+    # Keep the most recent BSR value per user and direction; if no BSR is
+    # found for a user, assume the user has been recently inactive, i.e., b=0
+    keys, latest = np.unique(keys[::-1], return_index=True)
+    bsr.flat[keys] = columns.bsr[records[::-1][latest]]
+    return bsr.tolist()
+
+def scp_file(unit, remote_file_path, local_file_path):
     try:
-        # Connect to the remote server
-        ssh.connect(hostname=ssh_host, username=ssh_username, pkey=private_key)
-
-        # Create an SFTP client to perform the file transfer
-        sftp = ssh.open_sftp()
+        # Reuse the pooled SFTP session of the unit
+        sftp = ssh_pool.sftp(unit)
 
         # Download the remote file to the local path
         sftp.get(remote_file_path, local_file_path)
 
-        # Close the SFTP connection
-        sftp.close()
-
     except paramiko.AuthenticationException as e:
         print("Authentication failed:", e)
     except paramiko.SSHException as e:
         print("SSH connection failed:", e)
+        ssh_pool.close(unit)
     except Exception as e:
         print("An error occurred:", e)
-    finally:
-        ssh.close()
 
 def fetch_logs(*args):
     local_file_path = [ue_log, enb_log]
     remote_path = ["/tmp/ue.log", "/tmp/mme.log"]
-    ssh_key_path = ["./keys/uebox_ssh_ed25519.txt", "./keys/callbox_ssh_ed25519.txt"]
-    remote_server = [uebox_ip, callbox_ip]
-    username = "root"
+    units = ["ue0", "mme"]
 
     # Create a local "logs" folder
     if not os.path.exists(logs):
@@ -468,19 +461,16 @@ def fetch_logs(*args):
     for value in args:
         if value == "ue":
             print("Fetching UE logs...")
-            scp_file(remote_path[0], local_file_path[0], ssh_key_path[0], username, remote_server[0])
+            scp_file(units[0], remote_path[0], local_file_path[0])
 
         elif value == "mme":
             print("Fetching MME logs...")
-            scp_file(remote_path[1], local_file_path[1], ssh_key_path[1], username, remote_server[1])
+            scp_file(units[1], remote_path[1], local_file_path[1])
 
         else:
             print(f"Invalid argument: '{value}'")
 
 if __name__ == "__main__":
-    # Tree operating functions are recursive
-    # sys.setrecursionlimit(10000)
-
     # fetch_logs("ue", "mme")
     if len(sys.argv) > 1:
         enb_log = f'scenarios/mme-export.{sys.argv[1]}.log'
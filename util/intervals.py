@@ -0,0 +1,85 @@
+import os
+import sys
+import time
+import heapq
+import numpy as np
+from .parameters import max_delay
+from .logscan import LogScanner
+from .logcolumns import parse_log_columns
+
+class IntervalSweep:
+    # Assign time-ordered points (log lines) to (possibly overlapping)
+    # intervals [start, end] by sweeping over both: windows that have started
+    # are taken in through a start pointer into the windows sorted by start,
+    # and dropped from the active set through a heap ordered by their end.
+    # Each point costs amortized O(1 + matches).
+    def __init__(self, intervals):
+        self.starts = [start for start, _ in intervals]
+        self.ends = [end for _, end in intervals]
+        self.order = sorted(range(len(intervals)), key=self.starts.__getitem__)
+        self.next = 0
+        self.expiry = []
+        self.active = set()
+        self.last = None
+
+    def assign(self, point):
+        # Return the indices of the intervals containing point; the returned
+        # set is owned by the sweep and only valid until the next call
+        starts, order = self.starts, self.order
+        while self.next < len(order) and starts[order[self.next]] <= point:
+            index = order[self.next]
+            heapq.heappush(self.expiry, (self.ends[index], index))
+            self.active.add(index)
+            self.next += 1
+        expiry = self.expiry
+        while expiry and expiry[0][0] < point:
+            self.active.discard(heapq.heappop(expiry)[1])
+
+        if self.last is not None and point < self.last:
+            # A slightly out of order line: windows started after it do not
+            # contain it (windows already expired are not brought back)
+            return {index for index in self.active if starts[index] <= point}
+        self.last = point
+        return self.active
+
+def assign_linear(points, intervals):
+    # Former approach: scan all intervals for each point
+    return [[index for index, (start, end) in enumerate(intervals) if start <= point <= end]
+            for point in points]
+
+def assign_masks(points, intervals):
+    # One vectorized mask over all points per interval
+    points = np.asarray(points)
+    assignment = [[] for _ in range(len(points))]
+    for index, (start, end) in enumerate(intervals):
+        for i in np.flatnonzero((points >= start) & (points <= end)):
+            assignment[i].append(index)
+    return assignment
+
+def assign_sweep(points, intervals):
+    sweep = IntervalSweep(intervals)
+    return [sorted(sweep.assign(point)) for point in points]
+
+def sample_intervals(first_ms, last_ms, num_windows, window_ms=max_delay):
+    # Windows of window_ms ending at evenly spaced samples, as in parse_mme()
+    step = (last_ms - first_ms) / (num_windows - 1)
+    return [(first_ms + i * step - window_ms, first_ms + i * step) for i in range(num_windows)]
+
+if __name__ == "__main__":
+    # Compare interval assignment approaches over the lines of a sample log, e.g.:
+    # python3 -m util.intervals logs/ue0.log
+    filepath = sys.argv[1] if len(sys.argv) > 1 else os.path.join('logs', 'ue0.log')
+    with LogScanner(filepath) as scanner:
+        points = parse_log_columns(scanner.read()).ts.tolist()
+    print(f"[intervals] {filepath}: {len(points)} timestamped lines")
+    for num_windows in (51, 500, 5000):
+        intervals = sample_intervals(points[0], points[-1], num_windows)
+        timings = []
+        for name, method in (("linear", assign_linear), ("masks", assign_masks), ("sweep", assign_sweep)):
+            start_time = time.time()
+            assignment = method(points, intervals)
+            timings.append((name, time.time() - start_time, assignment))
+        agree = all(assignment == timings[0][2] for _, _, assignment in timings)
+        matches = sum(len(indices) for indices in timings[0][2])
+        print(f"[intervals] {num_windows} windows, {matches} matches, identical: {agree}; " +
+              ", ".join(f"{name} {elapsed:.3f} s" for name, elapsed, _ in timings))
@@ -0,0 +1,78 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .parameters import overlap_learning
+
+class Learner:
+    # Runs the learning of the rounds (e.g., Slice.learn()) in one worker
+    # thread, in the order it is submitted, while the rounds after them go
+    # on; without overlap, it runs at once. It keeps track of how much of this work was done while
+    # the rounds slept, e.g., in their measurement intervals, i.e., no longer
+    # lengthens the rounds.
+    def __init__(self, overlap=overlap_learning):
+        self.overlap = overlap
+        self.executor = ThreadPoolExecutor(max_workers=1) if overlap else None
+        self.futures = []
+        # (start, end) of the jobs and of the idle intervals, in order
+        self.jobs = []
+        self.windows = []
+        self.waited = 0.0
+
+    def submit(self, function, *args):
+        self.collect()
+
+        def job():
+            start = time.time()
+            try:
+                function(*args)
+            finally:
+                self.jobs.append((start, time.time()))
+
+        if self.overlap:
+            self.futures.append(self.executor.submit(job))
+        else:
+            job()
+
+    def collect(self):
+        # Forget the jobs that are done, raising their exceptions, if any
+        futures, self.futures = self.futures, []
+        for future in futures:
+            if future.done():
+                future.result()
+            else:
+                self.futures.append(future)
+
+    def sleep(self, seconds):
+        # Idle interval of a round, e.g., its measurement interval, while the jobs run
+        start = time.time()
+        time.sleep(seconds)
+        self.windows.append((start, time.time()))
+
+    def wait(self):
+        # Block until all jobs are done, e.g., before the end
+        start = time.time()
+        futures, self.futures = self.futures, []
+        for future in futures:
+            future.result()
+        self.waited += time.time() - start
+
+    def busy(self):
+        return sum(end - start for start, end in self.jobs)
+
+    def reclaimed(self):
+        # Seconds of the jobs within idle intervals (both in order)
+        jobs, windows = list(self.jobs), list(self.windows)
+        total, first = 0.0, 0
+        for job_start, job_end in jobs:
+            while first < len(windows) and windows[first][1] <= job_start:
+                first += 1
+            window = first
+            while window < len(windows) and windows[window][0] < job_end:
+                total += min(job_end, windows[window][1]) - max(job_start, windows[window][0])
+                window += 1
+        return total
+
+    def report(self):
+        busy, reclaimed = self.busy(), self.reclaimed()
+        print(f"[learner] {len(self.jobs)} learning jobs took {busy:.3f} seconds, {reclaimed:.3f} of them "
+              f"({100 * reclaimed / busy if busy else 0:.0f}%) reclaimed from the idle intervals; "
+              f"{self.waited:.3f} seconds waited for them")
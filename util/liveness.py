@@ -1,14 +1,34 @@
+import os
 import re
 import sys
 import json
+import time
 import subprocess
 from .parameters import *
-from .logflatten import get_current_datetime_string, subtract_milliseconds_from_timestamp
-from .e2estats import parse_bsr, last_bsr
-
-def calculate_context():
-    # Obtain the current context
+from datetime import datetime
+from .logflatten import get_current_datetime_string, subtract_milliseconds_from_timestamp, LogSnapshot
+from .e2estats import parse_bsr
+from .bsr import BsrTracker
+from .wsclient import ws_pool
+from .ueregistry import UeRegistry
+from .control import control_plane, cells_config, Actuation
+
+# Latest BSR per UE, kept across rounds
+bsr_tracker = BsrTracker()
+
+# Amarisoft API client of the "node" backend, wherever the process runs from
+ws_js = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ws.js")
+
+def calculate_context(users=None, scan=True):
+    # Obtain the current context. With users (e.g., the ue_ids of a slice),
+    # only these UEs are taken into account; without scan, the BSRs already
+    # tracked (e.g., for another slice, or by the previous round's log
+    # snapshot) are used as they are instead of fetching the UEbox log again.
     ue_list, mcs, active_users, num_alive_users = liveness(for_real)
+    if users is not None:
+        mcs = [mcs[i] for i, (ue_id, _, _) in enumerate(ue_list) if ue_id in users]
+        active_users = [ue_id for ue_id in active_users if ue_id in users]
+        num_alive_users = sum(1 for ue_id in ue_status.get(for_real).alive_users if ue_id in users)
 
     # Extract Uplink MCS and find average over users
     ul_mcs = [x[1] for x in mcs if x[1] is not None]
@@ -32,16 +52,19 @@ def calculate_context():
     # print(f"Calculating context using packets with timestamps from [{starting_buffer_time}] to [{starting_time}].")
 
     # should we look to get enough data for context calculation?
-    mac_headers = parse_bsr(ue_log, "ue0", starting_buffer_time)
-
-    # Get the BSR indices per user per direction (DL/UL)
-    bsr = last_bsr(mac_headers, active_users)
-
-    # Find the BSR values in bytes using the b values from the logs
-    ul_bsr = [bsr_list[direct[1]] for direct in bsr]
+    if not scan:
+        pass
+    elif oldStyle:
+        bsr_tracker.feed_headers(parse_bsr(ue_log, "ue0", starting_buffer_time))
+    else:
+        # Update the BSR of the users from the UEbox log records of the last second
+        snapshot = LogSnapshot()
+        snapshot.register("ue0", bsr_tracker.watch(datetime.strptime(starting_buffer_time, "%Y%m%d.%H:%M:%S")))
+        snapshot.scan("ue0")
 
-    # Sum the BSR values in bytes from the list above
-    sum_ul_bsr = sum(ul_bsr)
+    # Sum the BSR values in bytes of the active users (all logical
+    # channel groups of long BSRs included)
+    sum_ul_bsr = bsr_tracker.sum_ul_bsr(active_users)
 
     # Find the index of the above sum's closest value
     sum_ul_bsr_idx = min(range(len(bsr_list)), key=lambda i: abs(bsr_list[i] - sum_ul_bsr))
@@ -53,6 +76,14 @@ def calculate_context():
 
 
 def run_ws_command(node_command, node_util, ip_address, config_json_str):
+    if ws_backend == "python":
+        # Same JSON as util/ws.js prints, over the persistent connection
+        try:
+            response = ws_pool.request(ip_address, json.loads(config_json_str))
+            return json.dumps(response, indent=4)
+        except (OSError, ConnectionError, TimeoutError) as e:
+            print(f"Error calling the Amarisoft API at {ip_address}: {e}")
+            return None
     try:
         # Run the Node.js command and capture the output
         completed_process = subprocess.run(
@@ -70,33 +101,42 @@ def run_ws_command(node_command, node_util, ip_address, config_json_str):
         return None
 
 
-def ws_set_bandwidth(total_rb):
-    # Selected arm is mapped to total_rb
+def ws_set_bandwidth(total_rb, refresh_status=False, cell="1", first_rb=5):
+    # Selected arm is mapped to total_rb PRBs of the cell from first_rb on;
+    # with refresh_status, the status of the UEs is retrieved at the same
+    # time. Return the Actuation.
+    return ws_set_cells({cell: (first_rb, total_rb)}, refresh_status)[0]
 
-    # Assign a value to first_rb
-    first_rb = 5
 
-    # Create a JSON object with the required configuration
-    config_json = {
-        "message": "config_set",
-        "cells": {
-            "1": {
-                "pusch_fixed_rb_alloc": True,
-                "pusch_fixed_rb_start": first_rb,
-                "pusch_fixed_l_crb": total_rb
-            }
-        }
-    }
+def ws_set_cells(allocations, refresh_status=False, control=control_plane):
+    # Apply the allocations {cell: (first_rb, total_rb)} of several cells
+    # (e.g., slices) with one config_set, over the ws_backend API client;
+    # return an Actuation per cell, in the given order
+    if ws_backend == "python":
+        actuations = control.actuate_cells(allocations, status=refresh_status)
+        if actuations[0].ue_get is not None:
+            ue_status.update(actuations[0].ue_get)
+        for actuation in actuations:
+            if actuation.error or actuation.confirmed is False:
+                print(f"[liveness] Bandwidth update of cell {actuation.cell}: {actuation}")
+        return actuations
 
     # Convert the JSON object to a string
-    config_json_str = json.dumps(config_json)
+    config_json_str = json.dumps(cells_config(allocations))
 
     # Execute the command through the Amarisoft API
-    ip_address = f"{callbox_ip}:9001"
+    requested_at = time.time()
+    actuations = [Actuation(total_rb, cell, requested_at) for cell, (_, total_rb) in allocations.items()]
+    ip_address = control.callbox
     node_command = "/usr/bin/node"
-    node_util = "util/ws.js"
+    node_util = ws_js
     node_output = run_ws_command(node_command, node_util, ip_address, config_json_str)
     if debug_mode: print(f"[liveness] The output of the util/ws.js is: {node_output}")
+    if node_output is not None:
+        for actuation in actuations:
+            actuation.acknowledged = True
+            actuation.ack_latency = actuation.latency = time.time() - requested_at
+    return actuations
 
 
 def ws_get_user_status(for_real4=True):
@@ -119,86 +159,177 @@ def ws_get_user_status(for_real4=True):
         config_json_str = json.dumps(config_json)
 
         # Execute the command through the Amarisoft API
-        ip_address = f"{uebox_ip}:9002"
+        ip_address = control_plane.uebox
         node_command = "/usr/bin/node"
-        node_util = "util/ws.js"
+        node_util = ws_js
         node_output = run_ws_command(node_command, node_util, ip_address, config_json_str)
 
     return node_output
 
 
-def liveness(for_real1):
-    node_output = ws_get_user_status(for_real1)
-    mcs = []
-    ue_list = []
-    active_users = []
-    num_alive_users = 0
-    if node_output is not None:
+class UeSnapshot:
+    # One ue_get of the UEbox, parsed once into what the round needs
+    def __init__(self, for_real=True):
+        self.for_real = for_real
+        self.fetched_at = time.time()
+        # (ue_id, rrc_state, per-cell CQIs) and (DL MCS, UL MCS) per UE
+        self.ue_list = []
+        self.mcs = []
+        self.active_users = []
+        self.num_alive_users = 0
+        self.alive_users = []
+        # IPv4 addresses of the connected UEs, and by ue_id
+        self.ip_addresses = []
+        self.user_ips = {}
+
+    @classmethod
+    def parse(cls, node_output, for_real=True):
+        snapshot = cls(for_real)
+        if node_output is None:
+            return snapshot
         # Find the index of the first opening curly bracket in the output
         json_start_index = node_output.find('{')
-        if json_start_index != -1:
-            # Extract the JSON substring from the output
-            json_data_str = node_output[json_start_index:]
-
+        if json_start_index == -1:
+            return snapshot
+        pdn_lists = []
+        try:
+            json_data = json.loads(node_output[json_start_index:])
+            for ue in json_data['ue_list']:
+                snapshot.ue_list.append((ue['ue_id'], ue['rrc_state'], [cell['cqi'] for cell in ue['cells']]))
+                if ue['emm_state'] != 'power off':
+                    # count alive users
+                    snapshot.num_alive_users += 1
+                    snapshot.alive_users.append(ue['ue_id'])
+                snapshot.mcs.append((ue.get('dl_mcs', None), ue.get('ul_mcs', None)))
+                if ue['rrc_state'] == 'connected':
+                    pdn_lists.append((ue['ue_id'], ue.get("pdn_list")))
+        except json.JSONDecodeError as e:
+            print(f"Error decoding JSON: {e}")
+        except KeyError as e:
+            print(f"KeyError: {e}")
+        try:
+            # Extract the IP address from each of the active users
+            for ue_id, pdn_list in pdn_lists:
+                snapshot.user_ips[ue_id] = pdn_list[0]["ipv4"]
+        except (KeyError, TypeError) as e:
+            print(f"No IP address of a connected UE: {e}")
+        snapshot.ip_addresses = list(snapshot.user_ips.values())
+        # Find the active UE IDs
+        snapshot.active_users = [t[0] for t in snapshot.ue_list if t[1] == 'connected']
+        return snapshot
+
+    @classmethod
+    def from_registry(cls, registry, for_real=True):
+        snapshot = cls(for_real)
+        snapshot.ue_list, snapshot.mcs, snapshot.active_users, snapshot.alive_users, \
+            snapshot.user_ips = registry.view()
+        snapshot.num_alive_users = len(snapshot.alive_users)
+        snapshot.ip_addresses = list(snapshot.user_ips.values())
+        snapshot.version = registry.version
+        return snapshot
+
+    def age(self):
+        return time.time() - self.fetched_at
+
+class UeStatus:
+    # Latest UE snapshot, fetched at most once per ttl seconds. Over the
+    # persistent API connection, ue_get results update the UE registry as
+    # diffs and its event notifications are applied in between.
+    def __init__(self, ttl=ue_status_ttl):
+        self.ttl = ttl
+        self.snapshot = None
+        self.registry = UeRegistry()
+        # Whether to register for UE events; cleared once the UEbox refuses
+        self.events = ue_events
+        self.registered_connection = None
+        self.fetches = 0
+        self.reuses = 0
+
+    def subscribe(self, ip_address):
+        # (Re)register for UE events after every (re)connection
+        client = ws_pool.client(ip_address)
+        if not self.events or self.registered_connection == (client, client.connects):
+            return
+        if self.registered_connection is None:
+            client.add_listener(self.registry.notify)
+        self.registered_connection = (client, client.connects)
+        try:
+            response = ws_pool.request(ip_address, ue_event_registration)
+        except (OSError, ConnectionError, TimeoutError) as e:
+            # Retried after the next reconnection
+            print(f"[liveness] Warning: UE event registration failed, polling ue_get meanwhile: {e}")
+            return
+        if 'error' in response:
+            # The UEbox does not know the registration message: poll from now on
+            self.events = False
+            print(f"[liveness] Warning: UE event registration refused, polling ue_get only: {response['error']}")
+
+    def fetch(self, for_real):
+        # Snapshot of a new ue_get, None if it failed
+        if for_real and ws_backend == "python":
+            ip_address = control_plane.uebox
             try:
-                # Parse the JSON output and store the JSON
-                # data in a Python variable as a dictionary.
-                json_data = json.loads(json_data_str)
-
-                for ue in json_data['ue_list']:
-                    cells_cqi = []
-                    cells_list = ue['cells']
-                    for cell in cells_list:
-                        cells_cqi.append(cell['cqi'])
-                    ue_info = (ue['ue_id'], ue['rrc_state'], cells_cqi)
-                    ue_list.append(ue_info)
-                    if ue['emm_state'] != 'power off':
-                        # count alive users
-                        num_alive_users += 1
-
-                    dl_mcs = ue.get('dl_mcs', None)
-                    ul_mcs = ue.get('ul_mcs', None)
-                    mcs.append((dl_mcs, ul_mcs))
-
-                # Find the active UE IDs
-                active_users = [t[0] for t in ue_list if t[1] == 'connected']
-
-            except json.JSONDecodeError as e:
-                print(f"Error decoding JSON: {e}")
-            except KeyError as e:
-                print(f"KeyError: {e}")
+                response = ws_pool.request(ip_address, {"message": "ue_get"})
+            except (OSError, ConnectionError, TimeoutError) as e:
+                print(f"Error calling the Amarisoft API at {ip_address}: {e}")
+                return None
+            return self.apply(response)
+        node_output = ws_get_user_status(for_real)
+        return UeSnapshot.parse(node_output, for_real) if node_output is not None else None
+
+    def apply(self, response):
+        # Snapshot of a ue_get response of the UEbox, None if malformed
+        try:
+            self.registry.apply(response['ue_list'])
+        except KeyError as e:
+            print(f"KeyError: {e}")
+            return None
+        self.subscribe(control_plane.uebox)
+        return UeSnapshot.from_registry(self.registry)
+
+    def update(self, response):
+        # Take a ue_get response obtained otherwise, e.g., during actuation
+        snapshot = self.apply(response)
+        if snapshot is not None:
+            self.snapshot = snapshot
+            self.fetches += 1
+
+    def get(self, for_real=True):
+        snapshot = self.snapshot
+        if snapshot is not None and snapshot.for_real == for_real and snapshot.age() <= self.ttl:
+            self.reuses += 1
+            if getattr(snapshot, 'version', self.registry.version) != self.registry.version:
+                # Events changed the UEs since the poll: a newer view
+                self.snapshot = snapshot = UeSnapshot.from_registry(self.registry, for_real)
+            return snapshot
+        snapshot = self.fetch(for_real)
+        self.fetches += 1
+        # Failed fetches are retried at the next call
+        self.snapshot = snapshot
+        if snapshot is None:
+            return UeSnapshot(for_real)
+        if debug_mode: print(f"[liveness] Fetched the status of {len(snapshot.ue_list)} UEs")
+        return snapshot
+
+    def age(self):
+        # Seconds since the snapshot in use was fetched, None if none
+        return self.snapshot.age() if self.snapshot is not None else None
+
+    def invalidate(self):
+        self.snapshot = None
+
+# UE status shared by the context and the probing of a round
+ue_status = UeStatus()
 
+def liveness(for_real1):
+    snapshot = ue_status.get(for_real1)
     # note that a user may be alive, but idle
-    return ue_list, mcs, active_users, num_alive_users
+    return snapshot.ue_list, snapshot.mcs, snapshot.active_users, snapshot.num_alive_users
 
 
 def ue_ip_addresses(for_real2):
-    node_output = ws_get_user_status(for_real2)
-    ue_ip = []
-    if node_output is not None:
-        # Find the index of the first opening curly bracket in the output
-        json_start_index = node_output.find('{')
-        if json_start_index != -1:
-            # Extract the JSON substring from the output
-            json_data_str = node_output[json_start_index:]
-
-            try:
-                # Parse the JSON output and store the JSON
-                # data in a Python variable as a dictionary.
-                json_data = json.loads(json_data_str)
-
-                # Extract the IP address from each of the active users
-                for ue in json_data['ue_list']:
-                    if ue['rrc_state'] == 'connected':
-                        ue_ip.append(ue["pdn_list"][0]["ipv4"])
-
-            except json.JSONDecodeError as e:
-                print(f"Error decoding JSON: {e}")
-            except KeyError as e:
-                print(f"KeyError: {e}")
-
     # note that a user may be alive, but idle
-    return ue_ip
+    return ue_status.get(for_real2).ip_addresses
 
 
 if __name__ == "__main__":
@@ -0,0 +1,169 @@
+import os
+import sys
+import json
+import time
+import tempfile
+import subprocess
+from datetime import timedelta
+from .parameters import num_samples, max_delay
+
+# Parsing stages, each run in a process of its own for its peak RSS
+stages = ["log_load", "extract_ue_entries_from_file", "extract_mme_entries_from_file",
+          "extract_entries_from_file", "parse_ip_packet_cluster", "decode_ip_packets",
+          "last_bsr", "e2e_stats", "user_packet_delays"]
+
+# Throughput drop beyond which a stage is reported as a regression
+regression_threshold = 0.2
+
+def sample_windows(start_time, end_time):
+    # Sample times and Tx windows over the logs, as in parse_mme()
+    time_delta = (end_time - start_time) / (num_samples - 1)
+    samples = [start_time + i * time_delta for i in range(num_samples)]
+    return samples, [(sample - timedelta(milliseconds=max_delay), sample) for sample in samples]
+
+def run_stage(stage, meta):
+    # Run a stage on the logs described by meta, after its (untimed) inputs;
+    # return its duration and the number of items it produced
+    from datetime import datetime
+    from .e2estats import log_load, parse_ip_packet_cluster, last_bsr, e2e_stats, parse_mme, parse_ue, \
+        user_packet_delays
+    from .logflatten import extract_ue_entries_from_file, extract_mme_entries_from_file, \
+        extract_entries_from_file, LogSnapshot
+    from .packets import decode_ip_packets
+    ue_log, mme_log = meta["paths"]["ue0"][-1], meta["paths"]["mme"][-1]
+    start_time, end_time = (datetime.fromisoformat(value) for value in meta["span"])
+    samples, windows = sample_windows(start_time, end_time)
+
+    def snapshot():
+        snapshot = LogSnapshot()
+        snapshot.use_logs("ue0", meta["paths"]["ue0"])
+        snapshot.use_logs("mme", meta["paths"]["mme"])
+        return snapshot
+
+    if stage in ("parse_ip_packet_cluster", "decode_ip_packets"):
+        ip_lines, _ = log_load("ue0", ue_log)
+    elif stage == "last_bsr":
+        _, mac_headers = extract_entries_from_file("ue0", ue_log, start_time, None)
+        mac_headers = list(reversed(mac_headers))
+    elif stage == "e2e_stats":
+        start_time_str = start_time.strftime("%Y%m%d.%H:%M:%S")
+        shared = snapshot()
+        data_rx, time_intervals_dt = parse_mme(start_time_str, num_samples, shared)
+        data_tx, _ = parse_ue(time_intervals_dt, shared)
+
+    start = time.time()
+    if stage == "log_load":
+        ip_lines, mac_headers = log_load("ue0", ue_log)
+        items = len(ip_lines) + len(mac_headers)
+    elif stage == "extract_ue_entries_from_file":
+        clusters, mac_headers = extract_ue_entries_from_file("ue0", ue_log, windows)
+        items = sum(map(len, clusters)) + len(mac_headers)
+    elif stage == "extract_mme_entries_from_file":
+        ip_lines, _, _ = extract_mme_entries_from_file("mme", mme_log, samples, 0)
+        items = len(ip_lines)
+    elif stage == "extract_entries_from_file":
+        ip_lines, mac_headers = extract_entries_from_file("ue0", ue_log, start_time, None)
+        items = len(ip_lines) + len(mac_headers)
+    elif stage == "parse_ip_packet_cluster":
+        items = len(parse_ip_packet_cluster(ip_lines))
+    elif stage == "decode_ip_packets":
+        items = len(decode_ip_packets(ip_lines)[1])
+    elif stage == "last_bsr":
+        last_bsr(mac_headers, list(range(1, meta["num_ues"] + 1)))
+        items = len(mac_headers)
+    elif stage == "e2e_stats":
+        items = len(e2e_stats(data_tx, data_rx)[1])
+    elif stage == "user_packet_delays":
+        items = sum(map(len, user_packet_delays(start_time.strftime("%Y%m%d.%H:%M:%S"), num_samples, snapshot())))
+    else:
+        raise ValueError(f"Unknown stage: {stage}")
+    return time.time() - start, items
+
+def measure(stage, meta_path):
+    # Run a stage in a child process; return its duration, items and peak RSS
+    process = subprocess.Popen([sys.executable, "-m", "util.logbench", "--stage", stage, meta_path],
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                               cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    output = process.stdout.read()
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = status
+    if status:
+        return None
+    result = json.loads(output.decode().strip().splitlines()[-1])
+    return result["seconds"], result["items"], usage.ru_maxrss * 1024
+
+def benchmark(size_mb, directory, num_ues=10, packet_rate=50):
+    # Generate UEbox/Callbox logs of about size_mb MB and measure every stage
+    from .loggen import write_log_pair
+    start = time.time()
+    paths, (start_time, end_time), packets, _ = write_log_pair(directory, num_ues, packet_rate,
+                                                               target_bytes=size_mb * 1024**2)
+    log_bytes = os.path.getsize(paths["ue0"][-1])
+    print(f"[logbench] {size_mb} MB: {log_bytes / 1e6:.1f} MB UEbox and {os.path.getsize(paths['mme'][-1]) / 1e6:.1f} MB "
+          f"Callbox logs of {num_ues} UEs, {packets} packets over {end_time - start_time}, "
+          f"generated in {time.time() - start:.1f} seconds")
+    meta_path = os.path.join(directory, "meta.json")
+    with open(meta_path, "w") as file:
+        json.dump({"paths": paths, "span": [start_time.isoformat(), end_time.isoformat()],
+                   "num_ues": num_ues}, file)
+
+    results = {}
+    for stage in stages:
+        measured = measure(stage, meta_path)
+        if measured is None:
+            print(f"[logbench]   {stage:32s} failed")
+            continue
+        seconds, items, peak_rss = measured
+        results[stage] = {"seconds": seconds, "items": items, "peak_rss": peak_rss,
+                          "throughput": log_bytes / max(seconds, 1e-9)}
+        print(f"[logbench]   {stage:32s} {seconds:8.3f} s {log_bytes / 1e6 / max(seconds, 1e-9):9.1f} MB/s "
+              f"{items:10d} items, peak RSS {peak_rss / 1e6:8.1f} MB")
+    for path in paths["ue0"] + paths["mme"]:
+        os.remove(path)
+    return results
+
+def compare(results, baseline):
+    # Report the stages whose throughput dropped by more than regression_threshold
+    regressions = []
+    for size, stage_results in results.items():
+        for stage, result in stage_results.items():
+            previous = baseline.get(size, {}).get(stage)
+            if previous and result["throughput"] < (1 - regression_threshold) * previous["throughput"]:
+                regressions.append(f"{stage} at {size} MB: {previous['throughput'] / 1e6:.1f} -> "
+                                   f"{result['throughput'] / 1e6:.1f} MB/s")
+    for regression in regressions:
+        print(f"[logbench] Regression: {regression}")
+    print(f"[logbench] {len(regressions)} regressions against the baseline")
+    return regressions
+
+if __name__ == "__main__":
+    # Time every parsing stage over synthetic logs of 1 MB up to 1 GB, e.g.:
+    # python3 -m util.logbench 1 10 100 1000 --save bench.json
+    # The 1 GB tier takes about 5 minutes and last_bsr needs more than 6 GB
+    # of memory there (it reads the whole log at once), otherwise it fails
+    # python3 -m util.logbench 1 10 100 --compare bench.json
+    arguments = sys.argv[1:]
+    if arguments[:1] == ["--stage"]:
+        with open(arguments[2]) as file:
+            seconds, items = run_stage(arguments[1], json.load(file))
+        print(json.dumps({"seconds": seconds, "items": items}))
+        sys.exit(0)
+
+    options = {}
+    for option in ("--save", "--compare"):
+        if option in arguments:
+            index = arguments.index(option)
+            options[option] = arguments[index + 1]
+            del arguments[index:index + 2]
+    sizes = [int(size) for size in arguments] or [1, 10, 100]
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            results[str(size)] = benchmark(size, directory)
+    if "--save" in options:
+        with open(options["--save"], "w") as file:
+            json.dump(results, file, indent=1)
+    if "--compare" in options:
+        with open(options["--compare"]) as file:
+            failed = compare(results, json.load(file))
+        sys.exit(1 if failed else 0)
@@ -0,0 +1,111 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+from .parameters import debug_mode
+from .logindex import discard_log_index, index_directories
+
+# Bookkeeping of the cached logs, stored in the cache directory
+manifest_name = 'manifest.json'
+
+class LogCache:
+    # Local cache of rotated (immutable) remote logs. A log is stored once per
+    # (unit, remote name, size, mtime) at <directory>/<digest>/<name>, so it
+    # keeps its name (and calendar date) and its index sidecar lives next to
+    # it. Least recently used logs are evicted to stay within budget bytes.
+    def __init__(self, directory, budget):
+        self.directory = directory
+        self.budget = budget
+        # The cached logs are ours, so their indexes are persisted
+        index_directories.add(directory)
+        self.manifest_path = os.path.join(directory, manifest_name)
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.bytes_fetched = 0
+        # Logs may be fetched from several threads at once
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        # Reuse the logs cached by previous runs, as long as they are intact
+        try:
+            with open(self.manifest_path) as file:
+                entries = json.load(file)
+        except (OSError, ValueError):
+            entries = {}
+        self.entries = {digest: entry for digest, entry in entries.items()
+                        if os.path.isfile(self.path(digest, entry['name'])) and
+                        os.path.getsize(self.path(digest, entry['name'])) == entry['size']}
+
+    def save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        temporary_path = self.manifest_path + '.tmp'
+        with open(temporary_path, 'w') as file:
+            json.dump(self.entries, file)
+        os.replace(temporary_path, self.manifest_path)
+
+    def key(self, unit, name, size, mtime):
+        return hashlib.sha1(f"{unit}:{name}:{size}:{int(mtime)}".encode()).hexdigest()
+
+    def path(self, digest, name):
+        return os.path.join(self.directory, digest, name)
+
+    def get(self, unit, name, size, mtime, download):
+        # Return the local path of the remote log, calling download(local_path)
+        # to transfer it only if it is not cached yet
+        digest = self.key(unit, name, size, mtime)
+        local_path = self.path(digest, name)
+        with self.lock:
+            if digest in self.entries:
+                self.hits += 1
+                self.bytes_saved += size
+                self.use(digest)
+                return local_path
+
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        # Download next to the final path, so that a partial transfer
+        # is never mistaken for a cached log
+        temporary_path = local_path + '.part'
+        download(temporary_path)
+        os.replace(temporary_path, local_path)
+        with self.lock:
+            self.misses += 1
+            self.bytes_fetched += size
+            self.entries[digest] = {'unit': unit, 'name': name, 'size': size, 'mtime': int(mtime)}
+            self.use(digest)
+        return local_path
+
+    def use(self, digest):
+        # Mark a log as most recently used and make room for it
+        self.entries[digest]['used'] = time.time()
+        self.evict(keep=digest)
+        self.save()
+
+    def size(self):
+        return sum(entry['size'] for entry in self.entries.values())
+
+    def evict(self, keep=None):
+        # Drop least recently used logs (except keep) while over budget
+        total = self.size()
+        for digest in sorted(self.entries, key=lambda digest: self.entries[digest].get('used', 0)):
+            if total <= self.budget:
+                break
+            if digest == keep:
+                continue
+            entry = self.entries.pop(digest)
+            local_path = self.path(digest, entry['name'])
+            discard_log_index(local_path)
+            shutil.rmtree(os.path.dirname(local_path), ignore_errors=True)
+            total -= entry['size']
+            if debug_mode: print(f"[logcache] Evicted {entry['name']} ({entry['size']} bytes)")
+
+    def stats(self):
+        return self.hits, self.misses, self.bytes_saved, self.bytes_fetched
+
+    def report(self):
+        print(f"[logcache] {self.hits} hits, {self.misses} misses, {self.bytes_saved} bytes saved, "
+              f"{self.bytes_fetched} bytes fetched, {self.size()} of {self.budget} bytes cached")
@@ -0,0 +1,173 @@
+import re
+import numpy as np
+
+# Log file format:
+# time layer dir ue_id {cell_id rnti sfn channel:} message
+# e.g. 21:14:33.931 [MAC] UL 0001 00 SBSR: lcg=3 b=0 LCID:3 len=2923 PAD: len=3188
+
+# Layer enum; unknown layers map to LAYER_OTHER
+layer_names = ["OTHER", "PHY", "MAC", "RLC", "PDCP", "RRC", "NAS", "IP", "S1AP", "NGAP", "GTPU", "X2AP", "XNAP"]
+LAYER_OTHER = 0
+LAYER_MAC = layer_names.index("MAC")
+LAYER_IP = layer_names.index("IP")
+
+# Direction enum, same convention as the DL/UL BSR tuples of last_bsr()
+DIR_NONE = -1
+DIR_DL = 0
+DIR_UL = 1
+
+# Layers are told apart by their first two letters
+layer_table = np.zeros(1 << 16, dtype=np.int8)
+for code, name in enumerate(layer_names[1:], start=1):
+    layer_table[ord(name[0]) << 8 | ord(name[1])] = code
+
+# Value of each hex digit, -1 for any other byte
+hex_table = np.full(256, -1, dtype=np.int32)
+for digit in b"0123456789":
+    hex_table[digit] = digit - ord("0")
+for digit in b"abcdef":
+    hex_table[digit] = digit - ord("a") + 10
+    hex_table[digit - 32] = digit - ord("a") + 10
+
+# Fields parsed out of the message part of header lines
+bsr_pattern = re.compile(rb' b=(\d+)')
+len_pattern = re.compile(rb' len=(\d+)')
+comment_bytes_pattern = re.compile(rb'^\s*(?:#.*)?$')
+
+ms_per_day = 24 * 3600 * 1000
+
+class LogColumns:
+    # Columnar view of the timestamped (header) lines of a log chunk. Record i
+    # is described by parallel arrays; its header line is buf[start[i]:end[i]]
+    # and its payload (continuation) lines are buf[payload_start[i]:payload_end[i]].
+    # Timestamps are milliseconds from the start of the log's day; day_offset
+    # is the start of the day of the first record, in the same milliseconds
+    def __init__(self, buf, start, end, ts, layer, direction, ue_id, bsr, length, payload_end, day_offset=0):
+        self.buf = buf
+        self.day_offset = day_offset
+        self.start = start
+        self.end = end
+        self.ts = ts
+        self.layer = layer
+        self.direction = direction
+        self.ue_id = ue_id
+        self.bsr = bsr
+        self.length = length
+        self.payload_start = np.minimum(end + 1, len(buf))
+        self.payload_end = payload_end
+
+    def __len__(self):
+        return len(self.ts)
+
+    def header(self, i):
+        # Header line of record i, newline included
+        return self.buf[self.start[i]:self.payload_start[i]].decode()
+
+    def payload_lines(self, i):
+        # Non-comment payload lines of record i, newlines included
+        payload = self.buf[self.payload_start[i]:self.payload_end[i]]
+        return [line.decode() for line in payload.splitlines(keepends=True)
+                if not comment_bytes_pattern.match(line)]
+
+    def field_positions(self, pattern):
+        # Record index and match of the first occurrence of pattern
+        # within each header line
+        matches = list(pattern.finditer(self.buf))
+        positions = np.fromiter((match.start() for match in matches), dtype=np.int64, count=len(matches))
+        records = np.searchsorted(self.start, positions, side='right') - 1
+        valid = (records >= 0) & (positions < self.end[np.maximum(records, 0)])
+        records, first = np.unique(records[valid], return_index=True)
+        return records, [matches[k] for k in np.flatnonzero(valid)[first]]
+
+    def contains(self, marker):
+        # Mask of the records whose header line contains marker
+        mask = np.zeros(len(self), dtype=bool)
+        records, _ = self.field_positions(re.compile(re.escape(marker)))
+        mask[records] = True
+        return mask
+
+    def within(self, start_ms, end_ms=None):
+        # Mask of the records timestamped within [start_ms, end_ms]
+        mask = self.ts >= start_ms
+        if end_ms is not None:
+            mask &= self.ts <= end_ms
+        return mask
+
+def parse_log_columns(buf, reference_ms=None):
+    # Parse a chunk of an Amarisoft log into a LogColumns; timestamps are
+    # milliseconds from the start of the log's day. reference_ms is the time
+    # of a line at most half a day before the chunk's first record, in the
+    # same milliseconds, e.g., that of the log's index entry before the chunk;
+    # it tells the day of the first record, the log's day if not given
+    data = np.frombuffer(buf, dtype=np.uint8)
+    size = len(data)
+
+    def peek(positions):
+        # Bytes at the given positions (clipped to the chunk)
+        return data[np.minimum(positions, size - 1)].astype(np.int64)
+
+    # Line boundaries (end excludes the newline)
+    newlines = np.flatnonzero(data == ord('\n'))
+    starts = np.concatenate(([0], newlines + 1)).astype(np.int64)
+    ends = np.concatenate((newlines, [size])).astype(np.int64)
+    nonempty = starts < ends
+    starts, ends = starts[nonempty], ends[nonempty]
+
+    # Header lines start with "HH:MM:SS.mmm [" and are long enough for layer and ue_id
+    long_enough = ends - starts >= 16
+    starts, ends = starts[long_enough], ends[long_enough]
+    header = np.ones(len(starts), dtype=bool)
+    digits = {}
+    for k in (0, 1, 3, 4, 6, 7, 9, 10, 11):
+        digits[k] = peek(starts + k) - ord('0')
+        header &= (digits[k] >= 0) & (digits[k] <= 9)
+    header &= (peek(starts + 2) == ord(':')) & (peek(starts + 5) == ord(':')) & (peek(starts + 8) == ord('.'))
+    header &= (peek(starts + 12) == ord(' ')) & (peek(starts + 13) == ord('['))
+    starts, ends = starts[header], ends[header]
+    digits = {k: value[header] for k, value in digits.items()}
+
+    # Timestamps, computed arithmetically; Amarisoft timestamps wrap around at midnight
+    ts = ((((digits[0] * 10 + digits[1]) * 60 + digits[3] * 10 + digits[4]) * 60 +
+           digits[6] * 10 + digits[7]) * 1000 + digits[9] * 100 + digits[10] * 10 + digits[11])
+    wraps = np.concatenate(([0], np.diff(ts) < -ms_per_day // 2))
+    day_offset = 0
+    if reference_ms is not None and len(ts):
+        day_offset = reference_ms // ms_per_day * ms_per_day
+        if ts[0] + day_offset < reference_ms - ms_per_day // 2:
+            # The chunk starts past the midnight after the reference
+            day_offset += ms_per_day
+    ts = ts + np.cumsum(wraps) * ms_per_day + day_offset
+
+    # Layer between the brackets
+    close = np.full(len(starts), -1, dtype=np.int64)
+    for k in range(15, 21):
+        found = (close < 0) & (peek(starts + k) == ord(']')) & (starts + k < ends)
+        close[found] = starts[found] + k
+    layer = layer_table[peek(starts + 14) << 8 | peek(starts + 15)]
+    layer[close < 0] = LAYER_OTHER
+    close = np.where(close < 0, starts + 13, close)
+
+    # Direction and ue_id follow the layer: "] UL 0001"
+    def after(k):
+        return peek(close + k)
+    direction = np.full(len(starts), DIR_NONE, dtype=np.int8)
+    direction[(after(2) == ord('D')) & (after(3) == ord('L'))] = DIR_DL
+    direction[(after(2) == ord('U')) & (after(3) == ord('L'))] = DIR_UL
+    nibbles = [hex_table[after(k)] for k in range(5, 9)]
+    ue_id = (nibbles[0] << 12) | (nibbles[1] << 8) | (nibbles[2] << 4) | nibbles[3]
+    valid_ue_id = (after(4) == ord(' ')) & (close + 8 < ends) & np.all([nibble >= 0 for nibble in nibbles], axis=0)
+    ue_id = np.where(valid_ue_id, ue_id, -1).astype(np.int32)
+
+    # Payload of a record extends up to the next header line
+    payload_end = np.concatenate((starts[1:], [size]))[:len(starts)]
+
+    columns = LogColumns(buf, starts, ends, ts, layer, direction, ue_id,
+                         np.full(len(starts), -1, dtype=np.int32),
+                         np.full(len(starts), -1, dtype=np.int32), payload_end, day_offset)
+
+    # BSR index (b=) and length (len=), first occurrence in the header line
+    for values, pattern in ((columns.bsr, bsr_pattern), (columns.length, len_pattern)):
+        records, matches = columns.field_positions(pattern)
+        values[records] = [int(match.group(1)) for match in matches]
+
+    return columns
@@ -0,0 +1,121 @@
+import os
+import sys
+import time
+import shlex
+import subprocess
+from .parameters import ip_id
+
+# Header marker of the lines BSR is taken from
+mac_id = "[MAC]"
+
+# Payload lines kept per IP packet, i.e., 16*max_payload_lines bytes for packet ID
+max_payload_lines = 3
+
+# Filter run next to the logs (POSIX awk, byte semantics under LC_ALL=C):
+# from the first line timestamped at or after start (ms from the start of
+# the file's day) up to end (-1: no end), print the mac_id header lines and
+# the ip_id header lines along with their first non-comment payload lines.
+# The first timestamp of the file and the number of bytes read are
+# reported on stderr.
+filter_program = r'''
+function ms(line) {
+    return ((substr(line, 1, 2) * 60 + substr(line, 4, 2)) * 60 + substr(line, 7, 2)) * 1000 + substr(line, 10, 3)
+}
+BEGIN { last = -1; day = 0; started = 0; left = 0; scanned = 0 }
+{ scanned += length($0) + 1 }
+/^[0-9][0-9]:[0-9][0-9]:[0-9][0-9]\.[0-9][0-9][0-9] / {
+    t = ms($0) + day
+    # Amarisoft timestamps wrap around at midnight
+    if (last >= 0 && t < last - 43200000) { day += 86400000; t += 86400000 }
+    last = t
+    if (first == "") { first = substr($0, 1, 12); print "first " first > "/dev/stderr" }
+    left = 0
+    if (!started && t >= start) started = 1
+    if (!started) next
+    if (end >= 0 && t > end) exit
+    if (index($0, ipid)) { print; left = payload; next }
+    if (index($0, marker)) print
+    next
+}
+left > 0 && !/^[ \t]*(#.*)?$/ { print; left-- }
+END { print "scanned " scanned > "/dev/stderr" }
+'''
+
+def filter_command(path, start_ms, end_ms=None):
+    # Shell command running the filter over the log at path
+    variables = {'start': start_ms, 'end': -1 if end_ms is None else end_ms,
+                 'ipid': ip_id, 'marker': mac_id, 'payload': max_payload_lines}
+    assignments = ' '.join(f"-v {name}={shlex.quote(str(value))}" for name, value in variables.items())
+    return f"LC_ALL=C awk {assignments} {shlex.quote(filter_program)} {shlex.quote(path)}"
+
+def run_local(command):
+    # Local stand-in for running a command on a box: return its stdout and
+    # stderr streams
+    process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    return process.stdout, process.stderr
+
+def filter_log(run, path, start_ms, end_ms, local_path, chunk_size=1 << 16):
+    # Run the filter over the log at path through run(command) -> (stdout,
+    # stderr) and store the matching lines at local_path. Return the first
+    # timestamp of the log ("HH:MM:SS.mmm", None if there is none), the
+    # bytes of the log read by the filter and the bytes received.
+    stdout, stderr = run(filter_command(path, start_ms, end_ms))
+    received = 0
+    with open(local_path, 'wb') as local_file:
+        while True:
+            data = stdout.read(chunk_size)
+            if not data:
+                break
+            local_file.write(data)
+            received += len(data)
+
+    first, scanned = None, 0
+    for line in stderr.read().decode().splitlines():
+        name, _, value = line.partition(' ')
+        if name == 'first':
+            first = value
+        elif name == 'scanned':
+            scanned = int(value)
+    return first, scanned, received
+
+if __name__ == "__main__":
+    # Measure the transfer reduction of filtering with a local stand-in and
+    # check that the consumers get the same packets and BSR, e.g.:
+    # python3 -m util.logfilter logs/ue0.log.20231122.15:41:16
+    import tempfile
+    from datetime import datetime, timedelta
+    from .logflatten import IntervalConsumer, MacHeaderConsumer, scan_log_file, log_file_date
+    from .logscan import LogScanner
+    from .logcolumns import parse_log_columns
+    from .intervals import sample_intervals
+    from .e2estats import last_bsr
+
+    filepaths = sys.argv[1:] or [os.path.join('logs', name) for name in sorted(os.listdir('logs'))
+                                 if name.startswith('ue0.log.') and not name.endswith('.idx')]
+    with tempfile.TemporaryDirectory() as directory:
+        for filepath in filepaths:
+            local_path = os.path.join(directory, os.path.basename(filepath))
+            with LogScanner(filepath) as scanner:
+                ts = parse_log_columns(scanner.read()).ts
+
+            # Whole log, and the last second of it as read for BSR context
+            for start_ms in (0, int(ts[-1]) - 1000):
+                start_time = time.time()
+                first, scanned, received = filter_log(run_local, filepath, start_ms, None, local_path)
+                elapsed = time.time() - start_time
+                print(f"[logfilter] {filepath} from {start_ms} ms: first timestamp {first}, {scanned} bytes "
+                      f"filtered down to {received} ({100 * received / max(scanned, 1):.1f}%) "
+                      f"in {elapsed:.3f} seconds")
+
+            # Consumers over the raw and the filtered log
+            filter_log(run_local, filepath, 0, None, local_path)
+            day = datetime.strptime(log_file_date("ue0", filepath), "%Y%m%d")
+            windows = [(day + timedelta(milliseconds=start), day + timedelta(milliseconds=end))
+                       for start, end in sample_intervals(int(ts[0]), int(ts[-1]), 51)]
+            results = []
+            for path in (filepath, local_path):
+                intervals, headers = IntervalConsumer(windows), MacHeaderConsumer(windows[0][0])
+                scan_log_file("ue0", path, [intervals, headers])
+                results.append((intervals.result()[0], last_bsr(list(reversed(headers.result()[1])), range(64))))
+            print(f"[logfilter] identical Tx packets: {results[0][0] == results[1][0]}, "
+                  f"identical BSR: {results[0][1] == results[1][1]}")
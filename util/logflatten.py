@@ -1,11 +1,44 @@
 import os
 import re
 import math
+import time
+import multiprocessing
 import paramiko
+import numpy as np
 from datetime import datetime, timedelta
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from .parameters import ip_id, uebox_ip, callbox_ip, testing
-from .parameters import debug_mode
-from .parameters import sampling_window
+from .parameters import debug_mode, remote_filtering
+from .parameters import sampling_window, log_cache_budget
+from .parameters import max_transfers_per_host, parse_workers, parse_chunk_size
+from .parameters import stream_retention, stream_memory_budget
+from .sshpool import SSHConnectionPool
+from .logscan import LogScanner
+from .logindex import window_ms, discard_log_index, index_suffix, get_log_index, ms_per_day
+from .logcolumns import parse_log_columns
+from .intervals import IntervalSweep
+from .logfilter import filter_log, max_payload_lines
+from .logcache import LogCache
+from .logstream import LogStream
+
+# Identifier for IP flows, as matched against raw log bytes
+ip_id_bytes = ip_id.encode()
+
+# Size of the chunks in which remote log bytes are transferred
+tail_chunk_size = 1 << 20
+
+# Per unit state of the incremental copy of /tmp/{ue0,mme}.log, i.e., remote
+# inode, number of bytes already copied, and path of the local copy
+tail_state = {}
+
+# Fields of the remote_params() tuple
+remote_fields = ("ssh_logs_mount_point", "log_filename_prefix", "remote_file_path", "remote_host",
+                 "remote_username", "remote_auth_key", "remote_directory")
+
+# Per unit overrides of remote_params() fields by name, e.g., the hosts and
+# keys of another testbed (util.testbeds): {"ue0": {"remote_host": ...}}
+remote_overrides = {}
 
 def remote_params(unit):
     # Return per unit UEbox/Callbox parameters
@@ -53,21 +86,21 @@ def remote_params(unit):
     else:
         if debug_mode: print("[logflatten] Invalid input. Please choose 'ue0' or 'mme'.")
 
-    return ssh_logs_mount_point, log_filename_prefix, remote_file_path, \
-           remote_host, remote_username, remote_auth_key, remote_directory
+    params = ssh_logs_mount_point, log_filename_prefix, remote_file_path, \
+             remote_host, remote_username, remote_auth_key, remote_directory
+    if unit in remote_overrides:
+        params = tuple(remote_overrides[unit].get(field, value) for field, value in zip(remote_fields, params))
+    return params
 
-def list_remote_directories(unit):
-    ssh = paramiko.SSHClient()
-    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+# Persistent SSH/SFTP connections shared by all remote operations
+ssh_pool = SSHConnectionPool(remote_params)
 
+def list_remote_directories(unit):
     # Get per unit UEbox/Callbox parameters
-    _,_,_,remote_host,remote_username,remote_auth_key,remote_directory = remote_params(unit)
-
-    # Load the private key
-    private_key = paramiko.Ed25519Key(filename=remote_auth_key)
+    _,_,_,_,_,_,remote_directory = remote_params(unit)
 
     try:
-        ssh.connect(remote_host, username=remote_username, pkey=private_key)
+        ssh = ssh_pool.client(unit)
         ssh_stdin, ssh_stdout, ssh_stderr = ssh.exec_command(f'ls -l {remote_directory}')
 
         # Read the output of the command
@@ -82,53 +115,91 @@ def list_remote_directories(unit):
         if debug_mode: print("Authentication failed. Please check your credentials.")
     except paramiko.SSHException as ssh_ex:
         if debug_mode: print(f"SSH connection error: {ssh_ex}")
-    finally:
-        ssh.close()
+        ssh_pool.close(unit)
+
+def remote_file_identity(ssh, remote_file_path):
+    # SFTP attributes lack the inode, so query it (and the size) with stat(1)
+    _, ssh_stdout, _ = ssh.exec_command(f"stat -c '%i %s' {remote_file_path}")
+    fields = ssh_stdout.read().decode().split()
+    try:
+        return int(fields[0]), int(fields[1])
+    except (IndexError, ValueError):
+        return None, None
 
 def fetch_latest_log(unit):
-    # Get the last modified date of the remote file
-    # and fetch it from /tmp/{ue0,mme}.log to logs/ue0.log.$TIMESTAMP
-    ssh = paramiko.SSHClient()
-    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    local_directory = create_local_directory()
+    # Incrementally mirror the remote file /tmp/{ue0,mme}.log to
+    # logs/live/{ue0,mme}.log.$TIMESTAMP; only the bytes appended since the
+    # previous call are transferred, unless the remote file has been rotated
+    live_directory = create_live_directory()
 
     # Get per unit UEbox/Callbox parameters
-    _,log_filename_prefix, remote_file_path, remote_host, \
-    remote_username, remote_auth_key, remote_directory = remote_params(unit)
+    _,log_filename_prefix, remote_file_path, _, _, _, _ = remote_params(unit)
 
-    # Load the private key
-    private_key = paramiko.Ed25519Key(filename=remote_auth_key)
     local_filepath = None
     try:
-        ssh.connect(remote_host, username=remote_username, pkey=private_key)
-        sftp = ssh.open_sftp()
+        ssh = ssh_pool.client(unit)
+        sftp = ssh_pool.sftp(unit)
 
         # The latest logs is at /tmp/{ue0,mme}.log and lacks external timestamping
         remote_file_stat = sftp.stat(remote_file_path)
+        remote_size = remote_file_stat.st_size
         last_modified_timestamp = remote_file_stat.st_mtime
         last_modified_date = datetime.fromtimestamp(last_modified_timestamp).strftime("%Y%m%d")
+        remote_inode, _ = remote_file_identity(ssh, remote_file_path)
 
-        # Especially for recent file /tmp/{ue0,mme}.log, follow the other logs
-        # naming convetion and get file extension from first encounetered timestamp
-        # in the contents (time), as well as the file creation date (calendar date)
-        with sftp.open(remote_file_path) as remote_file:
-            # Read the file line by line until we find the timestamp
-            for line in remote_file:
-                line = line.strip()
-                timestamp = extract_timestamp(line, last_modified_date)
-                if timestamp:
-                    # Append the timestamp to the local filename
-                    local_filename = f'{log_filename_prefix}{timestamp}'
-                    local_filepath = os.path.join(local_directory, local_filename)
-
-                    # Download the remote file to the local folder
-                    sftp.get(remote_file_path, local_filepath)
-                    if debug_mode: print(f"[logflatten] Copying {remote_file_path} to {local_filepath}")
-                    break  # Stop reading the file once we found the timestamp
-            else:
-                if debug_mode: print("[logflatten] Timestamp not found in the file.")
+        # A new inode, a shrunk file or a missing local copy means
+        # that the local copy has to be rebuilt from the first byte
+        state = tail_state.get(unit)
+        rotated = state is None or \
+            (remote_inode is not None and remote_inode != state['inode']) or \
+            remote_size < state['offset'] or \
+            not os.path.exists(state['local_filepath'])
 
-        sftp.close()
+        with sftp.open(remote_file_path) as remote_file:
+            if rotated:
+                # Especially for recent file /tmp/{ue0,mme}.log, follow the other logs
+                # naming convetion and get file extension from first encounetered timestamp
+                # in the contents (time), as well as the file creation date (calendar date)
+                for line in remote_file:
+                    line = line.strip()
+                    timestamp = extract_timestamp(line, last_modified_date)
+                    if timestamp:
+                        # Append the timestamp to the local filename
+                        local_filename = f'{log_filename_prefix}{timestamp}'
+                        local_filepath = os.path.join(live_directory, local_filename)
+                        break  # Stop reading the file once we found the timestamp
+                else:
+                    if debug_mode: print("[logflatten] Timestamp not found in the file.")
+                    return None
+
+                # Drop the local copy of the previous (rotated) remote file
+                if state and state['local_filepath'] != local_filepath:
+                    discard_log_index(state['local_filepath'])
+                    if os.path.exists(state['local_filepath']):
+                        os.remove(state['local_filepath'])
+
+                state = {'inode': remote_inode, 'offset': 0, 'local_filepath': local_filepath}
+                discard_log_index(local_filepath)
+                open(local_filepath, 'wb').close()
+                if debug_mode: print(f"[logflatten] Copying {remote_file_path} to {local_filepath}")
+
+            # Transfer only the bytes appended since the last call
+            local_filepath = state['local_filepath']
+            remote_file.seek(state['offset'])
+            remote_file.prefetch(remote_size)
+            with open(local_filepath, 'ab') as local_file:
+                remaining = remote_size - state['offset']
+                while remaining > 0:
+                    data = remote_file.read(min(remaining, tail_chunk_size))
+                    if not data:
+                        break
+                    local_file.write(data)
+                    remaining -= len(data)
+                    state['offset'] += len(data)
+            if debug_mode: print(f"[logflatten] Appended {remote_file_path} to {local_filepath} "
+                                 f"up to byte {state['offset']}")
+
+        tail_state[unit] = state
 
         return local_filepath # Return the new timestamped filename
 
@@ -136,47 +207,98 @@ def fetch_latest_log(unit):
         if debug_mode: print("Authentication failed. Please check your credentials.")
     except paramiko.SSHException as ssh_ex:
         if debug_mode: print(f"SSH connection error: {ssh_ex}")
-    finally:
-        ssh.close()
+        ssh_pool.close(unit)
 
 def fetch_remote_files(unit, remote_files):
-    # Fetch files with full-paths in list remote_files
-    ssh = paramiko.SSHClient()
-    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    local_directory = create_local_directory()
-
+    # Fetch files with full-paths in list remote_files; rotated logs do not
+    # change, so each one is downloaded once into the local cache. Return
+    # the local logs (None on failure) and the bytes downloaded by this call
     # Get per unit UEbox/Callbox parameters
-    _, _, _, remote_host, remote_username, remote_auth_key, \
-        remote_directory = remote_params(unit)
-
-    # Load the private key
-    private_key = paramiko.Ed25519Key(filename=remote_auth_key)
+    _, _, _, _, _, _, remote_directory = remote_params(unit)
+    # Sizes of the files downloaded, not found in the cache
+    downloaded = []
 
     try:
-        ssh.connect(remote_host, username=remote_username, pkey=private_key)
-        sftp = ssh.open_sftp()
+        sftp = ssh_pool.sftp(unit)
+        remote_paths = [os.path.join(remote_directory, file_name) for file_name in remote_files]
+        remote_file_stats = [sftp.stat(remote_path) for remote_path in remote_paths]
+
+        def fetch(file_name, remote_path, remote_file_stat):
+            def download(local_path):
+                # Each transfer runs on its own SFTP channel of the pooled connection
+                with ssh_pool.client(unit).open_sftp() as transfer_sftp:
+                    transfer_sftp.get(remote_path, local_path)
+                downloaded.append(remote_file_stat.st_size)
+                if debug_mode: print(f"[logflatten] Copying {remote_path} to {local_path}")
+            return log_cache.get(unit, file_name, remote_file_stat.st_size,
+                                 remote_file_stat.st_mtime, download)
+
+        # Fetch the files from the remote directory, unless cached, with at
+        # most max_transfers_per_host concurrent transfers; local log files
+        # paths are kept in the order of remote_files
+        with ThreadPoolExecutor(max_workers=max_transfers_per_host) as executor:
+            local_logs = list(executor.map(fetch, remote_files, remote_paths, remote_file_stats))
+
+        return local_logs, sum(downloaded)  # Return the list of the local logs
 
-        # local log files paths
-        local_logs = []
+    except paramiko.AuthenticationException:
+        if debug_mode: print("Authentication failed. Please check your credentials.")
+    except paramiko.SSHException as ssh_ex:
+        if debug_mode: print(f"SSH connection error: {ssh_ex}")
+        ssh_pool.close(unit)
+    return None, sum(downloaded)
+
+def ssh_runner(unit):
+    # Run commands on the unit over its pooled connection
+    def run(command):
+        _, ssh_stdout, ssh_stderr = ssh_pool.client(unit).exec_command(command)
+        return ssh_stdout, ssh_stderr
+    return run
+
+def fetch_filtered_log(unit, remote_path, start_time, remote_filename=None):
+    # Filter the remote log on the unit and store only the [MAC] header lines
+    # and the IP packets logged from start_time on in logs/. Rotated logs keep
+    # their name; the latest one, /tmp/{ue0,mme}.log, is named after its first
+    # timestamp. Return the local path, the bytes filtered and those received.
+    local_directory = create_local_directory()
 
-        # Fetch each file from the remote directory and store it in the local directory
-        for file_name in remote_files:
-            remote_path = os.path.join(remote_directory, file_name)
-            local_path = os.path.join(local_directory, file_name)
-            sftp.get(remote_path, local_path)
-            if debug_mode: print(f"[logflatten] Copying {remote_path} to {local_path}")
-            local_logs.append(local_path)
+    # Get per unit UEbox/Callbox parameters
+    _, log_filename_prefix, _, _, _, _, _ = remote_params(unit)
 
-        sftp.close()
+    try:
+        if remote_filename:
+            filename_date = remote_filename[len(log_filename_prefix):].split(".")[0]
+            local_path = os.path.join(local_directory, remote_filename)
+        else:
+            # The latest log lacks external timestamping; take the calendar date
+            # from its modification time
+            last_modified_timestamp = ssh_pool.sftp(unit).stat(remote_path).st_mtime
+            filename_date = datetime.fromtimestamp(last_modified_timestamp).strftime("%Y%m%d")
+            local_path = os.path.join(local_directory, f'{log_filename_prefix}filtered')
+
+        start_ms, _ = window_ms(filename_date, start_time)
+        discard_log_index(local_path)
+        first, scanned, received = filter_log(ssh_runner(unit), remote_path, start_ms, None, local_path)
+        if debug_mode: print(f"[logflatten] Filtered {remote_path} ({scanned} bytes) "
+                             f"to {local_path} ({received} bytes)")
+
+        if not remote_filename:
+            if first is None:
+                if debug_mode: print("[logflatten] Timestamp not found in the file.")
+                os.remove(local_path)
+                return None
+            local_filename = f'{log_filename_prefix}{filename_date}.{first[:8]}'
+            discard_log_index(os.path.join(local_directory, local_filename))
+            os.replace(local_path, os.path.join(local_directory, local_filename))
+            local_path = os.path.join(local_directory, local_filename)
 
-        return local_logs  # Return the list of the local logs
+        return local_path, scanned, received
 
     except paramiko.AuthenticationException:
         if debug_mode: print("Authentication failed. Please check your credentials.")
     except paramiko.SSHException as ssh_ex:
         if debug_mode: print(f"SSH connection error: {ssh_ex}")
-    finally:
-        ssh.close()
+        ssh_pool.close(unit)
 
 def create_local_directory():
     # Locate and if necessary, create local logs folder
@@ -187,12 +309,26 @@ def create_local_directory():
 
     return local_directory
 
+# Rotated logs fetched in previous rounds (and runs); as a subfolder of the
+# local logs folder, the cache survives remove_all_files_from_directory
+log_cache = LogCache(os.path.join('./logs', 'cache'), log_cache_budget)
+
+def create_live_directory():
+    # Locate and if necessary, create the folder holding the local copies of
+    # /tmp/{ue0,mme}.log; as a subfolder it survives remove_all_files_from_directory
+    live_directory = os.path.join(create_local_directory(), 'live')
+
+    if not os.path.exists(live_directory):
+        os.makedirs(live_directory)
+
+    return live_directory
+
 def get_log_directory(unit, isLocal):
     # Get local or remote log directory contents
     if isLocal:
         ssh_logs_mount_point, _, _, _, _, _, _ = remote_params(unit)
         log_files = os.listdir(ssh_logs_mount_point)
-        log_files = [log for log in log_files if f"{unit}.log." in log]
+        log_files = [log for log in log_files if f"{unit}.log." in log and not log.endswith(index_suffix)]
     else:
         log_files = list_remote_directories(unit)
 
@@ -254,536 +390,479 @@ def find_latest_file_before_time(unit, log_files, target_time):
 
     return latest_file
 
-def extract_sample_mme_entries(start_time_dt, time_samples_dt):
-    # Set this to True, to load logs files from local folder
-    isLocal = False
+def log_file_date(unit, filepath):
+    # Amarisoft logs timestamps contain only relative time from the start of day;
+    # the calendar date is taken from the file name, or else its modification time
+    _,log_filename_prefix,_,_,_,_,_ = remote_params(unit)
+    filename = os.path.basename(filepath)
+    filename_date = filename[len(log_filename_prefix):].split(".")[0] \
+        if filename.startswith(log_filename_prefix) else ''
+    if not filename_date.isdigit():
+        # Live log, e.g., ue0.log: its timestamps are relative to the day of
+        # its first line, as many days before its modification time as its
+        # indexed timestamps wrapped around midnight
+        mtime = os.path.getmtime(filepath)
+        index = get_log_index(filepath)
+        days = index.ms[-1] // ms_per_day if index.ms else 0
+        last_modified_time = datetime.fromtimestamp(mtime) - timedelta(days=days)
+        filename_date = last_modified_time.strftime("%Y%m%d")
+    return filename_date
+
+def packet_lines(columns, i, max_payload_lines=max_payload_lines):
+    # Header of IP packet record i and up to max_payload_lines payload
+    # lines, i.e., 16*max_payload_lines bytes for packet ID
+    return [columns.header(i)] + columns.payload_lines(i)[:max_payload_lines]
+
+class MacHeaderConsumer:
+    # Collect MAC, etc. headers and IP packets logged from the first packet
+    # within [start_time, end_time] on; end_time None means up to now
+    def __init__(self, start_time, end_time=None):
+        self.start_time = start_time
+        self.end_time = end_time
+        self.started = False
+        self.ip_lines = []
+        self.mac_headers = []
+
+    def window(self):
+        return self.start_time, self.end_time
+
+    def feed(self, columns, filename_date, is_ip):
+        if self.started:
+            # Past the first packet within the window, in an earlier chunk
+            records = np.arange(len(columns))
+        else:
+            start_ms, end_ms = window_ms(filename_date, self.start_time, self.end_time)
+            in_window = np.flatnonzero(columns.within(start_ms, end_ms))
+            if not len(in_window):
+                return
+            records = np.arange(in_window[0], len(columns))
+            self.started = True
+
+        # For MAC, etc. packets, just keep the header
+        self.mac_headers.extend(columns.header(i) for i in records[~is_ip[records]])
+        for i in records[is_ip[records]]:
+            self.ip_lines.extend(packet_lines(columns, i))
+
+    def result(self):
+        return self.ip_lines, self.mac_headers
+
+class IntervalConsumer:
+    # Collect IP packets per (possibly overlapping) time interval, along
+    # with the MAC, etc. headers that fall within any of the intervals
+    def __init__(self, time_intervals_dt):
+        self.time_intervals_dt = time_intervals_dt
+        self.sweep_date = None
+        self.sweep = None
+        self.ip_lines = [[] for _ in range(len(time_intervals_dt))]
+        self.mac_headers = []
+
+    def window(self):
+        if not self.time_intervals_dt:
+            return None
+        return min(interval_start for interval_start, _ in self.time_intervals_dt), \
+            max(interval_end for _, interval_end in self.time_intervals_dt)
+
+    def feed(self, columns, filename_date, is_ip):
+        # Log lines and intervals are both time-ordered, so a single sweep
+        # (carried over the chunks of a log) assigns each line to the
+        # intervals containing it
+        if self.sweep_date != filename_date:
+            self.sweep_date = filename_date
+            self.sweep = IntervalSweep([window_ms(filename_date, interval_start, interval_end)
+                                        for interval_start, interval_end in self.time_intervals_dt])
+        sweep = self.sweep
+        for i, (timestamp, ip) in enumerate(zip(columns.ts.tolist(), is_ip.tolist())):
+            indices = sweep.assign(timestamp)
+            if not indices:
+                continue
+            if ip:
+                lines = packet_lines(columns, i)
+                for index in indices:
+                    self.ip_lines[index].extend(lines)
+            else:
+                # For MAC, etc. packets, just keep the header
+                self.mac_headers.append(columns.header(i))
+
+    def result(self):
+        return self.ip_lines, self.mac_headers
+
+class SampleConsumer:
+    # Collect the first IP packet within tolerance_seconds of each sample
+    # time; a sample is skipped once a later packet is logged
+    def __init__(self, time_samples_dt, sample_idx=0, tolerance_seconds=sampling_window/2):
+        self.time_samples_dt = time_samples_dt
+        self.sample_idx = sample_idx
+        self.tolerance_seconds = tolerance_seconds
+        self.ip_lines = []
+        self.sample_timestamp = []
+
+    def window(self):
+        if self.sample_idx >= len(self.time_samples_dt):
+            return None
+        tolerance = timedelta(seconds=self.tolerance_seconds)
+        return self.time_samples_dt[self.sample_idx] - tolerance, self.time_samples_dt[-1] + tolerance
+
+    def feed(self, columns, filename_date, is_ip):
+        day = datetime.strptime(filename_date, "%Y%m%d")
+        samples_ms = [(sample - day).total_seconds() * 1000 for sample in self.time_samples_dt]
+        tolerance_ms = self.tolerance_seconds * 1000
+        for i, (timestamp, ip) in enumerate(zip(columns.ts.tolist(), is_ip.tolist())):
+            if self.sample_idx >= len(samples_ms):
+                break
+            sample_ms = samples_ms[self.sample_idx]
+            if ip and abs(sample_ms - timestamp) <= tolerance_ms:
+                # Flag packet if its timestamp is within sample range
+                self.ip_lines.extend(packet_lines(columns, i))
+                self.sample_timestamp.append(day + timedelta(milliseconds=timestamp))
+                self.sample_idx += 1
+            elif timestamp - sample_ms > tolerance_ms:
+                # Skip sample if no sample within tolerance window is found
+                self.sample_idx += 1
+
+    def result(self):
+        return self.ip_lines, self.sample_timestamp, self.sample_idx
+
+def consumers_window(consumers):
+    # Union of the time windows of interest to the consumers, None if none
+    windows = [window for window in (consumer.window() for consumer in consumers) if window]
+    if not windows:
+        return None
+    start_time = min(window[0] for window in windows)
+    end_time = None if any(window[1] is None for window in windows) else max(window[1] for window in windows)
+    return start_time, end_time
+
+def parse_log_chunk(chunk, reference_ms=None):
+    # Parse log bytes into columns, flag its IP packets and count its lines
+    columns = parse_log_columns(chunk, reference_ms)
+    return columns, columns.contains(ip_id_bytes), chunk.count(b'\n')
+
+def parse_log_range(filepath, start, end, reference_ms=None):
+    # Parse bytes [start, end) of a log; runs in parse worker processes too
+    with LogScanner(filepath) as scanner:
+        chunk = scanner.read(start, end)
+    return parse_log_chunk(chunk, reference_ms)
+
+def log_chunks(filepath, filename_date, window):
+    # Byte ranges of the log holding the lines within the time window, found
+    # through its sparse timestamp index, split into chunks of whole records
+    # of about parse_chunk_size bytes; each comes with the time of the index
+    # entry before it, which places its records on the right day
+    index = get_log_index(filepath)
+    window_start, window_end = index.window(*window_ms(filename_date, *window))
+    with LogScanner(filepath) as scanner:
+        return [(start, end, index.reference_ms(start))
+                for start, end in scanner.chunk_ranges(window_start, window_end, parse_chunk_size)]
+
+def feed_consumers(consumers, columns, filename_date, is_ip):
+    for consumer in consumers:
+        if consumer.window():
+            consumer.feed(columns, filename_date, is_ip)
+
+def scan_log_file(unit, filepath, consumers):
+    # Parse the part of a log file that is of interest to any of the
+    # consumers into columns once, and feed them to each consumer.
+    # Return the number of lines and bytes scanned.
+    if debug_mode: print('[logflatten] Now locally processing: ', end='')
+    if debug_mode: print (filepath)
 
-    unit = "mme"
-    # Get per unit UEbox/Callbox parameters
-    ssh_logs_mount_point, _, remote_file_path, remote_host, remote_username, \
-    remote_auth_key, remote_directory = remote_params(unit)
-
-    # Check directory where files post-log-rotation are stored
-    log_files = get_log_directory(unit, isLocal)
-
-    # To decide which logs are necessary, it is important to
-    # take the latest log's timestamps into account
-    if not isLocal:
-        # Fetch current log file /tmp/{ue0,mme}.log
-        local_filepath = fetch_latest_log(unit)
-        if local_filepath:
-            basename = os.path.basename(local_filepath)
-            # latest log's timestamp can be appended to sorted list
-            log_files.append(basename)
-    else:
-        # Take separately stored latest/current log, too
-        basename = os.path.basename(remote_file_path)
-        # latest log's timestamp can be appended to sorted list
-        log_files.append(basename)
-
-    # Perform binary search on the log filenames' timestamps
-    latest_file = find_latest_file_before_time(unit, log_files, start_time_dt)
-
-    if latest_file:
-        # Find the index of the latest_file in the sorted list
-        index_of_latest_file = log_files.index(latest_file)
-
-        if debug_mode: print(f"[logflatten] Remote files of interest:", end=' ')
-        if debug_mode: print(log_files[index_of_latest_file:])
-
-        if not isLocal:
-            # Fetch remote logs: (i) Files indicated by binary search, except
-            # for the current log in /tmp/{ue0,mme}.log, which has been already copied
-            target_files = log_files[index_of_latest_file:-1]
-            local_logs = fetch_remote_files(unit, target_files)
+    window = consumers_window(consumers)
+    if not window:
+        return 0, 0
+
+    # Seek straight to the time window through the sparse timestamp index
+    # and parse only that part of the log, one chunk at a time; the columns
+    # of a chunk are dropped before the next one is read
+    filename_date = log_file_date(unit, filepath)
+    lines = nbytes = 0
+    for chunk in log_chunks(filepath, filename_date, window):
+        columns, is_ip, chunk_lines = parse_log_range(filepath, *chunk)
+        feed_consumers(consumers, columns, filename_date, is_ip)
+        lines += chunk_lines
+        nbytes += len(columns.buf)
+        del columns, is_ip
+
+    return lines, nbytes
+
+# Worker processes parsing log chunks in parallel, started on first use.
+# By then this process runs threads (SSH transports, API readers, log
+# streams, the learner), so workers are not forked from it but from a fork
+# server, and get plain paths and byte ranges (parse_log_range()).
+parse_pool = None
+
+def get_parse_pool():
+    global parse_pool
+    if parse_pool is None:
+        parse_pool = ProcessPoolExecutor(max_workers=parse_workers,
+                                         mp_context=multiprocessing.get_context('forkserver'))
+    return parse_pool
+
+# Background streams of /tmp/{ue0,mme}.log, per unit
+log_streams = {}
+
+def open_ssh_stream(unit):
+    # Run stream commands on their own channel of the unit's pooled connection
+    def open_stream(command):
+        channel = ssh_pool.client(unit).get_transport().open_session()
+        # Wake up every second to notice stop requests
+        channel.settimeout(1)
+        channel.exec_command(command)
+        return channel
+    return open_stream
+
+def start_log_streams(units=("ue0", "mme")):
+    # Start streaming the live logs of the units into memory
+    for unit in units:
+        if unit not in log_streams:
+            _, _, remote_file_path, _, _, _, _ = remote_params(unit)
+            log_streams[unit] = LogStream(unit, remote_file_path, open_ssh_stream(unit),
+                                          stream_retention, stream_memory_budget).start()
+
+def report_log_streams():
+    for stream in log_streams.values():
+        stream.report()
+
+def stop_log_streams():
+    while log_streams:
+        _, stream = log_streams.popitem()
+        stream.stop()
+
+class LogSnapshot:
+    # Per-round view of the UEbox/Callbox logs. The logs of each unit are
+    # listed and fetched once, and each file is scanned once for all of
+    # the consumers registered for the unit.
+    def __init__(self, isLocal=False):
+        # Set isLocal to True, to load logs files from local folder
+        self.isLocal = isLocal
+        self.consumers = defaultdict(list)
+        self.local_logs = {}
+        self.fetched_bytes = defaultdict(int)
+        self.rotated_bytes = defaultdict(int)
+        self.scanned_lines = defaultdict(int)
+        self.scanned_bytes = defaultdict(int)
+        self.filtered_bytes = defaultdict(int)
+        self.served = defaultdict(int)
+        self.streamed = defaultdict(int)
+
+    def register(self, unit, consumer):
+        self.consumers[unit].append(consumer)
+        return consumer
+
+    def use_logs(self, unit, filepaths):
+        # Serve the unit from the given local logs (e.g., exported ones) instead
+        # of the box's logs
+        self.local_logs[unit] = (datetime.min, list(filepaths))
+
+    def count_filtered(self, unit, local_path, scanned, received):
+        # Account for a log filtered on the box
+        self.filtered_bytes[unit] += scanned
+        self.fetched_bytes[unit] += received
+        return local_path
+
+    def logs(self, unit, start_time):
+        # Return the local paths of the logs of the unit from start_time on;
+        # logs are listed and fetched only once per snapshot
+        if unit in self.local_logs and self.local_logs[unit][0] <= start_time:
+            return self.local_logs[unit][1]
+
+        # Get per unit UEbox/Callbox parameters
+        ssh_logs_mount_point, _, remote_file_path, _, _, _, _ = remote_params(unit)
+
+        # Check directory where files post-log-rotation are stored
+        log_files = get_log_directory(unit, self.isLocal) or []
+
+        # To decide which logs are necessary, it is important to
+        # take the latest log's timestamps into account
+        local_filepath = None
+        if not self.isLocal and remote_filtering:
+            # Filter current log file /tmp/{ue0,mme}.log on the box
+            filtered = fetch_filtered_log(unit, remote_file_path, start_time)
+            if filtered:
+                local_filepath = self.count_filtered(unit, *filtered)
+                log_files.append(os.path.basename(local_filepath))
+        elif not self.isLocal:
+            # Fetch current log file /tmp/{ue0,mme}.log
+            offset = tail_state.get(unit, {}).get('offset', 0)
+            local_filepath = fetch_latest_log(unit)
             if local_filepath:
-                local_logs.append(local_filepath)
-
+                self.fetched_bytes[unit] += max(0, tail_state[unit]['offset'] - offset)
+                basename = os.path.basename(local_filepath)
+                # latest log's timestamp can be appended to sorted list
+                log_files.append(basename)
         else:
-            # Process logs that are accessible via the current file system;
-            # this works with sshfs too.
-            local_logs = [os.path.join(ssh_logs_mount_point, filename) \
-                for filename in log_files[index_of_latest_file:]]
-
-        sample_idx = 0
-        ip_entries = []
-        sample_timestamp = []
-        # print (time_samples_dt)
-        for filepath in local_logs:
-            # Now that all logs of interest are accessible locally, process them
-            ip_lines, sample_real_timestamps, sample_idx = extract_mme_entries_from_file(unit, filepath, time_samples_dt, sample_idx)
-            ip_entries.extend(ip_lines)
-            sample_timestamp.extend(sample_real_timestamps)
-            # print(f"[logflatten] Found {sample_idx} samples from mme logs.")
-            # if sample_idx >= len(time_samples_dt):
-            #     break
-
-        # print (f"[logflatten] Returned {sample_idx} samples from mme logs.")
-        # print (ip_entries)
-        return ip_entries, sample_timestamp
-
-    else:
-        return [], []
-
-def extract_ue_entries_within_intervals(time_intervals_dt):
-    # Set this to True, to load logs files from local folder
-    isLocal = False
-
-    unit = "ue0"
-    # Get per unit UEbox/Callbox parameters
-    ssh_logs_mount_point, _, remote_file_path, remote_host, remote_username, \
-    remote_auth_key, remote_directory = remote_params(unit)
-
-    # Check directory where files post-log-rotation are stored
-    log_files = get_log_directory(unit, isLocal)
-
-    # To decide which logs are necessary, it is important to
-    # take the latest log's timestamps into account
-    if not isLocal:
-        # Fetch current log file /tmp/{ue0,mme}.log
-        local_filepath = fetch_latest_log(unit)
-        if local_filepath:
-            basename = os.path.basename(local_filepath)
+            # Take separately stored latest/current log, too
+            basename = os.path.basename(remote_file_path)
             # latest log's timestamp can be appended to sorted list
             log_files.append(basename)
-    else:
-        # Take separately stored latest/current log, too
-        basename = os.path.basename(remote_file_path)
-        # latest log's timestamp can be appended to sorted list
-        log_files.append(basename)
-
-    # Perform binary search on the log filenames' timestamps
-    try:
-        start_time_dt = time_intervals_dt[0][0]
-    except IndexError:
-        return [], []
 
-    latest_file = find_latest_file_before_time(unit, log_files, start_time_dt)
+        # Perform binary search on the log filenames' timestamps
+        latest_file = find_latest_file_before_time(unit, log_files, start_time)
 
-    if latest_file:
-        # Find the index of the latest_file in the sorted list
-        index_of_latest_file = log_files.index(latest_file)
-
-        if debug_mode: print(f"[logflatten] Remote files of interest:", end=' ')
-        if debug_mode: print(log_files[index_of_latest_file:])
-
-        if not isLocal:
-            # Fetch remote logs: (i) Files indicated by binary search, except
-            # for the current log in /tmp/{ue0,mme}.log, which has been already copied
-            target_files = log_files[index_of_latest_file:-1]
-            local_logs = fetch_remote_files(unit, target_files)
-            if local_filepath:
-                local_logs.append(local_filepath)
+        local_logs = []
+        if latest_file:
+            # Find the index of the latest_file in the sorted list
+            index_of_latest_file = log_files.index(latest_file)
+
+            if debug_mode: print(f"[logflatten] Remote files of interest:", end=' ')
+            if debug_mode: print(log_files[index_of_latest_file:])
+
+            if not self.isLocal:
+                # Fetch remote logs: (i) Files indicated by binary search, except
+                # for the current log in /tmp/{ue0,mme}.log, which has been already copied
+                target_files = log_files[index_of_latest_file:-1] if local_filepath \
+                    else log_files[index_of_latest_file:]
+                if remote_filtering:
+                    # (ii) Filter them on the box, too
+                    _, _, _, _, _, _, remote_directory = remote_params(unit)
+                    for filename in target_files:
+                        filtered = fetch_filtered_log(unit, os.path.join(remote_directory, filename),
+                                                      start_time, filename)
+                        if filtered:
+                            local_logs.append(self.count_filtered(unit, *filtered))
+                            self.rotated_bytes[unit] += filtered[2]
+                else:
+                    # Bytes downloaded for this unit only, as the other
+                    # units may be fetching into the cache meanwhile
+                    local_logs, received = fetch_remote_files(unit, target_files)
+                    local_logs = local_logs or []
+                    self.rotated_bytes[unit] += received
+                    self.fetched_bytes[unit] += received
+                if local_filepath:
+                    local_logs.append(local_filepath)
 
+            else:
+                # Process logs that are accessible via the current file system;
+                # this works with sshfs too.
+                local_logs = [os.path.join(ssh_logs_mount_point, filename) \
+                    for filename in log_files[index_of_latest_file:]]
+
+        self.local_logs[unit] = (start_time, local_logs)
+        return local_logs
+
+    def prefetch(self, start_times):
+        # List and fetch the logs of several units concurrently, one thread
+        # per host, given a {unit: start_time} dict; the round's collection
+        # then takes about as long as its slowest host
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=max(1, len(start_times))) as executor:
+            futures = {unit: executor.submit(self.logs, unit, start_time)
+                       for unit, start_time in start_times.items()}
+        for unit, future in futures.items():
+            future.result()
+        if debug_mode: print(f"[logflatten] Fetched logs of {', '.join(start_times)} "
+                             f"in {time.time() - start:.3f} seconds")
+
+    def scan(self, unit):
+        # Scan the logs of the unit once for all of its registered consumers
+        consumers = self.consumers.pop(unit, [])
+        window = consumers_window(consumers)
+        if not window:
+            return
+        stream = log_streams.get(unit)
+        if stream and stream.covers(window[0]):
+            # Recent enough to be read from the streamed records
+            filename_date, chunk = stream.query(*window)
+            if filename_date:
+                columns, is_ip, lines = parse_log_chunk(chunk)
+                feed_consumers(consumers, columns, filename_date, is_ip)
+                self.scanned_lines[unit] += lines
+                self.scanned_bytes[unit] += len(chunk)
+            self.streamed[unit] += len(consumers)
+            self.served[unit] += len(consumers)
+            return
+        filepaths = self.logs(unit, window[0])
+        chunks = [(filepath, filename_date, chunk) for filepath, filename_date in
+                  ((filepath, log_file_date(unit, filepath)) for filepath in filepaths)
+                  for chunk in log_chunks(filepath, filename_date, window)] if parse_workers else []
+        if len(chunks) > 1:
+            # Parse the chunks of the logs in worker processes, a few at a
+            # time so that memory stays bounded; index lookups stay in this
+            # process and consumers are fed in log order
+            parsed = deque()
+
+            def feed_oldest():
+                filename_date, future = parsed.popleft()
+                columns, is_ip, lines = future.result()
+                feed_consumers(consumers, columns, filename_date, is_ip)
+                self.scanned_lines[unit] += lines
+                self.scanned_bytes[unit] += len(columns.buf)
+
+            for filepath, filename_date, chunk in chunks:
+                parsed.append((filename_date, get_parse_pool().submit(parse_log_range, filepath, *chunk)))
+                if len(parsed) > parse_workers:
+                    feed_oldest()
+            while parsed:
+                feed_oldest()
         else:
-            # Process logs that are accessible via the current file system;
-            # this works with sshfs too.
-            local_logs = [os.path.join(ssh_logs_mount_point, filename) \
-                for filename in log_files[index_of_latest_file:]]
-
-        mac_entries = []
-        ip_entries = [[] for _ in range(len(time_intervals_dt))]
-        for filepath in local_logs:
-            # Now that all logs of interest are accessible locally, process them
-            ip_lines, mac_headers = extract_ue_entries_from_file(unit, filepath, time_intervals_dt)
-            for i in range (0, len(ip_entries)):
-                ip_entries[i].extend(ip_lines[i])
-            mac_entries.extend(mac_headers)
-
-        # print (f"[logflatten] Returned {len(ip_entries)} windows from ue0 logs.")
-        return ip_entries, list(reversed(mac_entries))
+            for filepath in filepaths:
+                # Now that all logs of interest are accessible locally, process them
+                lines, nbytes = scan_log_file(unit, filepath, consumers)
+                self.scanned_lines[unit] += lines
+                self.scanned_bytes[unit] += nbytes
+        self.served[unit] += len(consumers)
+
+    def report(self):
+        # Compare with fetching and scanning the logs once per consumer
+        for unit in sorted(self.served):
+            repeats = self.served[unit] - 1
+            print(f"[logflatten] {unit} snapshot: fetched {self.fetched_bytes[unit]} bytes, scanned "
+                  f"{self.scanned_lines[unit]} lines for {self.served[unit]} consumers; saved "
+                  f"{repeats * self.rotated_bytes[unit]} bytes of transfers and "
+                  f"{repeats * self.scanned_lines[unit]} lines of scanning")
+            if self.streamed[unit]:
+                print(f"[logflatten] {unit} snapshot: {self.streamed[unit]} consumers served from the log stream")
+            if self.filtered_bytes[unit]:
+                print(f"[logflatten] {unit} snapshot: filtered {self.filtered_bytes[unit]} bytes on the box down to "
+                      f"{self.fetched_bytes[unit]} ({100 * self.fetched_bytes[unit] / self.filtered_bytes[unit]:.1f}%)")
 
-    else:
-        return [], []
+def extract_sample_mme_entries(start_time_dt, time_samples_dt):
+    unit = "mme"
+    snapshot = LogSnapshot()
+    consumer = snapshot.register(unit, SampleConsumer(time_samples_dt))
+    snapshot.scan(unit)
+    ip_entries, sample_timestamp, _ = consumer.result()
+    return ip_entries, sample_timestamp
+
+def extract_ue_entries_within_intervals(time_intervals_dt):
+    unit = "ue0"
+    snapshot = LogSnapshot()
+    consumer = snapshot.register(unit, IntervalConsumer(time_intervals_dt))
+    snapshot.scan(unit)
+    ip_entries, mac_entries = consumer.result()
+    return ip_entries, list(reversed(mac_entries))
 
 def parse_packet_timestamp(timestamp_str):
     # Parse a timestamp string into a datetime object
     return datetime.strptime(timestamp_str, "%H:%M:%S.%f")
 
-def find_interval_index0(timestamp_dt, intervals):
-    # Intervals are sorted by default
-    # Sort the intervals based on their start times
-    sorted_intervals = intervals # sorted(intervals, key=lambda x: x[0])
-
-    # Binary search to find the interval containing the timestamp
-    low, high = 0, len(sorted_intervals) - 1
-
-    while low <= high:
-        mid = (low + high) // 2
-        interval_start, interval_end = sorted_intervals[mid]
-
-        if interval_start <= timestamp_dt <= interval_end:
-            return mid, True
-        elif timestamp_dt < interval_start:
-            high = mid - 1
-        else:
-            low = mid + 1
-
-    return low, False
-
-def find_interval_indices(timestamp_dt, intervals):
-    # Convert the input timestamp to a datetime object
-    # timestamp_dt = parse_timestamp(timestamp)
-
-    # Sort the intervals based on their start times
-    # sorted_intervals = sorted(intervals, key=lambda x: x[0])
-
-    # Iterate through the sorted intervals and yield matching indices
-    for index, (interval_start, interval_end) in enumerate(intervals):
-        if interval_start <= timestamp_dt <= interval_end:
-            yield index
-
-
 def extract_ue_entries_from_file(unit, filepath, time_intervals_dt):
     # Process file and return MAC packet lines, time indexed IP packets
     # represented by bitwise hex digit concatenation of their payload.
     # The packets' timestamps are subjects to constraints
-
-    if debug_mode: print('[logflatten] Now locally processing: ', end='')
-    if debug_mode: print (filepath)
-
-    # Load log file
-    with open(filepath, "r") as file:
-        log_content = file.readlines()
-
-    # Get per unit UEbox/Callbox parameters
-    _,log_filename_prefix,_,_,_,_,_ = remote_params(unit)
-
-    # Regex for commented lines to ignore
-    comment_pattern = re.compile(r'^\s*(?:#.*)?$')
-
-    # Regex timestamps patterns to match
-    timestamp_pattern = re.compile(r'^\d{2}:\d{2}:\d{2}\.\d{3}')
-
-    # store only ip packets here
-    ip_lines = [[] for _ in range(len(time_intervals_dt))]
-    # store ip packets per separate indexed intervals
-    index = 0
-
-    # store remaining packets (MAC, etc.) here
-    mac_headers = []
-
-    # payload line (amari log format) counter
-    payload_lines = 0
-
-    # specify up to how many bytes will be used for packet ID
-    max_payload_lines = 3
-
-    # Flag to indicate when to ignore lines
-    ignore_content = False
-
-    # Count (IP) packets of interest; we may want to downsample
-    packet_count = 0
-
-    interesting = False
-
-    matching_indices = []
-
-    # Define sparsity differently for each unit
-    packet_sparsity = 1 # unit_packet_sparsity[unit]
-
-    filename_date = filepath.split(log_filename_prefix)[-1].split(".")[0]
-    if filename_date == 'log':
-        mtime = os.path.getmtime(filepath)
-        last_modified_time = datetime.fromtimestamp(mtime)
-        filename_date = last_modified_time.strftime("%Y%m%d")
-
-    for line in log_content:
-        match = re.search(r'^\d{2}:\d{2}:\d{2}\.\d{3}', line)
-        if match:
-            interesting = False
-            # Amarisoft logs timestamps contain only relative time from the start of day
-            timestamp_str = match.group()
-            # Augment timestamp to include calendar date...
-            str_timestamp = filename_date + "." + timestamp_str
-            timestamp = datetime.strptime(str_timestamp, "%Y%m%d.%H:%M:%S.%f")
-            # index, interesting = find_interval_index(timestamp, time_intervals_dt)
-            matching_indices = list(find_interval_indices(timestamp, time_intervals_dt))
-
-        if matching_indices:
-            if match:
-                if ip_id in line:
-                    # Collect payload for IP packets
-                    payload_lines = 0
-                    ignore_content = False
-                    packet_count += 1
-                    if packet_count % packet_sparsity != 0:
-                        ignore_content = True
-                else:
-                    # Discard payload for other type (MAC, etc.) packets
-                    ignore_content = True
-                    # for such packets, just keep the header
-                    mac_headers.append(line) #.strip())
-
-            if ignore_content or comment_pattern.match(line):
-                # Skip commented-lines and MAC payload
-                continue
-
-            if payload_lines <= max_payload_lines:
-                # include only up to 16*max_payload_lines
-                # bytes for packet ID
-                for index in matching_indices:
-                    ip_lines[index].append(line) #.strip())
-                payload_lines += 1
-
-    return ip_lines, mac_headers
+    consumer = IntervalConsumer(time_intervals_dt)
+    scan_log_file(unit, filepath, [consumer])
+    return consumer.result()
 
 def extract_mme_entries_from_file(unit, filepath, time_samples_dt, sample_idx, tolerance_seconds = sampling_window/2):
-    # Process file and return MAC packet lines, time indexed IP packets
-    # represented by bitwise hex digit concatenation of their payload.
-    # The packets' timestamps are subjects to constraints
-
-    if debug_mode: print('[logflatten] Now locally processing: ', end='')
-    if debug_mode: print (filepath)
-
-    # Load log file
-    with open(filepath, "r") as file:
-        log_content = file.readlines()
-
-    # Get per unit UEbox/Callbox parameters
-    _,log_filename_prefix,_,_,_,_,_ = remote_params(unit)
-
-    # Regex for commented lines to ignore
-    comment_pattern = re.compile(r'^\s*(?:#.*)?$')
-
-    # Regex timestamps patterns to match
-    timestamp_pattern = re.compile(r'^\d{2}:\d{2}:\d{2}\.\d{3}')
-
-    # store only ip packets here
-    ip_lines = []
-
-    # store remaining packets (MAC, etc.) here
-    mac_headers = []
-
-    # payload line (amari log format) counter
-    payload_lines = 0
-
-    # specify up to how many bytes will be used for packet ID
-    max_payload_lines = 3
-
-    # Flag to indicate when to ignore lines
-    ignore_content = False
-
-    # Flag to indicate when to append lines
-    append_mode = False
-
-    # Count (IP) packets of interest; we may want to downsample
-    packet_count = 0
-
-    # Define sparsity differently for each unit
-    packet_sparsity = 1 # unit_packet_sparsity[unit]
-
-    sample_timestamp = []
-
-    filename_date = filepath.split(log_filename_prefix)[-1].split(".")[0]
-    if filename_date == 'log':
-        mtime = os.path.getmtime(filepath)
-        last_modified_time = datetime.fromtimestamp(mtime)
-        filename_date = last_modified_time.strftime("%Y%m%d")
-
-    for line in log_content:
-        if sample_idx >= len(time_samples_dt):
-            break
-        match = re.search(r'^\d{2}:\d{2}:\d{2}\.\d{3}', line)
-        if match:
-            # Check if timestamp if acceptable
-            append_mode = False
-            # Amarisoft logs timestamps contain only relative time from the start of day
-            timestamp_str = match.group()
-            # Augment it by date for robustness
-            str_timestamp = filename_date + "." + timestamp_str
-            timestamp = datetime.strptime(str_timestamp, "%Y%m%d.%H:%M:%S.%f")
-            # print (f"Looking for: {time_samples_dt[sample_idx]}, encountered {timestamp}")
-            if ip_id in line and abs((time_samples_dt[sample_idx] - timestamp).total_seconds()) <= tolerance_seconds:
-                # Flag packet if its timestamp is within sample range
-                # print(f"Looking for: {time_samples_dt[sample_idx]}, found {timestamp}[{sample_idx}]")
-                append_mode = True
-                sample_idx += 1
-                sample_timestamp.append(timestamp)
-                # print (line)
-            elif (timestamp - time_samples_dt[sample_idx]).total_seconds() > tolerance_seconds:
-                # Skip sample if no sample within tolerance window is found
-                sample_idx += 1
-
-        if append_mode:
-            # Store content only for flagged/acceptable packets
-            if match:
-                if ip_id in line:
-                    # Collect payload for IP packets
-                    payload_lines = 0
-                    ignore_content = False
-                    packet_count += 1
-                    if packet_count % packet_sparsity != 0:
-                        ignore_content = True
-                else:
-                    # Discard payload for other type (MAC, etc.) packets
-                    ignore_content = True
-
-            if ignore_content or comment_pattern.match(line):
-                # Skip commented-lines and MAC payload
-                continue
-
-            if payload_lines <= max_payload_lines:
-                # include only up to 16*max_payload_lines
-                # bytes for packet ID
-                ip_lines.append(line) #.strip())
-                payload_lines += 1
-
-    return ip_lines, sample_timestamp, sample_idx
-
+    # Process file and return IP packet lines sampled around time_samples_dt,
+    # their actual timestamps and the index of the next sample to look for
+    consumer = SampleConsumer(time_samples_dt, sample_idx, tolerance_seconds)
+    scan_log_file(unit, filepath, [consumer])
+    return consumer.result()
 
 def extract_entries_since_time(unit, start_time):
-    # Set this to True, to load logs files from local folder
-    isLocal = False
-
-    # Get per unit UEbox/Callbox parameters
-    ssh_logs_mount_point, _, remote_file_path, remote_host, remote_username, \
-    remote_auth_key, remote_directory = remote_params(unit)
-
-    # Check directory where files post-log-rotation are stored
-    log_files = get_log_directory(unit, isLocal)
-
-    # To decide which logs are necessary, it is important to
-    # take the latest log's timestamps into account
-    if not isLocal:
-        # Fetch current log file /tmp/{ue0,mme}.log
-        local_filepath = fetch_latest_log(unit)
-        if local_filepath:
-            basename = os.path.basename(local_filepath)
-            # latest log's timestamp can be appended to sorted list
-            log_files.append(basename)
-    else:
-        # Take separately stored latest/current log, too
-        basename = os.path.basename(remote_file_path)
-        # latest log's timestamp can be appended to sorted list
-        log_files.append(basename)
-
-    # Perform binary search on the log filenames' timestamps
-    latest_file = find_latest_file_before_time(unit, log_files, start_time)
-
-    if latest_file:
-        # Find the index of the latest_file in the sorted list
-        index_of_latest_file = log_files.index(latest_file)
-
-        if debug_mode: print(f"[logflatten] Remote files of interest:", end=' ')
-        if debug_mode: print(log_files[index_of_latest_file:])
-
-        if not isLocal:
-            # Fetch remote logs: (i) Files indicated by binary search, except
-            # for the current log in /tmp/{ue0,mme}.log, which has been already copied
-            target_files = log_files[index_of_latest_file:-1]
-            local_logs = fetch_remote_files(unit, target_files)
-            if local_filepath:
-                local_logs.append(local_filepath)
-
-        else:
-            # Process logs that are accessible via the current file system;
-            # this works with sshfs too.
-            local_logs = [os.path.join(ssh_logs_mount_point, filename) \
-                for filename in log_files[index_of_latest_file:]]
-
-        ip_entries = []
-        mac_entries = []
-        for filepath in local_logs:
-            # Now that all logs of interest are accesible locally, process them
-            ip_lines, mac_headers = extract_entries_from_file(unit, filepath, start_time, datetime.now())
-            ip_entries.extend(ip_lines)
-            mac_entries.extend(mac_headers)
-
-        return ip_entries, list(reversed(mac_entries))
-
-    else:
-        return [], []
+    snapshot = LogSnapshot()
+    consumer = snapshot.register(unit, MacHeaderConsumer(start_time))
+    snapshot.scan(unit)
+    ip_entries, mac_entries = consumer.result()
+    return ip_entries, list(reversed(mac_entries))
 
 def extract_entries_from_file(unit, filepath, start_time, end_time):
     # Process file and return MAC packet lines, time indexed IP packets
     # represented by bitwise hex digit concatenation of their payload.
     # The packets' timestamps are subjects to constraints
-
-    if debug_mode: print('[logflatten] Now locally processing: ', end='')
-    if debug_mode: print (filepath)
-
-    # Load log file
-    with open(filepath, "r") as file:
-        log_content = file.readlines()
-
-    # Get per unit UEbox/Callbox parameters
-    _,log_filename_prefix,_,_,_,_,_ = remote_params(unit)
-
-    # Regex for commented lines to ignore
-    comment_pattern = re.compile(r'^\s*(?:#.*)?$')
-
-    # Regex timestamps patterns to match
-    timestamp_pattern = re.compile(r'^\d{2}:\d{2}:\d{2}\.\d{3}')
-
-    # store only ip packets here
-    ip_lines = []
-
-    # store remaining packets (MAC, etc.) here
-    mac_headers = []
-
-    # payload line (amari log format) counter
-    payload_lines = 0
-
-    # specify up to how many bytes will be used for packet ID
-    max_payload_lines = 3
-
-    # Flag to indicate when to ignore lines
-    ignore_content = False
-
-    # Flag to indicate when to append lines
-    append_mode = False
-
-    # Count (IP) packets of interest; we may want to downsample
-    packet_count = 0
-
-    # Define sparsity differently for each unit
-    packet_sparsity = 1 # unit_packet_sparsity[unit]
-
-    # Amarisoft logs timestamps contain only relative time from the start of day
-    filename_date = filepath.split(log_filename_prefix)[-1].split(".")[0]
-    if filename_date == 'log':
-        mtime = os.path.getmtime(filepath)
-        last_modified_time = datetime.fromtimestamp(mtime)
-        filename_date = last_modified_time.strftime("%Y%m%d")
-
-    for line in log_content:
-        if not append_mode:
-            match = re.search(r'^\d{2}:\d{2}:\d{2}\.\d{3}', line)
-            if match:
-                timestamp_str = match.group()
-                # Augment timestamp to include calendar date...
-                str_timestamp = filename_date + "." + timestamp_str
-                timestamp = datetime.strptime(str_timestamp, "%Y%m%d.%H:%M:%S.%f")
-                if start_time <= timestamp <= end_time:
-                    append_mode = True
-
-        if append_mode:
-            if timestamp_pattern.match(line):
-                if ip_id in line:
-                    # Collect payload for IP packets
-                    payload_lines = 0
-                    ignore_content = False
-                    packet_count += 1
-                    if packet_count % packet_sparsity != 0:
-                        ignore_content = True
-                else:
-                    # Discard payload for other type (MAC, etc.) packets
-                    ignore_content = True
-                    # for such packets, just keep the header
-                    mac_headers.append(line) #.strip())
-
-            if ignore_content or comment_pattern.match(line):
-                # Skip commented-lines and MAC payload
-                continue
-
-            if payload_lines <= max_payload_lines:
-                # include only up to 16*max_payload_lines
-                # bytes for packet ID
-                ip_lines.append(line) #.strip())
-                payload_lines += 1
-
-    return ip_lines, mac_headers
+    consumer = MacHeaderConsumer(start_time, end_time)
+    scan_log_file(unit, filepath, [consumer])
+    return consumer.result()
 
 def remove_all_files_from_directory(directory_path):
     try:
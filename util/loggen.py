@@ -0,0 +1,173 @@
+import os
+import sys
+import time
+import random
+from datetime import datetime, timedelta
+from .parameters import ip_id
+from .packets import bytes_per_line
+
+ms_per_day = 24 * 3600 * 1000
+
+# Header of the logs, as written by lteue/lteenb on start or rotation
+log_headers = {
+    "ue0": "# lteue version 2021-09-18, gcc 9.2.1\n",
+    "mme": "# lteenb version 2021-09-18, gcc 9.2.1\n",
+}
+log_format = ("# Log file format:\n"
+              "# time layer dir ue_id {cell_id rnti sfn channel:} message\n"
+              "# Started\n")
+
+def log_timestamp(ms):
+    # "HH:MM:SS.mmm" of ms from the start of day
+    ms %= ms_per_day
+    return f"{ms // 3600000:02d}:{ms // 60000 % 60:02d}:{ms // 1000 % 60:02d}.{ms % 1000:03d}"
+
+def packet_record(timestamp, ue_id, payload, dump_bytes=64):
+    # IP packet record: header and hex dump of the first dump_bytes bytes
+    lines = [f"{timestamp} {ip_id} {ue_id:04x} len={len(payload)} IPv4 10.0.0.{ue_id % 256} > 192.168.2.2\n"]
+    for offset in range(0, min(len(payload), dump_bytes), bytes_per_line):
+        chunk = payload[offset:offset + bytes_per_line]
+        hex_bytes = ' '.join(f"{byte:02x}" for byte in chunk)
+        lines.append(f"  {offset:04x}:  {hex_bytes}  {'.' * len(chunk)}\n")
+    return ''.join(lines)
+
+def mac_ul_record(timestamp, ue_id, rng):
+    # MAC UL header with a short or long BSR, as in the sample logs; b= are
+    # indices into bsr_list, one per logical channel group for long BSRs
+    if rng.random() < 0.1:
+        bsr = "LBSR: b=" + " ".join(str(rng.randrange(20)) for _ in range(4))
+    else:
+        bsr = f"SBSR: lcg=3 b={rng.randrange(40)}"
+    return f"{timestamp} [MAC] UL {ue_id:04x} 00 {bsr} LCID:3 len={rng.randrange(2, 5000)} PAD: len={rng.randrange(1, 4000)} \n"
+
+def mac_dl_record(timestamp, ue_id, rng):
+    return f"{timestamp} [MAC] DL {ue_id:04x} 00 LCID:3 len=2 PAD: len={rng.randrange(1, 400)} \n"
+
+class RotatingLog:
+    # Log of a unit written in time order: the live log is <prefix>log, and
+    # once it exceeds rotate_bytes it is renamed after its first timestamp,
+    # <prefix>log.YYYYMMDD.HH:MM:SS, as lteue/lteenb do
+    def __init__(self, directory, unit, day, rotate_bytes=None):
+        self.directory = directory
+        self.unit = unit
+        self.day = day
+        self.rotate_bytes = rotate_bytes
+        self.live_path = os.path.join(directory, f"{unit}.log")
+        self.paths = []
+        self.total_bytes = 0
+        self.file = None
+
+    def open(self, ms):
+        self.first_ms = ms
+        self.file = open(self.live_path, 'w')
+        self.size = self.file.write(log_headers[self.unit] + log_format)
+
+    def write(self, ms, record):
+        if self.file is None:
+            self.open(ms)
+        elif self.rotate_bytes and self.size >= self.rotate_bytes:
+            self.rotate()
+            self.open(ms)
+        self.size += self.file.write(record)
+
+    def rotate(self):
+        self.file.close()
+        self.total_bytes += self.size
+        date = self.day + timedelta(milliseconds=self.first_ms)
+        path = os.path.join(self.directory, f"{self.unit}.log.{date.strftime('%Y%m%d')}.{log_timestamp(self.first_ms)[:8]}")
+        os.replace(self.live_path, path)
+        self.paths.append(path)
+
+    def close(self):
+        # Return the logs in time order, the live one last
+        if self.file is not None:
+            self.file.close()
+            self.total_bytes += self.size
+            self.paths.append(self.live_path)
+            self.file = None
+        return self.paths
+
+def write_log_pair(directory, num_ues=10, packet_rate=50, duration=10, start_time=None, rotate_bytes=None,
+                   target_bytes=None, mac_rate=200, payload_size=84, mean_delays=None, seed=0, record_delays=False):
+    # Write the UEbox (ue0) and Callbox (mme) logs of num_ues UEs, each sending
+    # packet_rate UL packets and logging mac_rate MAC UL and DL headers per
+    # second, for duration seconds from start_time (default: duration seconds
+    # ago), or until the UEbox logs reach target_bytes. Packets are logged by
+    # the Callbox after a per-UE exponential delay (ms) of mean mean_delays[u]
+    # under a ue_id of its own, as on the testbed. Return the log paths per
+    # unit, the time span, the number of packets and, if record_delays, the
+    # delays per UE.
+    rng = random.Random(seed)
+    if start_time is None:
+        start_time = datetime.now().replace(microsecond=0) - timedelta(seconds=duration)
+    if target_bytes:
+        duration = None
+    if mean_delays is None:
+        mean_delays = [10 + 5 * ue for ue in range(num_ues)]
+    day = start_time.replace(hour=0, minute=0, second=0, microsecond=0)
+    start_ms = int((start_time - day).total_seconds() * 1000)
+    tx_log = RotatingLog(directory, "ue0", day, rotate_bytes)
+    rx_log = RotatingLog(directory, "mme", day, rotate_bytes)
+    delays = [[] for _ in range(num_ues)] if record_delays else None
+    pending = []  # Callbox records (ms, record) not yet logged
+    packets = 0
+
+    second = 0
+    while (duration is None or second < duration) and \
+            (target_bytes is None or tx_log.total_bytes + (tx_log.size if tx_log.file else 0) < target_bytes):
+        block_ms = start_ms + 1000 * second
+        tx = []
+        for ue in range(num_ues):
+            for _ in range(mac_rate):
+                ms = block_ms + rng.randrange(1000)
+                tx.append((ms, mac_ul_record if rng.random() < 0.5 else mac_dl_record, ue + 1))
+                if rng.random() < 0.25:
+                    # The Callbox logs a share of the MAC headers, too
+                    ms += rng.randrange(1, 10)
+                    pending.append((ms, mac_ul_record(log_timestamp(ms), ue + 17, rng)))
+            for _ in range(packet_rate):
+                ms = block_ms + rng.randrange(1000)
+                payload = rng.getrandbits(8 * payload_size).to_bytes(payload_size, 'big')
+                delay = int(rng.expovariate(1 / mean_delays[ue])) + 1
+                tx.append((ms, payload, ue + 1))
+                pending.append((ms + delay, packet_record(log_timestamp(ms + delay), ue + 17, payload)))
+                if record_delays:
+                    delays[ue].append(delay)
+                packets += 1
+        tx.sort(key=lambda event: event[0])
+        for ms, content, ue_id in tx:
+            timestamp = log_timestamp(ms)
+            record = packet_record(timestamp, ue_id, content) if isinstance(content, bytes) \
+                else content(timestamp, ue_id, rng)
+            tx_log.write(ms, record)
+
+        # Callbox records logged within this second
+        pending.sort(key=lambda event: event[0])
+        block_end = block_ms + 1000
+        logged = 0
+        while logged < len(pending) and pending[logged][0] < block_end:
+            rx_log.write(*pending[logged])
+            logged += 1
+        del pending[:logged]
+        second += 1
+
+    for ms, record in pending:
+        rx_log.write(ms, record)
+    end_time = start_time + timedelta(seconds=second)
+    return {"ue0": tx_log.close(), "mme": rx_log.close()}, (start_time, end_time), packets, delays
+
+if __name__ == "__main__":
+    # Write a log pair, e.g.:
+    # python3 -m util.loggen logs/synthetic 10 50 60 [rotate_bytes]
+    directory = sys.argv[1] if len(sys.argv) > 1 else os.path.join('logs', 'synthetic')
+    num_ues, packet_rate, duration = [int(value) for value in sys.argv[2:5]] if len(sys.argv) > 4 else (10, 50, 10)
+    rotate_bytes = int(sys.argv[5]) if len(sys.argv) > 5 else None
+    os.makedirs(directory, exist_ok=True)
+    start = time.time()
+    paths, (start_time, end_time), packets, _ = write_log_pair(directory, num_ues, packet_rate, duration,
+                                                               rotate_bytes=rotate_bytes)
+    elapsed = time.time() - start
+    sizes = {unit: sum(os.path.getsize(path) for path in unit_paths) for unit, unit_paths in paths.items()}
+    print(f"[loggen] {num_ues} UEs, {packets} packets from {start_time} to {end_time}: "
+          f"{', '.join(f'{unit} {len(paths[unit])} files of {sizes[unit] / 1e6:.1f} MB' for unit in paths)} "
+          f"written in {elapsed:.1f} seconds")
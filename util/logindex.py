@@ -0,0 +1,198 @@
+import os
+import sys
+import math
+import zlib
+import time
+import struct
+from bisect import bisect_left, bisect_right
+from .logscan import LogScanner, timestamp_bytes_pattern, ms_of_day
+from .parameters import debug_mode
+
+# Every index_stride-th timestamped line of a log gets an index entry
+index_stride = 256
+
+# Sidecar index files are stored next to the log as <log>.idx, for the logs
+# of index_directories only
+index_suffix = '.idx'
+
+# Directories whose logs this process owns (e.g., the log cache): only their
+# indexes are persisted; those of other logs (the local copies of the live
+# logs, sshfs mounts, exported or tracked logs) are kept in memory
+index_directories = set()
+
+# Header: magic, stride, indexed bytes, timestamped lines since the last
+# entry, CRC32 of the first head_length bytes of the log (detects rewrites)
+header_format = '<4sIQII'
+header_magic = b'AMIX'
+head_length = 4096
+
+# Entry: milliseconds from the start of the log's first day, byte offset
+entry_format = '<IQ'
+
+ms_per_day = 24 * 3600 * 1000
+
+# In-memory indexes of this process, keyed by log path
+log_indexes = {}
+
+class LogIndex:
+    # Sparse timestamp index of an Amarisoft log: the byte offset of every
+    # index_stride-th timestamped line, persisted in a compact binary sidecar
+    # if the log is owned (see index_directories). Rotated logs are indexed
+    # once; the live log is indexed incrementally.
+    def __init__(self, filepath, stride=index_stride):
+        self.filepath = filepath
+        self.index_path = filepath + index_suffix if owns_log(filepath) else None
+        self.stride = stride
+        self.reset()
+        self.load()
+
+    def reset(self):
+        self.ms = []
+        self.offsets = []
+        self.indexed_upto = 0
+        self.pending = 0
+        self.head_crc = 0
+        self.saved_entries = 0
+
+    def file_head_crc(self):
+        with open(self.filepath, 'rb') as file:
+            return zlib.crc32(file.read(head_length))
+
+    def load(self):
+        if self.index_path is None:
+            return
+        try:
+            with open(self.index_path, 'rb') as file:
+                data = file.read()
+        except OSError:
+            return
+        header_size = struct.calcsize(header_format)
+        if len(data) < header_size:
+            return
+        magic, stride, indexed_upto, pending, head_crc = struct.unpack_from(header_format, data)
+        if magic != header_magic or stride != self.stride:
+            return
+        entry_size = struct.calcsize(entry_format)
+        entries_size = (len(data) - header_size) // entry_size * entry_size
+        for ms, offset in struct.iter_unpack(entry_format, data[header_size:header_size + entries_size]):
+            self.ms.append(ms)
+            self.offsets.append(offset)
+        self.indexed_upto, self.pending, self.head_crc = indexed_upto, pending, head_crc
+        self.saved_entries = len(self.ms)
+
+    def save(self):
+        if self.index_path is None:
+            return
+        header = struct.pack(header_format, header_magic, self.stride, self.indexed_upto,
+                             self.pending, self.head_crc)
+        entries = b''.join(struct.pack(entry_format, ms, offset) for ms, offset in
+                           zip(self.ms[self.saved_entries:], self.offsets[self.saved_entries:]))
+        try:
+            if self.saved_entries and os.path.exists(self.index_path):
+                # Append the new entries and refresh the header in place
+                with open(self.index_path, 'r+b') as file:
+                    file.write(header)
+                    file.seek(0, os.SEEK_END)
+                    file.write(entries)
+            else:
+                with open(self.index_path, 'wb') as file:
+                    file.write(header)
+                    file.write(entries)
+            self.saved_entries = len(self.ms)
+        except OSError as e:
+            # e.g., a read-only sshfs mount; keep the index in memory
+            if debug_mode: print(f"[logindex] Could not store {self.index_path}: {e}")
+
+    def update(self):
+        # Index the bytes appended to the log since the last update
+        size = os.path.getsize(self.filepath)
+        if size == self.indexed_upto:
+            return self
+        head_crc = self.file_head_crc()
+        if size < self.indexed_upto or (self.indexed_upto and head_crc != self.head_crc):
+            # The log has been truncated or rewritten
+            self.reset()
+        self.head_crc = head_crc
+
+        day_offset = self.ms[-1] // ms_per_day * ms_per_day if self.ms else 0
+        with LogScanner(self.filepath) as scanner:
+            for pos, line in scanner.lines(self.indexed_upto, size):
+                if not line.endswith(b'\n'):
+                    # Leave a partially written last line for the next update
+                    break
+                self.indexed_upto = pos + len(line)
+                if not timestamp_bytes_pattern.match(line):
+                    continue
+                if self.pending % self.stride == 0:
+                    ms = ms_of_day(line) + day_offset
+                    if self.ms and ms < self.ms[-1] - ms_per_day // 2:
+                        # Amarisoft timestamps wrap around at midnight
+                        day_offset += ms_per_day
+                        ms += ms_per_day
+                    self.ms.append(ms)
+                    self.offsets.append(pos)
+                    self.pending = 0
+                self.pending += 1
+        self.save()
+        return self
+
+    def window(self, start_ms, end_ms=None):
+        # Return the byte range [start, end) of the log that contains all
+        # lines timestamped within [start_ms, end_ms]; end is None when the
+        # range extends to the end of the log. One extra entry is kept on
+        # each side to tolerate slightly out of order timestamps.
+        if not self.ms:
+            return 0, None
+        i = bisect_left(self.ms, start_ms) - 2
+        start = self.offsets[i] if i >= 0 else 0
+        if end_ms is None:
+            return start, None
+        j = bisect_right(self.ms, end_ms) + 1
+        end = self.offsets[j] if j < len(self.offsets) else None
+        return start, end
+
+    def reference_ms(self, offset):
+        # Time of the last indexed line at or before offset, None if none
+        i = bisect_right(self.offsets, offset) - 1
+        return self.ms[i] if i >= 0 else None
+
+def owns_log(filepath):
+    # Whether the log lives in one of the index_directories
+    directory = os.path.dirname(os.path.abspath(filepath))
+    return any(os.path.commonpath([directory, os.path.abspath(owned)]) == os.path.abspath(owned)
+               for owned in index_directories)
+
+def get_log_index(filepath):
+    # Return the (cached and up to date) index of a log file
+    index = log_indexes.get(filepath)
+    if index is None:
+        index = log_indexes[filepath] = LogIndex(filepath)
+    return index.update()
+
+def discard_log_index(filepath):
+    # Forget the index of a log that is about to be rewritten
+    log_indexes.pop(filepath, None)
+    if owns_log(filepath) and os.path.exists(filepath + index_suffix):
+        os.remove(filepath + index_suffix)
+
+def window_ms(filedate, start_dt, end_dt=None):
+    # Express [start_dt, end_dt] in milliseconds from the start of filedate
+    # (YYYYMMDD), the day Amarisoft log timestamps are relative to
+    day = time.mktime(time.strptime(filedate, "%Y%m%d"))
+    start_ms = max(0, math.ceil(round((start_dt.timestamp() - day) * 1000, 3)))
+    end_ms = None if end_dt is None else max(0, math.floor(round((end_dt.timestamp() - day) * 1000, 3)))
+    return start_ms, end_ms
+
+def log_window(filepath, filedate, start_dt, end_dt=None):
+    # Byte range of the log holding the lines within [start_dt, end_dt]
+    return get_log_index(filepath).window(*window_ms(filedate, start_dt, end_dt))
+
+if __name__ == "__main__":
+    # Build the indexes of the given logs (stored only for the logs of the
+    # log cache, see index_directories), e.g.:
+    # python3 -m util.logindex logs/ue0.log.20231122.15:41:16
+    for filepath in sys.argv[1:]:
+        start_time = time.time()
+        index = get_log_index(filepath)
+        print(f"[logindex] {filepath}: {len(index.ms)} entries over {index.indexed_upto} bytes "
+              f"in {time.time() - start_time:.3f} seconds")
@@ -0,0 +1,142 @@
+import os
+import re
+import sys
+import mmap
+import time
+import tracemalloc
+
+# Byte-level counterparts of the regexes used when processing logs
+timestamp_bytes_pattern = re.compile(rb'^\d{2}:\d{2}:\d{2}\.\d{3}')
+comment_bytes_pattern = re.compile(rb'^\s*(?:#.*)?$')
+
+def ms_of_day(line):
+    # Milliseconds from the start of day of a line starting with a timestamp
+    # "HH:MM:SS.mmm", computed arithmetically from its digits
+    return ((int(line[0:2]) * 60 + int(line[3:5])) * 60 + int(line[6:8])) * 1000 + int(line[9:12])
+
+class LogScanner:
+    # Scan a log file line by line over a read-only memory map of its bytes,
+    # so that the file is never materialized as a list of Python strings.
+    # Lines are handed out as bytes (newline included); callers decode only
+    # the lines they keep.
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.file = open(filepath, "rb")
+        self.size = os.fstat(self.file.fileno()).st_size
+        # An empty file cannot be memory mapped
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.file.close()
+
+    def read(self, start=0, end=None):
+        # Return the bytes in [start, end)
+        if self.map is None:
+            return b''
+        end = self.size if end is None else min(end, self.size)
+        return self.map[start:end]
+
+    def record_start(self, start, stop, end):
+        # Offset at which to end a chunk [start, stop) so that it holds whole
+        # records: the start of the last timestamped line in (start, stop],
+        # or else of the first one after stop, or end if there is none
+        pos = stop
+        while pos > start:
+            newline = self.map.rfind(b'\n', start, pos)
+            if newline < 0:
+                break
+            if timestamp_bytes_pattern.match(self.map[newline + 1:newline + 13]):
+                return newline + 1
+            pos = newline
+        pos = stop
+        while pos < end:
+            newline = self.map.find(b'\n', pos, end)
+            if newline < 0 or newline + 1 >= end:
+                break
+            if timestamp_bytes_pattern.match(self.map[newline + 1:newline + 13]):
+                return newline + 1
+            pos = newline + 1
+        return end
+
+    def chunk_ranges(self, start=0, end=None, size=1 << 24):
+        # Split [start, end) into ranges of about size bytes that end at
+        # record boundaries, so that each can be parsed on its own
+        if self.map is None:
+            return []
+        end = self.size if end is None else min(end, self.size)
+        ranges = []
+        while start < end:
+            stop = end if start + size >= end else self.record_start(start, start + size, end)
+            ranges.append((start, stop))
+            start = stop
+        return ranges
+
+    def lines(self, start=0, end=None):
+        # Yield (offset, line) for the lines starting in [start, end)
+        if self.map is None:
+            return
+        end = self.size if end is None else min(end, self.size)
+        self.map.seek(start)
+        readline = self.map.readline
+        pos = start
+        while pos < end:
+            line = readline()
+            yield pos, line
+            pos += len(line)
+
+def scan_count(filepath, marker):
+    # Count timestamped lines and lines containing marker
+    headers = matches = 0
+    with LogScanner(filepath) as scanner:
+        for _, line in scanner.lines():
+            if timestamp_bytes_pattern.match(line):
+                headers += 1
+                if marker in line:
+                    matches += 1
+    return headers, matches
+
+def readlines_count(filepath, marker):
+    # Same as scan_count(), on top of the former readlines() approach
+    marker = marker.decode()
+    headers = matches = 0
+    with open(filepath, "r") as file:
+        log_content = file.readlines()
+    for line in log_content:
+        if re.match(r'^\d{2}:\d{2}:\d{2}\.\d{3}', line):
+            headers += 1
+            if marker in line:
+                matches += 1
+    return headers, matches
+
+def measure(function, *args):
+    # Return the result, the elapsed time and, from a second traced run,
+    # the peak allocated memory of function(*args)
+    start_time = time.time()
+    result = function(*args)
+    elapsed = time.time() - start_time
+    tracemalloc.start()
+    function(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+if __name__ == "__main__":
+    # Report scan throughput for the sample logs, e.g.:
+    # python3 -m util.logscan logs/ue0.log logs/ue0.log.20231122.15:41:16
+    filepaths = sys.argv[1:] or [os.path.join('logs', name) for name in sorted(os.listdir('logs'))
+                                 if os.path.isfile(os.path.join('logs', name))]
+    for filepath in filepaths:
+        megabytes = os.path.getsize(filepath) / 1e6
+        for name, method in (("mmap", scan_count), ("readlines", readlines_count)):
+            (headers, matches), elapsed, peak = measure(method, filepath, b'[MAC]')
+            print(f"[logscan] {name:9s} {filepath}: {megabytes:.2f} MB, {headers} headers, "
+                  f"{matches} [MAC] lines, {megabytes / elapsed:.1f} MB/s, peak memory {peak / 1e6:.2f} MB")
@@ -0,0 +1,210 @@
+import os
+import sys
+import time
+import shlex
+import socket
+import threading
+import subprocess
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+from .parameters import debug_mode
+from .logscan import timestamp_bytes_pattern, ms_of_day
+
+ms_per_day = 24 * 3600 * 1000
+
+# Rough per record bookkeeping cost on top of its bytes (list slots, objects)
+record_overhead = 100
+
+# Slack around queried time ranges for slightly out of order timestamps
+query_slack_ms = 100
+
+class LocalStream:
+    # Local stand-in for a remote channel: a tail -F subprocess
+    def __init__(self, command):
+        self.process = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE)
+
+    def recv(self, size):
+        return os.read(self.process.stdout.fileno(), size)
+
+    def close(self):
+        self.process.kill()
+        self.process.wait()
+        self.process.stdout.close()
+
+class LogStream:
+    # Keep a tail -F stream of a live Amarisoft log open in a background
+    # thread and buffer the records (timestamped line and its payload lines)
+    # of the last retention seconds, within memory_budget bytes. Time ranges
+    # covered by the buffer can then be read without any network round trip.
+    def __init__(self, unit, path, open_stream, retention, memory_budget, chunk_size=1 << 16):
+        # open_stream(command) returns an object with recv(size) and close()
+        self.unit = unit
+        self.command = f"tail -F -n 0 {shlex.quote(path)}"
+        self.open_stream = open_stream
+        self.retention_ms = retention * 1000
+        self.memory_budget = memory_budget
+        self.chunk_size = chunk_size
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.stream = None
+        self.thread = None
+        # Records, oldest first, from index head on; epoch ms in parallel
+        self.ms = []
+        self.records = []
+        self.head = 0
+        self.nbytes = 0
+        self.partial = b''
+        # Epoch ms from which the buffer holds every record (None: no stream)
+        self.since = None
+        self.received = 0
+        self.evicted_by_age = 0
+        self.evicted_by_memory = 0
+        self.reconnects = 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name=f"logstream-{self.unit}", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        stream = self.stream
+        if stream is not None:
+            stream.close()
+        if self.thread is not None:
+            self.thread.join()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.stream = self.open_stream(self.command)
+                with self.lock:
+                    # Anything logged before (re)connecting may be missing
+                    self.partial = b''
+                    self.since = time.time() * 1000
+                while not self.stopped.is_set():
+                    try:
+                        data = self.stream.recv(self.chunk_size)
+                    except socket.timeout:
+                        continue
+                    if not data:
+                        break
+                    self.append(data)
+            except Exception as e:
+                if debug_mode: print(f"[logstream] {self.unit}: stream failed: {e}")
+            finally:
+                with self.lock:
+                    self.since = None
+                if self.stream is not None and not self.stopped.is_set():
+                    self.stream.close()
+                self.stream = None
+            if not self.stopped.is_set():
+                self.reconnects += 1
+                self.stopped.wait(1)
+
+    def epoch_ms(self, line, now_ms):
+        # Absolute time of a line, given that it has just been logged;
+        # Amarisoft timestamps are relative to the start of (local) day
+        day_start = time.mktime(datetime.fromtimestamp(now_ms / 1000).date().timetuple()) * 1000
+        ms = day_start + ms_of_day(line)
+        if ms - now_ms > ms_per_day // 2:
+            # Logged just before midnight
+            ms -= ms_per_day
+        return ms
+
+    def append(self, data):
+        # Split received bytes into records and evict old ones
+        now_ms = time.time() * 1000
+        with self.lock:
+            data = self.partial + data
+            complete = data.rfind(b'\n') + 1
+            self.partial = data[complete:]
+            for line in data[:complete].splitlines(keepends=True):
+                if timestamp_bytes_pattern.match(line):
+                    self.ms.append(self.epoch_ms(line, now_ms))
+                    self.records.append(line)
+                    self.nbytes += len(line) + record_overhead
+                elif len(self.records) > self.head:
+                    # Payload line of the latest record
+                    self.records[-1] += line
+                    self.nbytes += len(line)
+            self.received += complete
+            self.evict()
+
+    def evict(self):
+        newest = self.ms[-1] if len(self.ms) > self.head else None
+        while len(self.ms) > self.head:
+            if newest - self.ms[self.head] > self.retention_ms:
+                self.evicted_by_age += 1
+            elif self.nbytes > self.memory_budget:
+                self.evicted_by_memory += 1
+            else:
+                break
+            self.nbytes -= len(self.records[self.head]) + record_overhead
+            self.since = max(self.since or 0, self.ms[self.head])
+            self.records[self.head] = None
+            self.head += 1
+        if self.head > len(self.ms) // 2:
+            # Compact the lists
+            del self.ms[:self.head]
+            del self.records[:self.head]
+            self.head = 0
+
+    def covers(self, start_time):
+        # True if every record logged since start_time is buffered
+        with self.lock:
+            return self.since is not None and self.since <= start_time.timestamp() * 1000
+
+    def query(self, start_time, end_time=None):
+        # Return the calendar date (YYYYMMDD) the records' timestamps are
+        # relative to and the records within [start_time, end_time] as log bytes
+        with self.lock:
+            i = bisect_left(self.ms, start_time.timestamp() * 1000 - query_slack_ms, self.head)
+            j = len(self.ms) if end_time is None else \
+                bisect_right(self.ms, end_time.timestamp() * 1000 + query_slack_ms, i)
+            if i == j:
+                return None, b''
+            filedate = datetime.fromtimestamp(self.ms[i] / 1000).strftime("%Y%m%d")
+            return filedate, b''.join(self.records[i:j])
+
+    def stats(self):
+        with self.lock:
+            records = len(self.ms) - self.head
+            span = (self.ms[-1] - self.ms[self.head]) / 1000 if records else 0
+            return records, self.nbytes, span
+
+    def report(self):
+        records, nbytes, span = self.stats()
+        print(f"[logstream] {self.unit}: {records} records over {span:.1f} seconds, "
+              f"{nbytes / 1e6:.2f} of {self.memory_budget / 1e6:.2f} MB, {self.received} bytes received, "
+              f"{self.evicted_by_age} evicted by age, {self.evicted_by_memory} by memory, "
+              f"{self.reconnects} reconnects")
+
+if __name__ == "__main__":
+    # Replay a sample log into a file followed by a local tail -F stand-in, e.g.:
+    # python3 -m util.logstream logs/ue0.log
+    import tempfile
+    source = sys.argv[1] if len(sys.argv) > 1 else os.path.join('logs', 'ue0.log')
+    with open(source, 'rb') as file:
+        lines = file.readlines()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'ue0.log')
+        open(path, 'wb').close()
+        stream = LogStream('ue0', path, LocalStream, retention=2, memory_budget=1 << 20).start()
+        time.sleep(0.5)
+        with open(path, 'ab') as file:
+            for k in range(0, len(lines), 500):
+                file.write(b''.join(lines[k:k + 500]))
+                file.flush()
+                time.sleep(0.05)
+        time.sleep(0.5)
+        stream.stop()
+        stream.report()
+
+        # Read the last second, as done for BSR context
+        newest = datetime.fromtimestamp(stream.ms[-1] / 1000)
+        start_time = time.time()
+        filedate, chunk = stream.query(newest.replace(microsecond=0) - timedelta(seconds=1))
+        lines = chunk.count(b'\n')
+        print(f"[logstream] Last second: {lines} lines of {filedate} "
+              f"read in {(time.time() - start_time) * 1000:.3f} ms")
@@ -0,0 +1,125 @@
+import sys
+import time
+import random
+import numpy as np
+from .logfilter import max_payload_lines
+
+# Payload IDs are made of up to 16 bytes per payload line
+key_width = 16 * max_payload_lines
+
+def key_matrix(keys, width=key_width):
+    # Payload IDs (ints) as rows of width big-endian bytes, so that bytewise
+    # order is numeric order
+    data = b''.join(key.to_bytes(width, 'big') for key in keys)
+    return np.frombuffer(data, dtype=np.uint8).reshape(len(keys), width)
+
+def packet_arrays(packets):
+    # (payload ID, ms) pairs, as returned by parse_ip_packet_cluster(), as the
+    # (keys, ms, lengths, ue_ids) arrays of decode_ip_packets(); lengths and
+    # ue_ids are unknown
+    ms = np.array([ms for _, ms in packets], dtype=np.int64).reshape(-1)
+    unknown = np.full(len(ms), -1, dtype=np.int32)
+    return key_matrix([key for key, _ in packets]), ms, unknown, unknown.copy()
+
+def pack(window, keys, ms):
+    # Composite sort keys: window (4 bytes), payload ID and time (8 bytes),
+    # all big-endian, so that bytewise order is (window, ID, time) order.
+    # Rows have a fixed width, hence numpy's trailing NUL stripping is harmless.
+    n, width = keys.shape
+    packed = np.empty((n, 4 + width + 8), dtype=np.uint8)
+    packed[:, :4] = np.asarray(window, dtype='>u4').view(np.uint8).reshape(n, 4)
+    packed[:, 4:4 + width] = keys
+    packed[:, 4 + width:] = np.asarray(ms, dtype='>u8').view(np.uint8).reshape(n, 8)
+    return packed, packed.view(f'S{packed.shape[1]}').ravel()
+
+class PacketMatcher:
+    # Tx packets of all sample windows of a round, sorted by (window, payload
+    # ID, time) so that all Rx packets are matched by one searchsorted.
+    # Duplicate IDs within a window resolve to the nearest preceding Tx.
+    def __init__(self, windows):
+        # windows: per sample window, the (keys, ms, lengths, ue_ids) arrays
+        # of its Tx packets, see decode_ip_packets()
+        self.window_sizes = [len(packets[1]) for packets in windows]
+        window = np.repeat(np.arange(len(windows)), self.window_sizes)
+        keys = np.concatenate([packets[0] for packets in windows]) if windows else \
+            np.zeros((0, key_width), dtype=np.uint8)
+        ms = np.concatenate([packets[1] for packets in windows]) if windows else np.zeros(0, dtype=np.int64)
+        ue_ids = np.concatenate([packets[3] for packets in windows]) if windows else np.zeros(0, dtype=np.int32)
+        rows, packed = pack(window, keys, ms)
+        order = np.argsort(packed, kind='stable')
+        self.packed = packed[order]
+        self.prefix = rows[order, :-8]
+        self.ms = ms[order]
+        self.ue_ids = ue_ids[order]
+
+    def __len__(self):
+        return len(self.ms)
+
+    def delays(self, rx_packets, rx_windows=None):
+        # Match Rx packet i of the (keys, ms, lengths, ue_ids) arrays rx_packets
+        # against the Tx packets of window rx_windows[i] (by default, window
+        # i). Return the mask of matched packets and their delays (Rx - Tx time).
+        matched, delays, _ = self.match(rx_packets, rx_windows)
+        return matched, delays
+
+    def match(self, rx_packets, rx_windows=None):
+        # Same as delays(), also returning the ue_ids of the matched Tx packets
+        keys, rx_ms = rx_packets[0], rx_packets[1]
+        n = len(rx_ms)
+        rx_windows = np.arange(n) if rx_windows is None else np.asarray(rx_windows)
+        if not len(self.ms) or not n:
+            return np.zeros(n, dtype=bool), np.zeros(n, dtype=np.int64), np.full(n, -1, dtype=np.int32)
+        rows, packed = pack(rx_windows, keys, rx_ms)
+        prefix = rows[:, :-8]
+
+        def same_packet(index):
+            # Mask of Tx candidates index having the window and ID of the Rx packets
+            inside = (index >= 0) & (index < len(self.ms))
+            index = np.clip(index, 0, len(self.ms) - 1)
+            return inside & np.all(self.prefix[index] == prefix, axis=1)
+
+        # Latest Tx of the same window and ID at or before the Rx time, or
+        # else the earliest one after it
+        preceding = np.searchsorted(self.packed, packed, side='right') - 1
+        found_preceding = same_packet(preceding)
+        found_following = ~found_preceding & same_packet(preceding + 1)
+        matched = found_preceding | found_following
+        tx_index = np.clip(np.where(found_preceding, preceding, preceding + 1), 0, len(self.ms) - 1)
+        return matched, np.where(matched, rx_ms - self.ms[tx_index], 0), \
+            np.where(matched, self.ue_ids[tx_index], -1)
+
+if __name__ == "__main__":
+    # Compare with the former tree based matching, e.g.:
+    # python3 -m util.matcher 1000 10000 100000 1000000
+    from .e2estats import BSTree, AVLTree
+    sizes = [int(size) for size in sys.argv[1:]] or [10**3, 10**4, 10**5, 10**6]
+    lookups = 1000
+    random.seed(0)
+    sys.setrecursionlimit(10000)
+    for size in sizes:
+        packets = [(random.getrandbits(8 * key_width), ms) for ms in range(size)]
+        rx = [(random.choice(packets)[0] if k % 2 else random.getrandbits(8 * key_width), size + k)
+              for k in range(lookups)]
+
+        start_time = time.time()
+        matcher = PacketMatcher([packet_arrays(packets)])
+        built = time.time()
+        matched, delays = matcher.delays(packet_arrays(rx), np.zeros(lookups, dtype=int))
+        timings = [("matcher", built - start_time, time.time() - built)]
+        found = {k for k in np.flatnonzero(matched)}
+
+        for name, tree_class in (("BSTree", BSTree), ("AVLTree", AVLTree)):
+            start_time = time.time()
+            tree = tree_class()
+            shuffled = list(packets)
+            random.shuffle(shuffled)
+            for packet in shuffled:
+                tree.insert(packet)
+            built = time.time()
+            tree_found = {k for k, (key, _) in enumerate(rx) if tree.find(key)}
+            timings.append((name, built - start_time, time.time() - built))
+            assert tree_found == found
+
+        print(f"[matcher] {size} Tx packets, {lookups} Rx lookups ({len(found)} matched): " +
+              ", ".join(f"{name} build {build:.3f} s + match {match * 1000:.1f} ms"
+                        for name, build, match in timings))
@@ -96,6 +96,11 @@ cqi_max = 16
 # we consider that the first component is the number of users and the total queue length
 num_context_component_values = [len(Users), len(MCSs), len(BSRs)]
 
+# Slices estimated by one process, each on a cell of its own, with its
+# first PRB, PRB allocations and UEs (UEbox ue_ids, None for all); with more
+# than one, main.py runs them in shared rounds (util.slices)
+slice_configs = [{"name": "main", "cell": "1", "rb_start": 5, "prbs": PRBs, "ue_ids": None}]
+
 # Define idle time between selecting arm and estimating reward
 round_interval = 10  # seconds
 
@@ -103,9 +108,51 @@ round_interval = 10  # seconds
 num_samples = 50 + 1
 sampling_window = round_interval / num_samples  # seconds
 
+# QoS evaluation backend: "ping" runs rtt.sh towards every connected UE
+# during the round, "logs" samples the UL end-to-end delays of the users'
+# own packets from the UEbox/Callbox logs and injects no probe traffic
+possible_qos_backends = ["ping", "logs"]
+qos_backend = "ping"
+# Packets sampled per round by the "logs" backend, shared by all users
+qos_sample_budget = num_samples
+# Relative error of the delay quantiles kept by the sketches (util.sketch)
+qos_sketch_accuracy = 0.01
+# Probing of the "ping" backend: "rtt.sh" launches /root/rtt.sh per UE and
+# reads its log back, "agent" (opt-in) ships util/probe_agent.py to the
+# Callbox and keeps it running, started and stopped for all UEs with one
+# message each over one SSH channel (util.probe); it probes with its own
+# ICMP echo requests every probe_interval, so its RTT samples differ from
+# those of rtt.sh
+possible_probe_backends = ["rtt.sh", "agent"]
+probe_backend = "rtt.sh"
+# Seconds between the probes of a UE by the agent
+probe_interval = sampling_window
+# "samples": the agent streams the RTTs back as they arrive, "sketch": it
+# aggregates them per UE into delay sketches, sent back once per round
+possible_probe_aggregations = ["samples", "sketch"]
+probe_aggregation = "samples"
+
 # Define location of logs folder
 logs = 'logs'
 
+# Disk budget for the local cache of rotated logs (logs/cache)
+log_cache_budget = 2 * 1024**3  # bytes
+
+# Concurrent SFTP transfers per UEbox/Callbox and processes parsing rotated
+# logs (0: parse in the main process)
+max_transfers_per_host = 4
+parse_workers = 2
+# Bytes of a log parsed into columns at a time, which bounds the memory of a
+# scan whatever the length of its time window
+parse_chunk_size = 16 * 1024**2
+
+# Setting this to true will keep the live logs of both boxes streaming into
+# memory, so that recent time ranges are read without fetching any log
+log_streaming = False
+# Seconds of records kept: a round plus max_delay and some slack
+stream_retention = round_interval + max_delay / 1000 + 5
+stream_memory_budget = 64 * 1024**2  # bytes per unit
+
 # Define location of logs from the UE side
 ue_log = logs + '/ue0.log'
 
@@ -118,6 +165,20 @@ callbox_ip = "192.168.1.81"
 # UEBox IP Address
 uebox_ip = "192.168.1.80"
 
+# Testbeds (Callbox/UEbox pairs) run by one coordinator (util.testbeds),
+# each in a process of its own, working in testbeds/<name> and estimating
+# its "slices" (slice_configs if not given); empty: run the testbed above
+# in this process. Other optional keys: "callbox_port", "uebox_port", per
+# unit overrides of the SSH parameters ("remote"), local logs per unit to
+# read instead of the boxes' ("logs", e.g., exported ones) and the QoS
+# evaluation backend ("qos_backend", qos_backend if not given), e.g.:
+# {"name": "lab2", "callbox_ip": "192.168.2.81", "uebox_ip": "192.168.2.80",
+#  "remote": {"ue0": {"remote_auth_key": "./keys/lab2_uebox_ssh_ed25519.txt"}}}
+testbeds = []
+# Setting this to true will pool the UCB1 and transition statistics of the
+# testbeds' slices with the same PRB allocations and context grid
+share_learning = False
+
 # Setting this to true will fetch logs from a dummy log server
 testing = False
 
@@ -127,6 +188,28 @@ oldStyle = False
 # Setting this to true will cause actual usage of the Amarisoft API
 for_real = True
 
+# Amarisoft API client: "python" keeps a persistent WebSocket per component
+# (util.wsclient), "node" launches util/ws.js for every call
+possible_ws_backends = ["python", "node"]
+ws_backend = "python"
+# Seconds to wait for a connection or a response of the Amarisoft API
+ws_timeout = 5
+# Seconds to wait for the acknowledgement of a config_set and for the new
+# PRB allocation to be read back from the Callbox, polled every interval
+ws_ack_deadline = 1
+ws_confirm_deadline = 2
+ws_confirm_interval = 0.02
+# Seconds for which a ue_get snapshot of the UEbox is reused, e.g., by the
+# context and the probing of the same round
+ue_status_ttl = round_interval / 2
+# Setting this to true will subscribe to the UE event notifications of the
+# UEbox, so that attach, detach and RRC state changes reach the UE registry
+# between polls; the registration message depends on the API version and
+# has yet to be checked against the Amarisoft remote API, and the registry
+# falls back to polling ue_get (with a warning) if it is refused
+ue_events = False
+ue_event_registration = {"message": "register", "register": "ue"}
+
 # Set this to true to look for received packets at transmitted logs
 search_at_tx = True
 
@@ -134,11 +217,20 @@ search_at_tx = True
 # ip_id = "[IP]"
 ip_id = "[IP] UL"
 
+# Setting this to true will filter logs on the UEbox/Callbox and transfer
+# only the [MAC] header lines and the ip_id packets of the time window
+remote_filtering = False
+
 # RL parameters
 epsilon = 0.01
 gamma = 0.99
 initial_rounds = 20
 rounds_per_episode = 10
+# Setting this to true will run the planning of a round's episode (policy/
+# value iteration) in a worker thread while the next rounds are carried out
+# (util.learner); the round is recorded (trajectory, UCB1) at once, and the
+# round after one that completes an episode waits for its new policy
+overlap_learning = True
 
 # If probability of QoS success for some action is smaller than the max prob by 'a', then do not prefer it
 a = 0.01
@@ -0,0 +1,295 @@
+import os
+import sys
+import json
+import time
+import shlex
+import queue
+import threading
+import subprocess
+import paramiko
+from collections import defaultdict
+from .parameters import udp_payload, probe_interval, probe_aggregation, qos_sketch_accuracy, debug_mode
+from .logflatten import ssh_pool
+from .sketch import DelaySketch
+
+# Seconds to wait for the agent to be ready or to answer a message
+reply_timeout = 5
+
+# Agent run on the Callbox (util/probe_agent.py), shipped over SFTP next
+# to rtt.sh whenever it is (re)started
+agent_source = os.path.join(os.path.dirname(os.path.abspath(__file__)), "probe_agent.py")
+agent_remote_path = "/root/probe_agent.py"
+
+def agent_command(path=agent_remote_path):
+    # Shell command running the agent
+    return f"exec python3 -u {shlex.quote(path)}"
+
+def ssh_agent_installer(unit):
+    # Copy the agent to the unit over its pooled SFTP session
+    def install():
+        ssh_pool.sftp(unit).put(agent_source, agent_remote_path)
+    return install
+
+def ssh_agent_runner(unit):
+    # Run commands on a channel of the unit's pooled connection: return
+    # their stdin and stdout streams
+    def run(command):
+        stdin, stdout, _ = ssh_pool.client(unit).exec_command(command)
+        return stdin, stdout
+    return run
+
+def run_local(command):
+    # Local stand-in for running a command on a box
+    process = subprocess.Popen(command, shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    return process.stdin, process.stdout
+
+class ProbeAgent:
+    # Controller of the probe agent (util/probe_agent.py) on the Callbox. The
+    # agent is installed and started once, on a channel of its own, and again
+    # only if that channel is gone; a round then costs one start and one stop
+    # message instead of an SSH command per UE to launch rtt.sh, a killall
+    # and an SSH command per UE to read its log back.
+    def __init__(self, run, install=None, interval=probe_interval, size=udp_payload, offset=0.0,
+                 aggregation=probe_aggregation, timeout=reply_timeout, command=agent_command()):
+        # run(command) returns the stdin and stdout streams of the command;
+        # install(), if given, copies the agent to where command runs it
+        self.run = run
+        self.install = install
+        self.command = command
+        self.interval = interval
+        self.size = size
+        self.offset = offset
+        self.aggregation = aggregation
+        self.timeout = timeout
+        self.stdin = None
+        self.reader = None
+        self.replies = None
+        self.samples = defaultdict(list)
+        self.prober = None
+        self.round = 0
+        self.launches = 0
+        self.failures = 0
+        self.rounds = 0
+        self.latency = defaultdict(float)
+
+    def alive(self):
+        return self.reader is not None and self.reader.is_alive()
+
+    def launch(self):
+        self.close()
+        self.replies = queue.Queue()
+        if self.install is not None:
+            self.install()
+        self.stdin, stdout = self.run(self.command)
+        self.reader = threading.Thread(target=self.read, args=(stdout, self.replies), daemon=True)
+        self.reader.start()
+        self.launches += 1
+        self.prober = self.reply()["prober"]
+        if debug_mode: print(f"[probe] Agent started, probing with {self.prober}")
+
+    def read(self, stdout, replies):
+        # Sort the agent's output into samples and replies
+        for line in iter(stdout.readline, b""):
+            if line.startswith(b"{"):
+                replies.put(json.loads(line))
+            else:
+                ip, _, delay = line.decode().partition("\t")
+                self.samples[ip].append(float(delay))
+        replies.put(None)
+
+    def reply(self):
+        try:
+            message = self.replies.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No reply of the probe agent within {self.timeout} seconds")
+        if message is None:
+            raise ConnectionError("Probe agent channel closed")
+        if "error" in message:
+            raise ConnectionError(f"Probe agent error: {message['error']}")
+        return message
+
+    def send(self, message):
+        self.stdin.write((json.dumps(message) + "\n").encode())
+        self.stdin.flush()
+
+    def start(self, ips):
+        # Start probing the IPs; return True if the agent started
+        start_time = time.time()
+        self.round += 1
+        message = {"start": list(ips), "size": self.size, "interval": self.interval, "offset": self.offset,
+                   "sketch": None, "round": self.round}
+        if self.aggregation == "sketch":
+            sketch = DelaySketch(qos_sketch_accuracy)
+            message["sketch"] = {"accuracy": sketch.accuracy, "min_delay": sketch.min_delay,
+                                 "max_delay": sketch.max_delay}
+        # A broken channel is noticed at the first message: start the agent again, once
+        for attempt in range(2):
+            try:
+                if not self.alive():
+                    self.launch()
+                self.samples = defaultdict(list)
+                self.send(message)
+                self.reply()
+                self.latency["start"] += time.time() - start_time
+                return True
+            except (OSError, ConnectionError, TimeoutError, paramiko.SSHException) as e:
+                print(f"[probe] Probe agent failed to start probing: {e}")
+                self.close()
+        self.failures += 1
+        return False
+
+    def stop(self, ips):
+        # Stop probing; return the delays (ms) of each of the IPs: lists of
+        # samples, or DelaySketch objects; None if the agent failed
+        start_time = time.time()
+        try:
+            if not self.alive():
+                raise ConnectionError("Probe agent not running")
+            self.send({"stop": self.round})
+            reply = self.reply()
+        except (OSError, ConnectionError, TimeoutError, paramiko.SSHException) as e:
+            print(f"[probe] Probe agent failed to stop probing: {e}")
+            self.failures += 1
+            self.close()
+            return None
+        if reply.get("stopped") != self.round:
+            print(f"[probe] Probe agent stopped round {reply.get('stopped')} instead of {self.round}")
+        if debug_mode: print(f"[probe] Round {self.round}: {reply['received']} replies to {reply['sent']} probes")
+        if "sketches" in reply:
+            delays = [DelaySketch.from_dict(reply["sketches"][ip]) if ip in reply["sketches"] else DelaySketch()
+                      for ip in ips]
+        else:
+            delays = [self.samples.get(ip, []) for ip in ips]
+        self.latency["stop"] += time.time() - start_time
+        self.rounds += 1
+        return delays
+
+    def close(self):
+        # Make the agent exit, if running
+        if self.stdin is not None:
+            try:
+                self.send({"exit": True})
+                self.stdin.close()
+            except (OSError, paramiko.SSHException):
+                pass
+        self.stdin = None
+        self.reader = None
+
+    def report(self):
+        if self.rounds or self.failures:
+            print(f"[probe] {self.rounds} rounds over {self.launches} agent launches ({self.prober} prober), "
+                  f"{self.failures} failures; start {self.latency['start'] / max(self.rounds, 1) * 1000:.1f} ms, "
+                  f"stop {self.latency['stop'] / max(self.rounds, 1) * 1000:.1f} ms per round")
+
+if __name__ == "__main__":
+    # Evaluation latency of a round, i.e., stopping the probes and getting
+    # their RTTs back, with rtt.sh and with the agent (samples and sketches),
+    # for growing numbers of UEs; against a local stand-in of the Callbox
+    # whose SSH channels and messages take ssh_rtt seconds each, with /root
+    # in a temporary directory and a stand-in ping over raw ICMP sockets
+    # (root only) towards loopback addresses, e.g.:
+    # python3 -m util.probe 1 4 16
+    import shutil
+    import tempfile
+    import statistics
+    from . import calculate_reward
+    sizes = [int(value) for value in sys.argv[1:]] or [1, 4, 16]
+    ssh_rtt = 0.005
+    rounds = 5
+    probing = 1  # seconds per round
+
+    ping_program = f"""#!{sys.executable}
+import os, sys, time, socket, struct, select, signal
+signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+args = sys.argv[1:]
+interval, size, ip = float(args[args.index("-i") + 1]), int(args[args.index("-s") + 1]), args[-1]
+sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+ident, seq, sent = os.getpid() & 0xffff, 0, {{}}
+def checksum(data):
+    total = sum(struct.unpack("!%dH" % (len(data) // 2), data + b"\\0" * (len(data) % 2)))
+    total = (total >> 16) + (total & 0xffff)
+    return ~(total + (total >> 16)) & 0xffff
+while True:
+    seq += 1
+    header = struct.pack("!BBHHH", 8, 0, 0, ident, seq)
+    sock.sendto(struct.pack("!BBHHH", 8, 0, checksum(header + bytes(size)), ident, seq) + bytes(size), (ip, 0))
+    sent[seq] = time.monotonic()
+    deadline = sent[seq] + interval
+    while time.monotonic() < deadline:
+        if select.select([sock], [], [], max(deadline - time.monotonic(), 0))[0]:
+            data = sock.recv(65535)
+            kind, _, _, packet_ident, reply = struct.unpack("!BBHHH", data[(data[0] & 15) * 4:][:8])
+            if kind == 0 and packet_ident == ident and reply in sent:
+                print("%d bytes from %s: icmp_seq=%d ttl=64 time=%.3f ms"
+                      % (size + 8, ip, reply, (time.monotonic() - sent.pop(reply)) * 1000), flush=True)
+"""
+
+    class Lagged:
+        # Stand-in stdin of a channel: every message takes a round trip
+        def __init__(self, file):
+            self.file = file
+
+        def write(self, data):
+            self.file.write(data)
+
+        def flush(self):
+            time.sleep(ssh_rtt)
+            self.file.flush()
+
+        def close(self):
+            self.file.close()
+
+    class StandInClient:
+        # Stand-in of the pooled SSH client of the Callbox
+        def __init__(self, root):
+            self.root = root
+            self.channels = 0
+
+        def exec_command(self, command):
+            self.channels += 1
+            time.sleep(ssh_rtt)
+            process = subprocess.Popen(command.replace("/root/", self.root + "/"), shell=True, cwd=self.root,
+                                       stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                       env={**os.environ, "PATH": f"{self.root}/bin:{os.environ['PATH']}"})
+            return Lagged(process.stdin), process.stdout, process.stderr
+
+    with tempfile.TemporaryDirectory() as root:
+        os.makedirs(os.path.join(root, "bin"))
+        with open(os.path.join(root, "bin", "ping"), "w") as file:
+            file.write(ping_program)
+        with open(os.path.join(root, "rtt.sh"), "w") as file:
+            file.write(f"#!/bin/sh\nping -n -i {probe_interval} -s \"$2\" \"$1\" | "
+                       f"sed -u -n 's/.*time=\\([0-9.]*\\).*/\\1/p' > {root}/packet_delays_$1.log\n")
+        for name in ("bin/ping", "rtt.sh"):
+            os.chmod(os.path.join(root, name), 0o755)
+        client = StandInClient(root)
+        ssh_pool.client = lambda unit: client
+        calculate_reward.probe_agent.install = lambda: shutil.copy(agent_source, os.path.join(root, "probe_agent.py"))
+
+        for size in sizes:
+            ips = [f"127.0.0.{i + 2}" for i in range(size)]
+            for backend, aggregation in (("rtt.sh", None), ("agent", "samples"), ("agent", "sketch")):
+                calculate_reward.probe_backend = backend
+                calculate_reward.probe_agent.aggregation = aggregation
+                starts, stops, samples = [], [], []
+                channels = client.channels
+                for _ in range(rounds):
+                    start_time = time.time()
+                    calculate_reward.log_packet_delays(ips)
+                    starts.append(time.time() - start_time)
+                    time.sleep(probing)
+                    start_time = time.time()
+                    delays = calculate_reward.fetch_packet_delays_and_stop_logging(ips)
+                    stops.append(time.time() - start_time)
+                    sketches = calculate_reward.user_sketches(delays)
+                    samples.append(sum(sketch.count for sketch in sketches))
+                    if backend == "rtt.sh":
+                        time.sleep(0.1)  # let the killed pings go before the next round
+                print(f"[probe] {size:2d} UEs, {backend}{f' ({aggregation})' if aggregation else ''}: "
+                      f"start {statistics.median(starts) * 1000:.1f} ms, stop and fetch "
+                      f"{statistics.median(stops) * 1000:.1f} ms per round (median), "
+                      f"{(client.channels - channels) / rounds:.1f} SSH channels and "
+                      f"{statistics.mean(samples) / size:.1f} RTTs per UE per round, "
+                      f"median delay of the first UE {sketches[0].quantile(0.5):.3f} ms")
+        calculate_reward.probe_agent.close()
+        calculate_reward.probe_agent.report()
@@ -0,0 +1,219 @@
+# Probe agent run on the Callbox by util.probe (Python 3, standard library
+# only, shipped over SFTP). It reads one JSON message per line on stdin:
+#   {"start": [ips], "size": bytes, "interval": seconds, "offset": ms,
+#    "sketch": null or {"accuracy", "min_delay", "max_delay"}, "round": n}
+#   {"stop": n}
+#   {"exit": true}
+# and probes the IPs with ICMP echo requests of size payload bytes every
+# interval seconds, over one raw socket, or with one ping per IP if raw
+# sockets are not permitted. RTTs minus offset are written to stdout as
+# "ip<TAB>delay" lines as they arrive, or added to a sketch per IP (the
+# buckets of util.sketch.DelaySketch) that is sent in the reply to stop.
+# Replies are JSON lines; the agent exits when stdin is closed.
+import os
+import re
+import sys
+import json
+import math
+import time
+import socket
+import select
+import struct
+import subprocess
+
+ident = os.getpid() & 0xffff
+time_pattern = re.compile(rb"time=([0-9.]+)")
+
+def emit(line):
+    sys.stdout.write(line + "\n")
+    sys.stdout.flush()
+
+def checksum(data):
+    if len(data) % 2:
+        data += b"\0"
+    total = sum(struct.unpack("!%dH" % (len(data) // 2), data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+class IcmpProber:
+    # Echo requests and replies over one raw socket, matched by sequence number
+    name = "icmp"
+    sends = True
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+        self.seq = 0
+        self.pending = {}
+
+    def start(self, ips, size, interval):
+        self.pending.clear()
+
+    def stop(self):
+        self.pending.clear()
+
+    def fds(self):
+        return [self.sock]
+
+    def send(self, ip, size):
+        self.seq = (self.seq + 1) & 0xffff
+        payload = bytes(size)
+        header = struct.pack("!BBHHH", 8, 0, 0, ident, self.seq)
+        packet = struct.pack("!BBHHH", 8, 0, checksum(header + payload), ident, self.seq) + payload
+        self.pending[self.seq] = (ip, time.monotonic())
+        try:
+            self.sock.sendto(packet, (ip, 0))
+        except OSError:
+            pass
+
+    def receive(self, fd):
+        data, (address, _) = self.sock.recvfrom(65535)
+        now = time.monotonic()
+        start = (data[0] & 0x0f) * 4
+        kind, _, _, packet_ident, seq = struct.unpack("!BBHHH", data[start:start + 8])
+        if kind != 0 or packet_ident != ident:
+            return None
+        entry = self.pending.get(seq)
+        if entry is None or entry[0] != address:
+            return None
+        del self.pending[seq]
+        return entry[0], (now - entry[1]) * 1000
+
+class PingProber:
+    # One ping process per IP, when raw sockets are not permitted
+    name = "ping"
+    sends = False
+
+    def __init__(self):
+        self.processes = {}
+
+    def start(self, ips, size, interval):
+        for ip in ips:
+            self.processes[ip] = subprocess.Popen(["ping", "-n", "-i", str(interval), "-s", str(size), ip],
+                                                  stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+    def stop(self):
+        for process in self.processes.values():
+            process.terminate()
+        for process in self.processes.values():
+            process.wait()
+            process.stdout.close()
+        self.processes.clear()
+
+    def fds(self):
+        return [process.stdout for process in self.processes.values()]
+
+    def receive(self, fd):
+        for ip, process in self.processes.items():
+            if process.stdout is fd:
+                match = time_pattern.search(fd.readline())
+                return (ip, float(match.group(1))) if match else None
+        return None
+
+class Sketch:
+    # Same buckets as util.sketch.DelaySketch, rebuilt there from to_dict()
+    def __init__(self, accuracy, min_delay, max_delay):
+        self.accuracy, self.min_delay, self.max_delay = accuracy, min_delay, max_delay
+        self.log_gamma = math.log((1 + accuracy) / (1 - accuracy))
+        self.offset = math.ceil(math.log(min_delay) / self.log_gamma)
+        self.positive, self.negative = {}, {}
+        self.zero, self.count, self.sum, self.min, self.max = 0, 0, 0.0, None, None
+
+    def add(self, delay):
+        magnitude = abs(delay)
+        if magnitude < self.min_delay:
+            self.zero += 1
+        else:
+            index = max(math.ceil(math.log(min(magnitude, self.max_delay)) / self.log_gamma) - self.offset, 0)
+            buckets = self.positive if delay > 0 else self.negative
+            buckets[str(index)] = buckets.get(str(index), 0) + 1
+        self.count += 1
+        self.sum += delay
+        self.min = delay if self.min is None else min(self.min, delay)
+        self.max = delay if self.max is None else max(self.max, delay)
+
+    def to_dict(self):
+        return {"accuracy": self.accuracy, "min_delay": self.min_delay, "max_delay": self.max_delay,
+                "positive": self.positive, "negative": self.negative, "zero": self.zero,
+                "count": self.count, "sum": self.sum, "min": self.min, "max": self.max}
+
+class Round:
+    # IPs and settings of the round being probed, with its samples or sketches
+    def __init__(self, message):
+        self.number = message.get("round")
+        self.ips = list(message["start"])
+        self.size = int(message.get("size", 56))
+        self.interval = float(message.get("interval", 1))
+        self.offset = float(message.get("offset", 0))
+        spec = message.get("sketch")
+        self.sketches = {ip: Sketch(**spec) for ip in self.ips} if spec else None
+        self.sent = dict.fromkeys(self.ips, 0)
+        self.received = dict.fromkeys(self.ips, 0)
+        self.next = time.monotonic()
+
+    def record(self, ip, rtt):
+        delay = rtt - self.offset
+        self.received[ip] += 1
+        if self.sketches is None:
+            emit("%s\t%.3f" % (ip, delay))
+        else:
+            self.sketches[ip].add(delay)
+
+    def reply(self):
+        reply = {"stopped": self.number, "sent": self.sent, "received": self.received}
+        if self.sketches is not None:
+            reply["sketches"] = {ip: sketch.to_dict() for ip, sketch in self.sketches.items()}
+        return reply
+
+def main():
+    try:
+        prober = IcmpProber()
+    except OSError:
+        prober = PingProber()
+    emit(json.dumps({"ready": os.getpid(), "prober": prober.name}))
+    current, buffer = None, b""
+    while True:
+        timeout = None
+        if current is not None and prober.sends:
+            timeout = max(current.next - time.monotonic(), 0)
+        readable, _, _ = select.select([0] + prober.fds(), [], [], timeout)
+        for fd in readable:
+            if fd != 0:
+                # Replies to other pings are drained too, between rounds as well
+                sample = prober.receive(fd)
+                if sample is not None and current is not None:
+                    current.record(*sample)
+                continue
+            data = os.read(0, 65536)
+            if not data:
+                prober.stop()
+                return
+            buffer += data
+            while b"\n" in buffer:
+                line, buffer = buffer.split(b"\n", 1)
+                try:
+                    message = json.loads(line)
+                    if "exit" in message:
+                        prober.stop()
+                        return
+                    if current is not None:
+                        prober.stop()
+                    if "start" in message:
+                        current = Round(message)
+                        prober.start(current.ips, current.size, current.interval)
+                        emit(json.dumps({"started": current.number, "ips": len(current.ips)}))
+                    elif "stop" in message:
+                        emit(json.dumps(current.reply() if current is not None else {"stopped": None}))
+                        current = None
+                except Exception as e:
+                    prober.stop()
+                    current = None
+                    emit(json.dumps({"error": repr(e)}))
+        if current is not None and prober.sends and time.monotonic() >= current.next:
+            for ip in current.ips:
+                prober.send(ip, current.size)
+                current.sent[ip] += 1
+            current.next = max(current.next + current.interval, time.monotonic())
+
+if __name__ == "__main__":
+    main()
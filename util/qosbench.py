@@ -0,0 +1,72 @@
+import os
+import sys
+import time
+import random
+import tempfile
+import numpy as np
+from .parameters import udp_payload, round_interval, qos_sample_budget
+from .logfilter import run_local
+from .logflatten import LogSnapshot
+from .loggen import write_log_pair
+from .e2estats import user_packet_delays
+from .calculate_reward import evaluate_qos, estimated_dl_delay
+
+# Bytes of an ICMP echo (IP and ICMP headers on top of the payload)
+icmp_overhead = 28
+
+def ping_round(directory, num_users, ping_interval, seed=0):
+    # Local stand-in for fetch_packet_delays_and_stop_logging(): one command
+    # to stop the pings, then one command per UE reading its RTT log
+    rng = random.Random(seed)
+    ips = [f"10.0.0.{user + 1}" for user in range(num_users)]
+    for ip_address in ips:
+        with open(os.path.join(directory, f"packet_delays_{ip_address}.log"), 'w') as file:
+            for _ in range(int(round_interval / ping_interval)):
+                file.write(f"{estimated_dl_delay + rng.expovariate(1 / 20):.3f}\n")
+
+    start_time = time.time()
+    _, stderr = run_local('killall -15 qosbench_ping_stand_in')
+    stderr.read()
+    output_list = []
+    for ip_address in ips:
+        stdout, _ = run_local(f'cat {os.path.join(directory, f"packet_delays_{ip_address}.log")}')
+        output = stdout.read().decode().splitlines()
+        output_list.append([float(val) - estimated_dl_delay for val in output])
+    evaluate_qos(output_list)
+    return time.time() - start_time, len(ips) + 1
+
+if __name__ == "__main__":
+    # Compare the "logs" QoS backend with the "ping" one on synthetic logs
+    # of a round and local stand-ins, e.g.:
+    # python3 -m util.qosbench 10 51 101 501
+    num_users = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    budgets = [int(budget) for budget in sys.argv[2:]] or [qos_sample_budget, 2 * qos_sample_budget]
+    ping_interval = 0.2  # seconds, as rtt.sh is not part of the repository
+    with tempfile.TemporaryDirectory() as directory:
+        paths, (start_time, _), _, true_delays = write_log_pair(
+            directory, num_users, packet_rate=50, duration=round_interval,
+            mean_delays=[5 + 10 * user for user in range(num_users)], record_delays=True)
+        start_time_str = start_time.strftime("%Y%m%d.%H:%M:%S")
+        true_p90 = [np.percentile(delays, 90) for delays in true_delays]
+        print(f"[qosbench] {num_users} users, {sum(map(len, true_delays))} packets per round; "
+              f"true QoS metric {max(true_p90):.1f} ms")
+
+        elapsed, commands = ping_round(directory, num_users, ping_interval)
+        probes = num_users * round_interval / ping_interval
+        print(f"[qosbench] ping: evaluated in {elapsed * 1000:.1f} ms over {commands} commands "
+              f"(one SSH round trip each on the testbed); {probes:.0f} probes, "
+              f"{probes * 2 * (udp_payload + icmp_overhead) / 1e3:.1f} kB injected per round")
+
+        for budget in budgets:
+            snapshot = LogSnapshot()
+            snapshot.use_logs("ue0", paths["ue0"])
+            snapshot.use_logs("mme", paths["mme"])
+            start_time = time.time()
+            delays_lists = user_packet_delays(start_time_str, budget, snapshot)
+            QoS_metric, _ = evaluate_qos(delays_lists)
+            elapsed = time.time() - start_time
+            sampled = sum(map(len, delays_lists))
+            print(f"[qosbench] logs, {budget} samples: evaluated in {elapsed * 1000:.1f} ms, "
+                  f"{sampled} samples of {len(delays_lists)} users, QoS metric {QoS_metric:.1f} ms "
+                  f"({QoS_metric - max(true_p90):+.1f} ms), {snapshot.scanned_bytes['ue0'] + snapshot.scanned_bytes['mme']} "
+                  f"log bytes scanned, no probes injected")
@@ -0,0 +1,199 @@
+import os
+import sys
+import json
+import math
+import time
+import numpy as np
+from .parameters import qos_sketch_accuracy, debug_mode
+
+class DelaySketch:
+    # Mergeable fixed-bucket log histogram of delays (ms). Bucket i holds
+    # the magnitudes in (gamma^(i-1), gamma^i], gamma = (1+accuracy)/(1-accuracy),
+    # and is represented by 2*gamma^i/(gamma+1), which is within relative
+    # accuracy of every value of the bucket. Magnitudes below min_delay
+    # count as 0 and above max_delay as max_delay; negative delays (RTTs
+    # below estimated_dl_delay) are kept mirrored.
+    #
+    # Error bound: for values within [min_delay, max_delay] in magnitude,
+    # quantile(q) lies within relative accuracy of an order statistic of
+    # rank between floor(h) and ceil(h), h = q*(count-1), i.e., of one of
+    # the two samples np.percentile(..., 100*q) interpolates between.
+    def __init__(self, accuracy=qos_sketch_accuracy, min_delay=1e-2, max_delay=1e6):
+        self.accuracy = accuracy
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.offset = math.ceil(math.log(min_delay) / self.log_gamma)
+        num_buckets = math.ceil(math.log(max_delay) / self.log_gamma) - self.offset + 1
+        self.positive = np.zeros(num_buckets, dtype=np.int64)
+        self.negative = np.zeros(num_buckets, dtype=np.int64)
+        self.zero = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.cumulative = None
+
+    @classmethod
+    def of(cls, delays, **kwargs):
+        sketch = cls(**kwargs)
+        sketch.add(delays)
+        return sketch
+
+    def buckets(self, magnitudes):
+        index = np.ceil(np.log(np.minimum(magnitudes, self.max_delay)) / self.log_gamma).astype(np.int64)
+        return np.bincount(np.maximum(index - self.offset, 0), minlength=len(self.positive))
+
+    def add(self, delays):
+        # Ingest a batch of delays, e.g., as they are parsed
+        delays = np.asarray(delays, dtype=float).reshape(-1)
+        if not len(delays):
+            return self
+        small = np.abs(delays) < self.min_delay
+        self.zero += int(np.count_nonzero(small))
+        self.positive += self.buckets(delays[~small & (delays > 0)])
+        self.negative += self.buckets(-delays[~small & (delays < 0)])
+        self.count += len(delays)
+        self.sum += float(delays.sum())
+        self.min = min(self.min, float(delays.min()))
+        self.max = max(self.max, float(delays.max()))
+        self.cumulative = None
+        return self
+
+    def compatible(self, other):
+        return (self.accuracy, self.min_delay, self.max_delay) == (other.accuracy, other.min_delay, other.max_delay)
+
+    def merge(self, other):
+        # Fold another sketch (e.g., of another user or round) into this one
+        if not self.compatible(other):
+            raise ValueError("Cannot merge delay sketches of different accuracy or range")
+        self.positive += other.positive
+        self.negative += other.negative
+        self.zero += other.zero
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.cumulative = None
+        return self
+
+    def mean(self):
+        return self.sum / self.count if self.count else None
+
+    def quantile(self, q):
+        # O(number of buckets), independent of the number of delays
+        if not self.count:
+            return None
+        if self.cumulative is None:
+            # Buckets in increasing delay order: negative, zero and positive ones
+            self.cumulative = np.cumsum(np.concatenate((self.negative[::-1], [self.zero], self.positive)))
+        rank = math.floor(q * (self.count - 1) + 0.5)
+        position = int(np.searchsorted(self.cumulative, rank, side='right'))
+        num_buckets = len(self.positive)
+        if position == num_buckets:
+            value = 0.0
+        elif position < num_buckets:
+            value = -2 * self.gamma ** (num_buckets - 1 - position + self.offset) / (self.gamma + 1)
+        else:
+            value = 2 * self.gamma ** (position - num_buckets - 1 + self.offset) / (self.gamma + 1)
+        # The exact extremes can only make the estimate closer
+        return min(max(value, self.min), self.max)
+
+    def quantiles(self, qs=(0.5, 0.9, 0.99)):
+        return [self.quantile(q) for q in qs]
+
+    def to_dict(self):
+        # Sparse JSON representation: {bucket: count} of the non-empty buckets
+        def sparse(counts):
+            return {str(i): int(counts[i]) for i in np.flatnonzero(counts)}
+        return {'accuracy': self.accuracy, 'min_delay': self.min_delay, 'max_delay': self.max_delay,
+                'positive': sparse(self.positive), 'negative': sparse(self.negative), 'zero': self.zero,
+                'count': self.count, 'sum': self.sum,
+                'min': self.min if self.count else None, 'max': self.max if self.count else None}
+
+    @classmethod
+    def from_dict(cls, entry):
+        sketch = cls(entry['accuracy'], entry['min_delay'], entry['max_delay'])
+        for counts, buckets in ((sketch.positive, entry['positive']), (sketch.negative, entry['negative'])):
+            for i, count in buckets.items():
+                counts[int(i)] = count
+        sketch.zero, sketch.count, sketch.sum = entry['zero'], entry['count'], entry['sum']
+        if sketch.count:
+            sketch.min, sketch.max = entry['min'], entry['max']
+        return sketch
+
+def user_sketches(packet_delays_lists):
+    # One sketch per user of the lists returned by the QoS backends
+    return [delays if isinstance(delays, DelaySketch) else DelaySketch.of(delays or [])
+            for delays in packet_delays_lists or []]
+
+class DelayHistory:
+    # Slice-level delay sketches per (context, PRBs), accumulated over the
+    # rounds of a run and stored at path after each round
+    def __init__(self, path):
+        self.path = path
+        self.sketches = {}
+        try:
+            with open(path) as file:
+                self.sketches = {key: DelaySketch.from_dict(entry) for key, entry in json.load(file).items()}
+        except (OSError, ValueError):
+            pass
+
+    def key(self, context, bandwidth):
+        return f"{','.join(str(value) for value in context)}/{bandwidth}"
+
+    def record(self, context, bandwidth, sketches):
+        # Merge the users' sketches of a round; return the slice's sketch of it
+        round_sketch = DelaySketch()
+        for sketch in sketches:
+            round_sketch.merge(sketch)
+        key = self.key(context, bandwidth)
+        self.sketches.setdefault(key, DelaySketch()).merge(round_sketch)
+        self.save()
+        if debug_mode:
+            p50, p90, p99 = self.sketches[key].quantiles()
+            if self.sketches[key].count:
+                print(f"[sketch] {key}: {self.sketches[key].count} delays, "
+                      f"p50/p90/p99 = {p50:.1f}/{p90:.1f}/{p99:.1f} ms")
+        return round_sketch
+
+    def save(self):
+        temporary_path = self.path + '.tmp'
+        with open(temporary_path, 'w') as file:
+            json.dump({key: sketch.to_dict() for key, sketch in self.sketches.items()}, file)
+        os.replace(temporary_path, self.path)
+
+if __name__ == "__main__":
+    # Check the error bound against np.percentile and compare costs, e.g.:
+    # python3 -m util.sketch 1000 100000 1000000
+    sizes = [int(size) for size in sys.argv[1:]] or [10**3, 10**5, 10**6]
+    rng = np.random.default_rng(0)
+    accuracy = qos_sketch_accuracy
+    for size in sizes:
+        distributions = {'lognormal': rng.lognormal(3, 1, size),
+                         'exponential+15': 15 + rng.exponential(30, size),
+                         'rtt-15': rng.normal(20, 10, size)}
+        for name, delays in distributions.items():
+            start_time = time.time()
+            sketch = DelaySketch.of(delays)
+            ingested = time.time() - start_time
+            start_time = time.time()
+            estimates = sketch.quantiles()
+            queried = time.time() - start_time
+            start_time = time.time()
+            exact = np.percentile(delays, [50, 90, 99])
+            percentile = time.time() - start_time
+            sorted_delays = np.sort(delays)
+            within = []
+            for q, estimate in zip((0.5, 0.9, 0.99), estimates):
+                h = q * (size - 1)
+                low, high = sorted_delays[math.floor(h)], sorted_delays[math.ceil(h)]
+                within.append(min(low * (1 - accuracy), low * (1 + accuracy)) - 1e-9 <= estimate <=
+                              max(high * (1 + accuracy), high * (1 - accuracy)) + 1e-9)
+            errors = np.abs(np.array(estimates) - exact) / np.maximum(np.abs(exact), sketch.min_delay)
+            print(f"[sketch] {size} {name} delays: p50/p90/p99 relative errors "
+                  f"{'/'.join(f'{100 * error:.2f}%' for error in errors)} (bound {100 * accuracy:.0f}% "
+                  f"of the interpolated samples: {all(within)}); ingest {ingested * 1000:.1f} ms, "
+                  f"query {queried * 1e6:.0f} us (np.percentile {percentile * 1000:.1f} ms), {sketch.positive.nbytes + sketch.negative.nbytes} bytes "
+                  f"vs {delays.nbytes} bytes of samples")
@@ -0,0 +1,495 @@
+import os
+import sys
+import time
+import threading
+import numpy as np
+from datetime import datetime, timedelta
+from collections import defaultdict
+from .parameters import *
+from .ucb1 import UCB1
+from .RL import compute_rl_reward, find_most_used_arm, second_policy, policy_iteration, epsilon_soft_policy, \
+    update_transition_matrix, value_iteration, epsilon_soft_policy_select
+from .sketch import DelayHistory, user_sketches
+from .calculate_reward import evaluate_qos, log_packet_delays, fetch_packet_delays_and_stop_logging
+from .liveness import calculate_context, ue_status, bsr_tracker, ws_set_cells
+from .logflatten import LogSnapshot, get_current_datetime_string
+from .e2estats import user_packet_delays
+from .control import control_plane
+from .learner import Learner
+
+class SliceRound:
+    # A round of a slice: its context and action, and, once concluded, its
+    # outcome and trajectory row, for its recording and learning
+    def __init__(self, t, actual_context, context, users_rounds, episode_of_users):
+        self.t = t
+        self.actual_context = actual_context
+        self.context = context
+        self.user_bound = Users[context[0]]
+        self.users_rounds = users_rounds
+        self.episode_of_users = episode_of_users
+        self.ucb1 = None
+        self.selected_action = None
+        self.actual_bandwidth = None
+        self.QoS_reward = None
+        self.row = None
+
+    def closes_episode(self):
+        # Whether the round completes an episode of its number of users
+        return self.users_rounds >= initial_rounds and (self.users_rounds - initial_rounds) % rounds_per_episode == 0
+
+class Slice:
+    # Bandwidth estimator of one slice: its cell, first PRB, PRB allocations
+    # (arms) and UEs (UEbox ue_ids, None for all), with the learning state
+    # that is kept across its rounds
+    def __init__(self, name="main", cell="1", rb_start=5, prbs=PRBs, ue_ids=None, trajectory_file=None,
+                 delay_history=None, algorithm=algorithm):
+        self.name = name
+        self.cell = cell
+        self.rb_start = rb_start
+        self.prbs = list(prbs)
+        self.ue_ids = set(ue_ids) if ue_ids is not None else None
+        self.trajectory_file = trajectory_file
+        self.delay_history = delay_history
+        self.algorithm = algorithm
+        # Exchange of learnt statistics with the slices of other testbeds
+        # (util.testbeds.LearningExchange), None if they are not shared
+        self.exchange = None
+        # PRB allocations and context grid: statistics are shared only
+        # between slices with the same grid
+        self.grid = (tuple(self.prbs), tuple(tuple(values) for values in list_of_lists))
+        # Last row of the trajectory, without the newline
+        self.row = None
+        if trajectory_file is not None:
+            with open(trajectory_file, "w") as file:
+                file.write(f"BW\tUsers\tMCS\tBSR\tDelay\tReward\tUEsAge\tActuation\t{self.algorithm}\n")
+
+        # Rounds of the slice so far
+        self.t = 0
+
+        # Keep track of the number of times a specific number of users was encountered
+        self.users_vs_counts = defaultdict(int)
+
+        # Keep track of the round number of the most recent rounds_per_episode rounds that a specific number of users occured
+        self.users_vs_last_rounds = defaultdict(list)
+
+        # Intialization for UCB1 (whenever a new number of users appears create new UCB1 instance)
+        self.ucb1_objects = np.empty(tuple(num_context_component_values), dtype=UCB1)
+
+        # Current round (SliceRound) and lock of the learnt state, which the
+        # rounds' learning may update in a worker (util.learner)
+        self.current = None
+        self.lock = threading.Lock()
+        # Cleared while the learning of a round that completed an episode is
+        # pending: the next round selects with its outcome
+        self.learned = threading.Event()
+        self.learned.set()
+
+        # policy iteration
+        self.returns = defaultdict(list)
+        self.Q = {}
+        self.context_vs_most_used_arm = {}
+
+        # value iteration
+        self.state_transition_count = defaultdict(lambda: defaultdict(int))
+        self.best_action_map = defaultdict(lambda: defaultdict(int))  # best action vs state for each number of users
+
+    def select(self, actual_context):
+        # Start a round of the slice in the given actual state/context;
+        # return the PRBs to allocate
+        self.t += 1
+
+        # Return the indices of the actual state/context
+        context = indexify_context(actual_context)
+        # Do not peform adaptation, consider a single state
+        if self.algorithm == "no_adaptation":
+            context = [0, 0, 0]
+        print(f"[{self.name}] [Users, Avg_UL_MCS, Sum_UL_BSR ] = {actual_context} --> {context}")
+
+        # Number of rounds that this number of users occurred
+        self.users_vs_counts[context[0]] += 1
+        users_rounds = self.users_vs_counts[context[0]]
+        if users_rounds <= initial_rounds:
+            episode_of_users = 1
+            round_of_users = users_rounds
+        else:
+            temp_rounds = users_rounds - initial_rounds
+            episode_of_users = -(temp_rounds // -rounds_per_episode) + 1  # ceil integral division
+            round_of_users = temp_rounds % rounds_per_episode
+        decision = SliceRound(self.t, actual_context, context, users_rounds, episode_of_users)
+        print(f"[{self.name}] This is round {round_of_users} of episode {episode_of_users} "
+              f"for [users <= {decision.user_bound}]")
+
+        # The learning of the previous rounds may be going on in a worker
+        # (util.learner): select with the policy learnt so far, unless the
+        # previous round completed an episode, whose policy is waited for
+        self.learned.wait()
+        with self.lock:
+            if self.algorithm == "UCB1_only" or self.algorithm == "no_adaptation" or episode_of_users <= 1:
+                # Construct a new UCB1 object for this context if one does not already exist
+                if not self.ucb1_objects[tuple(context)]:
+                    self.ucb1_objects[tuple(context)] = UCB1(len(self.prbs), arm_correlations, self.prbs)
+
+                # Refer to current ucb1 object as 'ucb1' for convenience
+                decision.ucb1 = self.ucb1_objects[tuple(context)]
+                if self.exchange is not None:
+                    decision.ucb1.share(*self.exchange.ucb1(self.grid, tuple(context)))
+
+                # Choose an arm
+                selected_action = decision.ucb1.select_arm()
+
+            elif self.algorithm == "policy_iteration":
+                if episode_of_users <= 2:
+                    # call the second policy, i.e., the first epsilon-soft policy
+                    selected_action = second_policy(tuple(context), self.context_vs_most_used_arm, self.prbs)
+                else:
+                    # Select action using the updated epsilon-soft policy given the current state and Q matrix
+                    selected_action = epsilon_soft_policy(context, self.Q, self.prbs)
+
+            elif self.algorithm == "value_iteration":
+                # select best action computed by value iteration with high_prob and the rest with low_prob
+                mini_state = tuple([context[1], context[2]])
+                best_action = self.best_action_map[context[0]][mini_state]
+                selected_action = epsilon_soft_policy_select(best_action, self.prbs)
+
+        # Find actual bandwidth in PRBs from selected action/arm
+        decision.selected_action = selected_action
+        decision.actual_bandwidth = self.prbs[int(selected_action)]
+        self.current = decision
+        print(f"[{self.name}] Allocated Bandwidth = {decision.actual_bandwidth} PRBs")
+        return decision.actual_bandwidth
+
+    def evaluate(self, packet_delays):
+        # QoS metric and reward of the round from the users' packet delays
+        decision = self.current
+        delay_sketches = user_sketches(packet_delays)
+        QoS_metric, QoS_reward = evaluate_qos(delay_sketches)
+        if self.delay_history is not None:
+            self.delay_history.record(decision.context, decision.actual_bandwidth, delay_sketches)
+
+        # Compute RL reward
+        RL_round_reward = compute_rl_reward(decision.actual_bandwidth, QoS_reward, prbs=self.prbs)
+
+        print(f"[{self.name}] QoS metric = {QoS_metric} ms")
+        print(f"[{self.name}] QoS reward = {QoS_reward}")
+        print(f"[{self.name}] RL reward = {RL_round_reward}")
+        return QoS_metric, QoS_reward
+
+    def conclude(self, QoS_metric, QoS_reward, ue_status_age=None, actuation_latency=None):
+        # Close the current round with its outcome; return it for record()
+        # and learn(), which may run later, in a worker
+        decision = self.current
+        actual_context = decision.actual_context
+        actual_context[1] = round(actual_context[1], 2)
+        QoS_metric = round(QoS_metric, 2)
+        reward = round(QoS_reward, 4)
+        decision.QoS_reward = QoS_reward
+        decision.row = (f"{decision.actual_bandwidth}\t{actual_context[0]}\t{actual_context[1]}\t{actual_context[2]}"
+                        f"\t{QoS_metric}\t{reward}"
+                        f"\t{round(ue_status_age, 3) if ue_status_age is not None else 'nan'}"
+                        f"\t{round(actuation_latency, 3) if actuation_latency is not None else 'nan'}")
+        self.row = decision.row
+        return decision
+
+    def record(self, decision):
+        # Log the tuple (action, state, QoS metric, reward) and add it to the current trajectory file of the policy;
+        # this runs before the next round, and only learn() may be left to a worker
+        if decision.closes_episode() and self.algorithm in ("policy_iteration", "value_iteration"):
+            self.learned.clear()
+        if self.trajectory_file is not None:
+            with open(self.trajectory_file, "a") as file:
+                file.write(decision.row + "\n")
+        # Rounds are counted in the episodes of their number of users once in the trajectory
+        self.users_vs_last_rounds[decision.context[0]].append(decision.t)
+
+        if decision.episode_of_users <= 1 or self.algorithm == "UCB1_only" or self.algorithm == "no_adaptation":
+            # Update the UCB1 object with the selected arm and reward
+            with self.lock:
+                decision.ucb1.update(decision.selected_action, decision.QoS_reward)
+            if self.exchange is not None:
+                self.exchange.publish_ucb1(self.grid, tuple(decision.context), decision.ucb1)
+
+    def learn(self, decision):
+        # Learn from the round, e.g., in a worker (util.learner)
+        try:
+            self.plan(decision)
+        finally:
+            self.learned.set()
+
+    def plan(self, decision):
+        # Check if an episode has just been completed
+        if self.algorithm == "UCB1_only" or self.algorithm == "no_adaptation":
+            return
+        context, users_rounds = decision.context, decision.users_rounds
+        episode_of_users, user_bound = decision.episode_of_users, decision.user_bound
+        last_rounds = self.users_vs_last_rounds[context[0]]
+        if self.algorithm == "policy_iteration":
+            if users_rounds == initial_rounds:
+                # The first episode has just been completed
+                # Find most used arm for each occured context to find the first epsilon-soft policy (second policy overall)
+                context_vs_most_used_arm = find_most_used_arm(self.trajectory_file, last_rounds, self.prbs)
+                with self.lock:
+                    self.context_vs_most_used_arm = context_vs_most_used_arm
+                last_rounds.clear()
+                print(f"[{self.name}] Episode {episode_of_users} for [users <= {user_bound}] completed. "
+                      f"Found the most used arms for each context...\n\n")
+            elif users_rounds >= initial_rounds and (users_rounds - initial_rounds) % rounds_per_episode == 0:
+                # Another episode has been completed so perform policy iteration to improve current epsilon-soft policy
+                # Receive the Q values and total rewards for each state-action pair, and then update them
+                # (on copies, so that the rounds selected meanwhile use the previous ones)
+                Q, returns = policy_iteration(self.trajectory_file, last_rounds, dict(self.Q),
+                                              defaultdict(list, {key: list(values)
+                                                                 for key, values in self.returns.items()}),
+                                              self.prbs)
+                with self.lock:
+                    self.Q, self.returns = Q, returns
+                last_rounds.clear()
+                print(f"[{self.name}] Episode {episode_of_users} for [users <= {user_bound}] completed. "
+                      f"Performed policy iteration to improve epsilon-soft policy.\n")
+        if self.algorithm == "value_iteration":
+            if users_rounds >= initial_rounds and (users_rounds - initial_rounds) % rounds_per_episode == 0:
+                # An episode has been completed so perform value iteration to improve current epsilon-soft policy
+
+                # First update transition probability matrix and the state transition count
+                shared_count = self.exchange.transitions(self.grid, context[0]) if self.exchange is not None else None
+                P, self.state_transition_count[context[0]] = \
+                    update_transition_matrix(self.trajectory_file, last_rounds,
+                                             self.state_transition_count[context[0]], self.prbs, shared_count)
+                last_rounds.clear()
+                if self.exchange is not None:
+                    self.exchange.publish_transitions(self.grid, context[0], self.state_transition_count[context[0]])
+
+                best_actions = value_iteration(P, self.prbs)
+                with self.lock:
+                    self.best_action_map[context[0]] = best_actions
+                print(f"[{self.name}] Best action map for [users <= {user_bound}] is: "
+                      f"{best_actions}")
+                print(f"[{self.name}] Episode {episode_of_users} for [users <= {user_bound}] completed. "
+                      f"Performed value iteration to improve epsilon-soft policy.\n")
+
+    def ips(self, user_ips):
+        # IPv4 addresses of the slice's connected users among {ue_id: IPv4}
+        return [ip for ue_id, ip in user_ips.items() if self.ue_ids is None or ue_id in self.ue_ids]
+
+    def users(self, user_delays):
+        # Delay lists of the slice's users among {ue_id: delays}; samples of
+        # unidentified UEs count for a slice of all users only
+        return [delays for ue_id, delays in user_delays.items()
+                if self.ue_ids is None or ue_id in self.ue_ids]
+
+class SliceScheduler:
+    # Rounds of several slices in one process over the shared API connections:
+    # per round, one ue_get, one config_set for the cells of all slices, one
+    # measurement interval and one log snapshot, which also updates the BSRs
+    # of the next round's contexts. Slices must be on distinct cells.
+    def __init__(self, slices, control=control_plane, interval=round_interval, snapshot_factory=LogSnapshot,
+                 clock=get_current_datetime_string, learner=None, qos_backend=qos_backend):
+        cells = [slice.cell for slice in slices]
+        if len(set(cells)) != len(cells):
+            raise ValueError(f"Slices must be on distinct cells, got {cells}")
+        self.slices = slices
+        self.control = control
+        self.interval = interval
+        self.snapshot_factory = snapshot_factory
+        self.clock = clock
+        self.qos_backend = qos_backend
+        # Recording and learning of the rounds, overlapped with the next
+        # rounds if overlap_learning
+        self.learner = learner or Learner()
+        self.bsr_fed = False
+        self.rounds = 0
+        self.slice_rounds = 0
+        self.timing = defaultdict(float)
+
+    def contexts(self):
+        # Actual context and alive users per slice, from one ue_get and one BSR scan
+        ue_status.invalidate()
+        ue_status.get(for_real)
+        scan = not self.bsr_fed
+        if scan:
+            starting_buffer_time = datetime.strptime(self.clock(), "%Y%m%d.%H:%M:%S") - timedelta(seconds=1)
+            snapshot = self.snapshot_factory()
+            snapshot.register("ue0", bsr_tracker.watch(starting_buffer_time))
+            snapshot.scan("ue0")
+        return [calculate_context(users=slice.ue_ids, scan=False) for slice in self.slices]
+
+    def measure(self, slices, measurement_start, ips_by_slice):
+        # Packet delays per slice of the round
+        if self.qos_backend == "ping":
+            ips = [ip for slice in slices for ip in ips_by_slice[slice]]
+            delays = fetch_packet_delays_and_stop_logging(ips) or [[] for _ in ips]
+            by_ip = dict(zip(ips, delays))
+            return {slice: [by_ip[ip] for ip in ips_by_slice[slice]] for slice in slices}
+        snapshot = self.snapshot_factory()
+        # The same scan updates the BSRs for the next round's contexts
+        starting_buffer_time = datetime.strptime(self.clock(), "%Y%m%d.%H:%M:%S") - timedelta(seconds=1)
+        snapshot.register("ue0", bsr_tracker.watch(starting_buffer_time))
+        user_delays = user_packet_delays(measurement_start, qos_sample_budget * len(slices), snapshot, by_user=True)
+        self.bsr_fed = True
+        return {slice: slice.users(user_delays) for slice in slices}
+
+    def round(self):
+        # One round of all slices with alive users; return these slices
+        self.rounds += 1
+        round_start = time.time()
+        print(f"[slices] Start of round {self.rounds}")
+        contexts = self.contexts()
+        context_time = time.time()
+
+        slices, allocations = [], {}
+        for slice, (actual_context, num_alive_users) in zip(self.slices, contexts):
+            if num_alive_users == 0:
+                print(f"[{slice.name}] All users powered off.")
+                continue
+            slices.append(slice)
+            allocations[slice.cell] = (slice.rb_start, slice.select(actual_context))
+        if not slices:
+            return slices
+        self.slice_rounds += len(slices)
+
+        # Enforce the slices' allocations at once, with the status of the UEs to probe
+        actuations = dict(zip(slices, ws_set_cells(allocations, refresh_status=self.qos_backend == "ping",
+                                                   control=self.control)))
+        actuation_time = time.time()
+
+        ips_by_slice = {}
+        if self.qos_backend == "ping":
+            user_ips = ue_status.get(for_real).user_ips
+            ips_by_slice = {slice: slice.ips(user_ips) for slice in slices}
+            log_packet_delays([ip for slice in slices for ip in ips_by_slice[slice]])
+        measurement_start = self.clock()
+        ue_status_age = ue_status.age()
+        self.learner.sleep(self.interval)
+
+        measured = time.time()
+        packet_delays = self.measure(slices, measurement_start, ips_by_slice)
+        decisions = []
+        for slice in slices:
+            QoS_metric, QoS_reward = slice.evaluate(packet_delays[slice])
+            decisions.append(slice.conclude(QoS_metric, QoS_reward, ue_status_age, actuations[slice].latency))
+        evaluation_time = time.time()
+        for slice, decision in zip(slices, decisions):
+            slice.record(decision)
+            self.learner.submit(slice.learn, decision)
+        learning_time = time.time()
+
+        self.timing["context"] += context_time - round_start
+        self.timing["actuation"] += actuation_time - context_time
+        self.timing["evaluation"] += evaluation_time - measured
+        self.timing["learning"] += learning_time - evaluation_time
+        print(f"[slices] Round {self.rounds} of {len(slices)} slices took {learning_time - round_start:.3f} seconds")
+        return slices
+
+    def run(self, rounds=None, observe=None):
+        # Run rounds until all users of all slices are powered off; observe,
+        # if given, is called with the round number and its slices after each
+        try:
+            while rounds is None or self.rounds < rounds:
+                slices = self.round()
+                if not slices:
+                    print("[slices] All users powered off.")
+                    break
+                if observe is not None:
+                    observe(self.rounds, slices)
+        finally:
+            # The trajectories are complete once the learning is done
+            self.learner.wait()
+
+    def report(self):
+        busy = sum(self.timing.values())
+        print(f"[slices] {self.rounds} rounds of {len(self.slices)} slices: "
+              + ", ".join(f"{stage} {seconds / max(self.rounds, 1) * 1000:.1f} ms" for stage, seconds in self.timing.items())
+              + f" per round besides the measurement interval ({busy / max(self.rounds, 1) * 1000:.1f} ms)")
+        self.learner.report()
+
+if __name__ == "__main__":
+    # Rounds per second as the number of slices grows, with a zero measurement
+    # interval, against local stand-ins of the Callbox and UEbox APIs and
+    # synthetic logs; each slice has its own cell and ues_per_slice UEs, e.g.:
+    # python3 -m util.slices 1 2 4 8 16 32
+    # Then, the round time of two slices with the learning in the round and
+    # overlapped with the next round
+    import io
+    import json
+    import tempfile
+    import contextlib
+    from .wsclient import StandInServer, ws_pool
+    from .loggen import write_log_pair
+    sizes = [int(value) for value in sys.argv[1:]] or [1, 2, 4, 8, 16, 32]
+    ues_per_slice = 2
+    rounds = 10
+    clock_offset = 5  # seconds the measurements look back
+
+    def clock():
+        return (datetime.now() - timedelta(seconds=clock_offset)).strftime("%Y%m%d.%H:%M:%S")
+
+    cells = {}
+
+    def config_set(message):
+        for cell, config in message["cells"].items():
+            cells[cell] = dict(config)
+        return {}
+
+    def config_get(message):
+        return {"cells": {cell: dict(config) for cell, config in cells.items()}}
+
+    num_ues = max(sizes) * ues_per_slice
+    ue_list = [{"ue_id": ue_id, "rrc_state": "connected", "emm_state": "registered", "cells": [{"cqi": 15}],
+                "dl_mcs": 20, "ul_mcs": 20, "pdn_list": [{"ipv4": f"192.168.3.{ue_id}"}]}
+               for ue_id in range(1, num_ues + 1)]
+    callbox = StandInServer({"config_set": config_set, "config_get": config_get}, name="ENB")
+    uebox = StandInServer({"ue_get": {"ue_list": ue_list}})
+    ws_pool.redirect(control_plane.callbox, callbox.address)
+    ws_pool.redirect(control_plane.uebox, uebox.address)
+
+    with tempfile.TemporaryDirectory() as directory:
+        start_time = datetime.now().replace(microsecond=0) - timedelta(seconds=clock_offset + 2)
+        paths, _, packets, _ = write_log_pair(directory, num_ues, packet_rate=20, mac_rate=10,
+                                              duration=clock_offset + 2 + 120, start_time=start_time)
+
+        def snapshot_factory():
+            snapshot = LogSnapshot()
+            snapshot.use_logs("ue0", paths["ue0"])
+            snapshot.use_logs("mme", paths["mme"])
+            return snapshot
+
+        baseline = None
+        for size in sizes:
+            slices = [Slice(f"slice{i}", cell=str(i + 1), prbs=PRBs,
+                            ue_ids=range(i * ues_per_slice + 1, (i + 1) * ues_per_slice + 1),
+                            trajectory_file=os.path.join(directory, f"slice{i}_trajectory.txt"))
+                      for i in range(size)]
+            scheduler = SliceScheduler(slices, interval=0, snapshot_factory=snapshot_factory, clock=clock,
+                                       qos_backend="logs")
+            with contextlib.redirect_stdout(io.StringIO()):
+                scheduler.round()
+                scheduler.timing.clear()
+                scheduler.rounds = 0
+                start = time.time()
+                scheduler.run(rounds)
+            elapsed = (time.time() - start) / rounds
+            baseline = baseline or elapsed
+            print(f"[slices] {size:3d} slices: {1 / elapsed:6.1f} rounds/s, {size / elapsed:7.1f} slice-rounds/s "
+                  f"({size * baseline / elapsed:.1f}x one slice per round); per round: "
+                  + ", ".join(f"{stage} {seconds / rounds * 1000:.1f} ms" for stage, seconds in scheduler.timing.items()))
+
+        # Round time besides a short measurement interval with and without
+        # overlapping the learning, for value iteration, whose episodes end
+        # with the heaviest planning
+        overlap_rounds = initial_rounds + 3 * rounds_per_episode
+        for overlap in (False, True):
+            slices = [Slice(f"slice{i}", cell=str(i + 1), prbs=PRBs,
+                            ue_ids=range(i * ues_per_slice + 1, (i + 1) * ues_per_slice + 1),
+                            trajectory_file=os.path.join(directory, f"overlap{i}_trajectory.txt"),
+                            algorithm="value_iteration")
+                      for i in range(2)]
+            scheduler = SliceScheduler(slices, interval=0.2, snapshot_factory=snapshot_factory, clock=clock,
+                                       learner=Learner(overlap), qos_backend="logs")
+            with contextlib.redirect_stdout(io.StringIO()):
+                scheduler.run(overlap_rounds)
+            print(f"[slices] Learning {'overlapped' if overlap else 'in the round'}: "
+                  f"{sum(scheduler.timing.values()) / overlap_rounds * 1000:.1f} ms per round besides the measurement "
+                  f"interval, of which learning {scheduler.timing['learning'] / overlap_rounds * 1000:.1f} ms")
+            scheduler.learner.report()
+    ws_pool.close_all()
+    callbox.close()
+    uebox.close()
@@ -0,0 +1,104 @@
+import time
+import threading
+import paramiko
+from collections import defaultdict
+from .parameters import debug_mode
+
+# Seconds between keepalive packets sent over idle pooled transports
+keepalive_interval = 30
+
+class SSHConnectionPool:
+    # Keep one authenticated SSH transport and one SFTP session per unit
+    # ("ue0"/"mme") alive across rounds. Connections are health-checked on
+    # every acquisition and transparently reopened when they have dropped.
+    def __init__(self, params):
+        # params(unit) returns the remote_params() tuple of the unit
+        self.params = params
+        self.clients = {}
+        self.sftps = {}
+        self.keys = {}
+        self.locks = defaultdict(threading.RLock)
+        self.handshakes = defaultdict(int)
+        self.reuses = defaultdict(int)
+        self.handshake_time = defaultdict(float)
+
+    def is_alive(self, unit):
+        # A pooled connection is healthy if its transport is active
+        # and still accepts a (no-op) SSH_MSG_IGNORE packet
+        client = self.clients.get(unit)
+        if client is None:
+            return False
+        transport = client.get_transport()
+        if transport is None or not transport.is_active():
+            return False
+        try:
+            transport.send_ignore()
+        except (paramiko.SSHException, EOFError, OSError):
+            return False
+        return True
+
+    def client(self, unit):
+        # Return a connected paramiko.SSHClient for the unit
+        with self.locks[unit]:
+            if self.is_alive(unit):
+                self.reuses[unit] += 1
+                return self.clients[unit]
+
+            # Drop whatever is left of a broken connection
+            self.close(unit)
+
+            _, _, _, remote_host, remote_username, remote_auth_key, _ = self.params(unit)
+
+            # Load the private key only once
+            if remote_auth_key not in self.keys:
+                self.keys[remote_auth_key] = paramiko.Ed25519Key(filename=remote_auth_key)
+
+            ssh = paramiko.SSHClient()
+            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            start_time = time.time()
+            ssh.connect(remote_host, username=remote_username, pkey=self.keys[remote_auth_key])
+            ssh.get_transport().set_keepalive(keepalive_interval)
+            self.handshake_time[unit] += time.time() - start_time
+            self.handshakes[unit] += 1
+            if debug_mode: print(f"[sshpool] Connected to {unit} ({remote_host}) "
+                                 f"in {time.time() - start_time:.3f} seconds")
+
+            self.clients[unit] = ssh
+            return ssh
+
+    def sftp(self, unit):
+        # Return an open paramiko.SFTPClient riding on the pooled connection
+        with self.locks[unit]:
+            self.client(unit)
+            sftp = self.sftps.get(unit)
+            if sftp is None or sftp.get_channel() is None or sftp.get_channel().closed:
+                sftp = self.clients[unit].open_sftp()
+                self.sftps[unit] = sftp
+            return sftp
+
+    def close(self, unit):
+        # Close the SFTP session and the connection of the unit, if any;
+        # the next acquisition reconnects
+        with self.locks[unit]:
+            sftp = self.sftps.pop(unit, None)
+            client = self.clients.pop(unit, None)
+            try:
+                if sftp is not None:
+                    sftp.close()
+                if client is not None:
+                    client.close()
+            except (paramiko.SSHException, EOFError, OSError):
+                pass
+
+    def close_all(self):
+        for unit in list(self.clients):
+            self.close(unit)
+
+    def stats(self):
+        # Per unit handshake count, reuse count and total handshake time
+        units = sorted(set(self.handshakes) | set(self.reuses))
+        return {unit: (self.handshakes[unit], self.reuses[unit], self.handshake_time[unit]) for unit in units}
+
+    def report(self):
+        for unit, (handshakes, reuses, handshake_time) in self.stats().items():
+            print(f"[sshpool] {unit}: {handshakes} handshakes ({handshake_time:.3f} seconds), {reuses} reuses")
@@ -0,0 +1,317 @@
+import os
+import sys
+import time
+import queue
+import signal
+import multiprocessing
+from datetime import datetime
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.managers import SyncManager
+from .parameters import *
+from .slices import Slice, SliceScheduler
+from .sketch import DelayHistory
+from .control import control_plane
+from .liveness import ws_set_cells
+from .wsclient import ws_pool
+from .logflatten import LogSnapshot, remote_params, remote_overrides, ssh_pool, log_cache
+from .logflatten import start_log_streams, report_log_streams, stop_log_streams
+from .calculate_reward import probe_agent
+
+class LearningExchange:
+    # Learnt statistics of a slice, published to a store shared by the
+    # processes of the testbeds (a multiprocessing Manager dict), and those
+    # of its peers, i.e., the slices of the other testbeds, read from it.
+    # Each slice writes its own entries only, so no update is lost; the
+    # peers' statistics are pooled with the own ones when used, never merged
+    # into them, so that they are not counted twice.
+    def __init__(self, store, owner, peers):
+        self.store = store
+        self.owner = owner
+        self.peers = [peer for peer in peers if peer != owner]
+        self.pulls = 0
+        # Most UCB1 iterations of the peers taken into account at once
+        self.shared_iterations = 0
+
+    def publish_ucb1(self, grid, context, ucb1):
+        self.store[(grid, "ucb1", context, self.owner)] = (list(ucb1.counts), list(ucb1.avg_rewards), ucb1.iterations)
+
+    def ucb1(self, grid, context):
+        # (counts, average rewards, iterations) of the peers' UCB1 of the context
+        counts, sums, iterations = [], [], 0
+        for peer in self.peers:
+            entry = self.store.get((grid, "ucb1", context, peer))
+            if entry is None:
+                continue
+            peer_counts, peer_rewards, peer_iterations = entry
+            if not counts:
+                counts, sums = [0] * len(peer_counts), [0.0] * len(peer_counts)
+            for arm, (count, reward) in enumerate(zip(peer_counts, peer_rewards)):
+                counts[arm] += count
+                sums[arm] += count * reward
+            iterations += peer_iterations
+        self.pulls += 1
+        self.shared_iterations = max(self.shared_iterations, iterations)
+        return counts, [total / count if count else 0.0 for total, count in zip(sums, counts)], iterations
+
+    def publish_transitions(self, grid, users, state_transition_count):
+        self.store[(grid, "transitions", users, self.owner)] = dict(state_transition_count)
+
+    def transitions(self, grid, users):
+        # Pooled state transition counts of the peers for the number of users
+        pooled = defaultdict(int)
+        for peer in self.peers:
+            for key, count in self.store.get((grid, "transitions", users, peer), {}).items():
+                pooled[key] += count
+        self.pulls += 1
+        return pooled
+
+def use_testbed(testbed, workdir):
+    # Point this process at the testbed: its Amarisoft API endpoints, its
+    # hosts for SSH (with the default keys, unless overridden) and a working
+    # directory of its own for the local logs and the log cache
+    control_plane.callbox = f"{testbed['callbox_ip']}:{testbed.get('callbox_port', 9001)}"
+    control_plane.uebox = f"{testbed['uebox_ip']}:{testbed.get('uebox_port', 9002)}"
+    for unit, host in (("ue0", testbed["uebox_ip"]), ("mme", testbed["callbox_ip"])):
+        _, _, _, _, _, remote_auth_key, _ = remote_params(unit)
+        overrides = {"remote_host": host, "remote_auth_key": remote_auth_key, **testbed.get("remote", {}).get(unit, {})}
+        overrides["remote_auth_key"] = os.path.abspath(overrides["remote_auth_key"])
+        remote_overrides[unit] = overrides
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    # The (relative) log cache directory is now the testbed's
+    log_cache.load()
+
+def run_testbed(testbed, rounds=None, trajectories_folder="./trajectories", timestring="", events=None, store=None,
+                peers=(), interval=round_interval):
+    # Worker of a testbed: run its slices in shared rounds until all their
+    # users are powered off, rounds are done or it is interrupted, putting
+    # (testbed, slice, round, trajectory row) to events after every round;
+    # return its statistics
+    name = testbed["name"]
+    trajectories_folder = os.path.abspath(trajectories_folder)
+    use_testbed(testbed, os.path.abspath(os.path.join("testbeds", name)))
+    # Output of the testbed, e.g., testbeds/lab2/output.log
+    sys.stdout = open("output.log", "a", buffering=1)
+
+    slices = []
+    for config in testbed.get("slices", slice_configs):
+        prefix = os.path.join(trajectories_folder, f"{timestring}_{name}_{config['name']}")
+        slice = Slice(**config, trajectory_file=prefix + "_trajectory.txt",
+                      delay_history=DelayHistory(prefix + "_delays.json"))
+        if store is not None:
+            slice.exchange = LearningExchange(store, f"{name}/{slice.name}", peers)
+        slices.append(slice)
+
+    snapshot_factory = LogSnapshot
+    if "logs" in testbed:
+        # Local logs of the units (e.g., exported ones) instead of the boxes'
+        def snapshot_factory():
+            snapshot = LogSnapshot()
+            for unit, filepaths in testbed["logs"].items():
+                snapshot.use_logs(unit, filepaths)
+            return snapshot
+
+    def observe(round_number, active):
+        if events is not None:
+            for slice in active:
+                events.put((name, slice.name, round_number, slice.row))
+
+    scheduler = SliceScheduler(slices, interval=interval, snapshot_factory=snapshot_factory,
+                               qos_backend=testbed.get("qos_backend", qos_backend))
+    if log_streaming:
+        start_log_streams()
+    start = time.time()
+    try:
+        scheduler.run(rounds, observe)
+    except KeyboardInterrupt:
+        print(f"[testbeds] Keyboard interrupt, resetting to 90 PRBs...")
+    elapsed = time.time() - start
+    ws_set_cells({slice.cell: (slice.rb_start, 90) for slice in slices})
+    scheduler.report()
+    ssh_pool.report()
+    probe_agent.report()
+    log_cache.report()
+    report_log_streams()
+    stop_log_streams()
+    ssh_pool.close_all()
+    ws_pool.close_all()
+    return {"name": name, "rounds": scheduler.rounds, "slice_rounds": scheduler.slice_rounds, "elapsed": elapsed,
+            "timing": dict(scheduler.timing), "trajectories": [slice.trajectory_file for slice in slices],
+            "shared_iterations": sum(slice.exchange.shared_iterations for slice in slices if slice.exchange)}
+
+def ignore_interrupts():
+    # The shared store must outlive a keyboard interrupt of the testbeds
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+class TestbedCoordinator:
+    # Estimators of several testbeds, one worker process per testbed (see
+    # run_testbed()). The rows of their rounds are gathered as they come into
+    # one trajectory, with the testbed, slice and round of each, and their
+    # timing when they are done. With share, the slices of different testbeds
+    # with the same PRB allocations and context grid pool their UCB1 and
+    # transition statistics.
+    def __init__(self, testbeds, trajectories_folder="./trajectories", timestring=None, share=share_learning,
+                 interval=round_interval):
+        names = [testbed["name"] for testbed in testbeds]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Testbeds must have distinct names, got {names}")
+        self.testbeds = testbeds
+        self.trajectories_folder = trajectories_folder
+        self.timestring = timestring or datetime.now().strftime("%Y%m%d%H%M")
+        self.share = share
+        self.interval = interval
+        self.trajectory_file = os.path.join(trajectories_folder, f"{self.timestring}_testbeds_trajectory.txt")
+        self.results = {}
+        self.errors = {}
+        self.rows = 0
+        self.elapsed = 0
+
+    def peers(self, name):
+        # Slices of the other testbeds
+        return [f"{testbed['name']}/{config['name']}" for testbed in self.testbeds if testbed["name"] != name
+                for config in testbed.get("slices", slice_configs)]
+
+    def collect(self, events, timeout=None):
+        # Append the rows reported so far to the trajectory, waiting up to
+        # timeout seconds for the first one
+        rows = []
+        try:
+            rows.append(events.get(timeout=timeout) if timeout else events.get_nowait())
+            while True:
+                rows.append(events.get_nowait())
+        except queue.Empty:
+            pass
+        if not rows:
+            return
+        with open(self.trajectory_file, "a") as file:
+            for name, slice_name, round_number, row in rows:
+                file.write(f"{row}\t{name}\t{slice_name}\t{round_number}\n")
+                bandwidth, _, _, _, delay, reward = row.split("\t")[:6]
+                print(f"[testbeds] {name}/{slice_name} round {round_number}: {bandwidth} PRBs, "
+                      f"delay {delay} ms, reward {reward}")
+        self.rows += len(rows)
+
+    def run(self, rounds=None):
+        # Run the testbeds until all of them are done; return their statistics
+        os.makedirs(self.trajectories_folder, exist_ok=True)
+        with open(self.trajectory_file, "w") as file:
+            file.write(f"BW\tUsers\tMCS\tBSR\tDelay\tReward\tUEsAge\tActuation\tTestbed\tSlice\tRound\t{algorithm}\n")
+        # Workers come from a fork server rather than forking this process,
+        # whose threads and connections (ssh_pool, ws_pool, the log streams)
+        # are not theirs to inherit: each testbed connects on its own
+        context = multiprocessing.get_context('forkserver')
+        manager = SyncManager(ctx=context)
+        manager.start(ignore_interrupts)
+        start = time.time()
+        try:
+            events = manager.Queue()
+            store = manager.dict() if self.share else None
+            with ProcessPoolExecutor(max_workers=len(self.testbeds), mp_context=context) as pool:
+                futures = {pool.submit(run_testbed, testbed, rounds, self.trajectories_folder, self.timestring, events,
+                                       store, self.peers(testbed["name"]), self.interval): testbed["name"]
+                           for testbed in self.testbeds}
+                pending = set(futures)
+                while pending:
+                    try:
+                        self.collect(events, 1)
+                        pending = {future for future in pending if not future.done()}
+                    except KeyboardInterrupt:
+                        print("[testbeds] Keyboard interrupt, waiting for the testbeds to reset...")
+            self.collect(events)
+        finally:
+            manager.shutdown()
+        self.elapsed = time.time() - start
+        for future, name in futures.items():
+            try:
+                self.results[name] = future.result()
+            except Exception as e:
+                self.errors[name] = e
+                print(f"[testbeds] {name} failed: {e!r}")
+        return self.results
+
+    def report(self):
+        # Rounds, slice-rounds per second and time per round stage, per testbed and overall
+        totals, rounds, slice_rounds = defaultdict(float), 0, 0
+        for name, result in self.results.items():
+            per_round = max(result["rounds"], 1)
+            print(f"[testbeds] {name}: {result['rounds']} rounds, {result['slice_rounds']} slice-rounds "
+                  f"in {result['elapsed']:.1f} seconds; per round: "
+                  + ", ".join(f"{stage} {seconds / per_round * 1000:.1f} ms"
+                              for stage, seconds in result["timing"].items())
+                  + (f"; {result['shared_iterations']} UCB1 rounds of other testbeds pooled" if self.share else ""))
+            for stage, seconds in result["timing"].items():
+                totals[stage] += seconds
+            rounds += result["rounds"]
+            slice_rounds += result["slice_rounds"]
+        print(f"[testbeds] {len(self.results)} testbeds: {slice_rounds} slice-rounds in {self.elapsed:.1f} seconds "
+              f"({slice_rounds / max(self.elapsed, 1e-9):.2f} slice-rounds/s), {self.rows} trajectory rows; per round: "
+              + ", ".join(f"{stage} {seconds / max(rounds, 1) * 1000:.1f} ms" for stage, seconds in totals.items()))
+        for name, error in self.errors.items():
+            print(f"[testbeds] {name} failed: {error!r}")
+
+if __name__ == "__main__":
+    # Slice-rounds per second as the number of testbeds grows, each with its
+    # own local stand-ins of the Callbox and UEbox APIs and its own generated
+    # logs in place of SSH, and with learning shared among them, e.g.:
+    # python3 -m util.testbeds 1 2 4
+    import io
+    import tempfile
+    import contextlib
+    from datetime import timedelta
+    from .wsclient import StandInServer
+    from .loggen import write_log_pair
+    sizes = [int(value) for value in sys.argv[1:]] or [1, 2, 4]
+    rounds = 5
+    interval = 0.5
+    num_ues = 4
+
+    def stand_ins():
+        cells = {}
+
+        def config_set(message):
+            for cell, config in message["cells"].items():
+                cells[cell] = dict(config)
+            return {}
+
+        def config_get(message):
+            return {"cells": {cell: dict(config) for cell, config in cells.items()}}
+
+        ue_list = [{"ue_id": ue_id, "rrc_state": "connected", "emm_state": "registered", "cells": [{"cqi": 15}],
+                    "dl_mcs": 20, "ul_mcs": 20, "pdn_list": [{"ipv4": f"192.168.3.{ue_id}"}]}
+                   for ue_id in range(1, num_ues + 1)]
+        return (StandInServer({"config_set": config_set, "config_get": config_get}, name="ENB"),
+                StandInServer({"ue_get": {"ue_list": ue_list}}))
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        servers, configs = [], []
+        for i in range(max(sizes)):
+            callbox, uebox = stand_ins()
+            servers += [callbox, uebox]
+            start_time = datetime.now().replace(microsecond=0) - timedelta(seconds=5)
+            os.makedirs(f"logs{i}")
+            paths, _, _, _ = write_log_pair(os.path.join(directory, f"logs{i}"), num_ues, packet_rate=20,
+                                            mac_rate=10, duration=300, start_time=start_time, seed=i)
+            configs.append({"name": f"lab{i}", "callbox_ip": "127.0.0.1", "callbox_port": callbox.address.split(":")[1],
+                            "uebox_ip": "127.0.0.1", "uebox_port": uebox.address.split(":")[1], "logs": paths,
+                            "qos_backend": "logs"})
+
+        baseline = None
+        for share in (False, True):
+            for size in sizes:
+                coordinator = TestbedCoordinator(configs[:size], os.path.join(directory, "trajectories"),
+                                                 f"{size}{share}", share, interval)
+                with contextlib.redirect_stdout(io.StringIO()) as output:
+                    coordinator.run(rounds)
+                    coordinator.report()
+                rate = sum(result["slice_rounds"] for result in coordinator.results.values()) / coordinator.elapsed
+                baseline = baseline or rate
+                print(f"[testbeds] {size} testbeds{', sharing learning' if share else ''}: {rate:.2f} slice-rounds/s "
+                      f"({rate / baseline:.1f}x one testbed), {coordinator.rows} trajectory rows, "
+                      f"{len(coordinator.errors)} failures"
+                      + (f", {sum(result['shared_iterations'] for result in coordinator.results.values())} "
+                         f"UCB1 rounds of other testbeds pooled" if share else ""))
+                print(output.getvalue().splitlines()[-1 - len(coordinator.errors)])
+        for server in servers:
+            server.close()
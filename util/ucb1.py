@@ -5,8 +5,9 @@ from .parameters import PRBs
 
 
 class UCB1:
-    def __init__(self, num_arms, arm_correlations):
+    def __init__(self, num_arms, arm_correlations, prbs=PRBs):
         self.num_arms = num_arms
+        self.prbs = prbs
         self.iterations = 0
         self.counts = [0] * num_arms
         self.avg_rewards = [0.0] * num_arms
@@ -17,18 +18,39 @@ class UCB1:
         # When correlations are considered, self.counts[a] is not the number of times that arm 'a' is selected
         self.times_selected = [0] * num_arms
 
+        # Counts, average rewards and iterations of the same arms and context
+        # learnt elsewhere (e.g., on other testbeds), None if not shared
+        self.shared = None
+
+    def share(self, counts, avg_rewards, iterations):
+        # Take statistics learnt elsewhere into account when selecting arms;
+        # they are not merged into this object's own statistics
+        self.shared = (counts, avg_rewards, iterations) if iterations else None
+
+    def pooled(self):
+        # Counts, average rewards and iterations of own and shared rounds
+        if self.shared is None:
+            return self.counts, self.avg_rewards, self.iterations
+        shared_counts, shared_rewards, shared_iterations = self.shared
+        counts = [own + shared for own, shared in zip(self.counts, shared_counts)]
+        avg_rewards = [(own_count * own + shared_count * shared) / count if count else 0.0
+                       for own_count, own, shared_count, shared, count
+                       in zip(self.counts, self.avg_rewards, shared_counts, shared_rewards, counts)]
+        return counts, avg_rewards, self.iterations + shared_iterations
+
     def select_arm(self):
         ucb_indices = [0.0] * self.num_arms
+        counts, avg_rewards, iterations = self.pooled()
 
         for arm in range(self.num_arms):
-            if self.counts[arm] == 0:
+            if counts[arm] == 0:
                 selected_arm = arm
                 # self.print_debug_info(ucb_indices, selected_arm)
                 self.times_selected[selected_arm] += 1
                 return selected_arm
 
-            exploitation = self.avg_rewards[arm]
-            exploration = np.sqrt((2 * np.log(self.iterations) / self.counts[arm]))
+            exploitation = avg_rewards[arm]
+            exploration = np.sqrt((2 * np.log(iterations) / counts[arm]))
             ucb_indices[arm] = exploitation + exploration
 
         max_ucb_value = max(ucb_indices)
@@ -56,8 +78,8 @@ class UCB1:
     def update(self, selected_arm, QoS_reward):
 
         # The selected arm is always updated regardless of correlations
-        bandwidth = PRBs[selected_arm]
-        reward = compute_rl_reward(bandwidth, QoS_reward)
+        bandwidth = self.prbs[selected_arm]
+        reward = compute_rl_reward(bandwidth, QoS_reward, prbs=self.prbs)
         self.single_arm_update(selected_arm, reward)
 
         # if arm correlations are considered, also update correlated arms
@@ -65,14 +87,14 @@ class UCB1:
             # If we did not meet the SLA, smaller arms/bandwidths would also fail
             if QoS_reward == 0:
                 for arm in range(selected_arm):
-                    bandwidth = PRBs[arm]
-                    reward = compute_rl_reward(bandwidth, QoS_reward)
+                    bandwidth = self.prbs[arm]
+                    reward = compute_rl_reward(bandwidth, QoS_reward, prbs=self.prbs)
                     self.single_arm_update(arm, reward)
             # If we met the SLA, larger arms/bandwidths would also succeed
             if reward == 1:
                 for arm in range(selected_arm + 1, self.num_arms):
-                    bandwidth = PRBs[arm]
-                    reward = compute_rl_reward(bandwidth, QoS_reward)
+                    bandwidth = self.prbs[arm]
+                    reward = compute_rl_reward(bandwidth, QoS_reward, prbs=self.prbs)
                     self.single_arm_update(arm, reward)
 
         # Algorithm just finished an iteration
@@ -0,0 +1,182 @@
+import sys
+import time
+import threading
+import numpy as np
+from .parameters import debug_mode
+
+class UeRegistry:
+    # State of the UEs of the UEbox keyed by ue_id, one row per UE ever seen.
+    # Consecutive ue_get results are applied as diffs: a UE whose entry did
+    # not change costs one dict comparison, and the round's view is rebuilt
+    # only if some UE changed. Event notifications of the remote API (e.g.,
+    # attach, detach and RRC state changes) update single UEs in between.
+    def __init__(self, capacity=16):
+        self.lock = threading.Lock()
+        self.rows = {}  # ue_id -> row
+        self.ue_ids = np.zeros(capacity, dtype=np.int64)
+        self.present = np.zeros(capacity, dtype=bool)    # in the last ue_get
+        self.connected = np.zeros(capacity, dtype=bool)  # RRC connected
+        self.alive = np.zeros(capacity, dtype=bool)      # not powered off
+        self.dl_mcs = np.full(capacity, np.nan)
+        self.ul_mcs = np.full(capacity, np.nan)
+        self.entries = []  # last ue_get entry per row
+        self.ue_tuples = []  # (ue_id, rrc_state, per-cell CQIs) per row
+        self.ipv4 = []  # first PDN's IPv4 address per row, None if none
+        self.version = 0
+        self.view_cache = None
+        self.changes = 0
+        self.unchanged = 0
+        self.events = 0
+
+    def row(self, ue_id):
+        row = self.rows.get(ue_id)
+        if row is not None:
+            return row
+        row = len(self.entries)
+        if row == len(self.ue_ids):
+            # Double the capacity of the arrays
+            for name in ("ue_ids", "present", "connected", "alive", "dl_mcs", "ul_mcs"):
+                array = getattr(self, name)
+                grown = np.full(2 * len(array), np.nan) if array.dtype == float else np.zeros(2 * len(array), array.dtype)
+                grown[:len(array)] = array
+                setattr(self, name, grown)
+        self.rows[ue_id] = row
+        self.ue_ids[row] = ue_id
+        self.entries.append({})
+        self.ue_tuples.append(None)
+        self.ipv4.append(None)
+        return row
+
+    def update(self, row, entry):
+        # Set the state of a UE from its (possibly partial) entry
+        self.entries[row] = entry
+        rrc_state = entry.get('rrc_state')
+        self.connected[row] = rrc_state == 'connected'
+        self.alive[row] = entry.get('emm_state') != 'power off'
+        self.dl_mcs[row] = entry.get('dl_mcs', np.nan) if entry.get('dl_mcs') is not None else np.nan
+        self.ul_mcs[row] = entry.get('ul_mcs', np.nan) if entry.get('ul_mcs') is not None else np.nan
+        self.ue_tuples[row] = (entry.get('ue_id'), rrc_state, [cell.get('cqi') for cell in entry.get('cells', [])])
+        try:
+            self.ipv4[row] = entry["pdn_list"][0]["ipv4"]
+        except (KeyError, IndexError, TypeError):
+            self.ipv4[row] = None
+
+    def apply(self, ue_list, complete=True):
+        # Apply the UE entries of a ue_get (complete: UEs missing from it are
+        # gone) or of a notification (partial: only the given fields change);
+        # return the number of UEs that changed
+        changed = 0
+        with self.lock:
+            seen = np.zeros(len(self.ue_ids), dtype=bool) if complete else None
+            for entry in ue_list:
+                row = self.row(entry['ue_id'])
+                if seen is not None:
+                    if row >= len(seen):
+                        seen = np.concatenate((seen, np.zeros(len(self.ue_ids) - len(seen), dtype=bool)))
+                    seen[row] = True
+                previous = self.entries[row]
+                if not complete:
+                    entry = {**previous, **entry}
+                if entry == previous and self.present[row]:
+                    continue
+                self.update(row, entry)
+                self.present[row] = True
+                changed += 1
+            if complete:
+                gone = self.present[:len(seen)] & ~seen[:len(self.present)]
+                changed += int(np.count_nonzero(gone))
+                self.present[:len(seen)] &= seen[:len(self.present)]
+            if changed:
+                self.version += 1
+            self.changes += changed
+            self.unchanged += len(ue_list) - min(changed, len(ue_list))
+        return changed
+
+    def notify(self, message):
+        # Listener of the remote API's notifications: UE entries, as a list
+        # or as events naming a ue_id, update the registry in place
+        if not isinstance(message, dict):
+            return
+        if isinstance(message.get('ue_list'), list):
+            entries = message['ue_list']
+        elif isinstance(message.get('events'), list):
+            entries = [event for event in message['events'] if isinstance(event, dict) and 'ue_id' in event]
+        elif 'ue_id' in message:
+            entries = [message]
+        else:
+            return
+        entries = [{key: value for key, value in entry.items() if key not in ('message', 'message_id', 'notification',
+                                                                              'time', 'utc', 'event')}
+                   for entry in entries if 'ue_id' in entry]
+        self.events += len(entries)
+        if self.apply(entries, complete=False) and debug_mode:
+            print(f"[ueregistry] {len(entries)} UE events applied")
+
+    def view(self):
+        # (ue_list, mcs, active_users, alive_users, {ue_id: IPv4}) of the
+        # present UEs, in the order they were first seen; rebuilt only when
+        # some UE changed
+        with self.lock:
+            if self.view_cache is not None and self.view_cache[0] == self.version:
+                return self.view_cache[1]
+            rows = np.flatnonzero(self.present[:len(self.entries)])
+            connected = rows[self.connected[rows]]
+            ue_list = [self.ue_tuples[row] for row in rows.tolist()]
+            mcs = [(self.entries[row].get('dl_mcs'), self.entries[row].get('ul_mcs')) for row in rows.tolist()]
+            active_users = self.ue_ids[connected].tolist()
+            alive_users = self.ue_ids[rows[self.alive[rows]]].tolist()
+            user_ips = {int(self.ue_ids[row]): self.ipv4[row] for row in connected.tolist() if self.ipv4[row] is not None}
+            view = (ue_list, mcs, active_users, alive_users, user_ips)
+            self.view_cache = (self.version, view)
+            return view
+
+    def ul_mcs_mean(self):
+        # Mean UL MCS of the present UEs that report one, None if none
+        values = self.ul_mcs[:len(self.entries)][self.present[:len(self.entries)]]
+        values = values[~np.isnan(values)]
+        return float(values.mean()) if len(values) else None
+
+if __name__ == "__main__":
+    # Compare a full parse of every ue_get with the registry's diffs as UEs
+    # change between polls, e.g.:
+    # python3 -m util.ueregistry 10 100 1000
+    import os
+    import json
+    import random
+    from .liveness import UeSnapshot
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ws.out')) as file:
+        output = file.read()
+    template = json.loads(output[output.find('{'):])['ue_list'][0]
+    rng = random.Random(0)
+    polls = 50
+    for num_ues in [int(value) for value in sys.argv[1:]] or [10, 100, 1000]:
+        ue_list = []
+        for ue_id in range(1, num_ues + 1):
+            entry = json.loads(json.dumps(template))
+            entry.update({'ue_id': ue_id, 'dl_mcs': 20, 'ul_mcs': 20, 'pdn_list': [{'ipv4': f"192.168.3.{ue_id % 256}"}]})
+            ue_list.append(entry)
+        for changing in (0.0, 0.1):
+            outputs = []
+            for _ in range(polls):
+                for entry in rng.sample(ue_list, int(changing * num_ues)):
+                    entry['ul_mcs'] = rng.randrange(29)
+                    entry['rrc_state'] = rng.choice(['connected', 'disconnected'])
+                outputs.append({'message': 'ue_get', 'ue_list': [dict(entry) for entry in ue_list]})
+            texts = [json.dumps(response, indent=4) for response in outputs]
+
+            start = time.time()
+            for text in texts:
+                snapshot = UeSnapshot.parse(text)
+            parsed = time.time() - start
+
+            registry = UeRegistry()
+            start = time.time()
+            for response in outputs:
+                registry.apply(response['ue_list'])
+                view = registry.view()
+            applied = time.time() - start
+            same = view == (snapshot.ue_list, snapshot.mcs, snapshot.active_users, snapshot.alive_users,
+                            snapshot.user_ips)
+            print(f"[ueregistry] {num_ues} UEs, {100 * changing:.0f}% changing per poll: full parse "
+                  f"{parsed / polls * 1000:.2f} ms vs registry {applied / polls * 1000:.2f} ms per poll "
+                  f"({registry.changes} changes applied), same view: {same}")
@@ -0,0 +1,464 @@
+import os
+import sys
+import json
+import time
+import base64
+import socket
+import hashlib
+import hmac
+import struct
+import threading
+from collections import defaultdict
+from .parameters import debug_mode, ws_timeout
+
+# RFC 6455 handshake GUID and opcodes
+websocket_guid = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+OP_CONTINUATION, OP_TEXT, OP_BINARY, OP_CLOSE, OP_PING, OP_PONG = 0x0, 0x1, 0x2, 0x8, 0x9, 0xA
+
+def accept_key(key):
+    return base64.b64encode(hashlib.sha1((key + websocket_guid).encode()).digest()).decode()
+
+def mask_payload(payload, mask):
+    # XOR payload with the repeated 4-byte mask, a machine word at a time
+    repeated = (mask * (len(payload) // 4 + 1))[:len(payload)]
+    return (int.from_bytes(payload, 'big') ^ int.from_bytes(repeated, 'big')).to_bytes(len(payload), 'big')
+
+def encode_frame(opcode, payload, masked):
+    header = bytearray([0x80 | opcode])
+    mask_bit = 0x80 if masked else 0
+    if len(payload) < 126:
+        header.append(mask_bit | len(payload))
+    elif len(payload) < 1 << 16:
+        header.append(mask_bit | 126)
+        header += struct.pack('>H', len(payload))
+    else:
+        header.append(mask_bit | 127)
+        header += struct.pack('>Q', len(payload))
+    if masked:
+        mask = os.urandom(4)
+        return bytes(header) + mask + mask_payload(payload, mask)
+    return bytes(header) + payload
+
+class WebSocketConnection:
+    # Minimal RFC 6455 endpoint over a connected socket: text, binary, ping,
+    # pong and close frames, with fragmented messages reassembled
+    def __init__(self, sock, masked):
+        self.sock = sock
+        self.masked = masked
+        self.send_lock = threading.Lock()
+        self.buffer = b''
+
+    def read_exactly(self, size):
+        while len(self.buffer) < size:
+            data = self.sock.recv(max(1 << 16, size - len(self.buffer)))
+            if not data:
+                raise ConnectionError("WebSocket closed by peer")
+            self.buffer += data
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def send(self, opcode, payload):
+        with self.send_lock:
+            self.sock.sendall(encode_frame(opcode, payload, self.masked))
+
+    def send_text(self, text):
+        self.send(OP_TEXT, text.encode())
+
+    def receive(self):
+        # Return the (opcode, payload) of the next data message; control
+        # frames are answered in passing
+        fragments, message_opcode = [], None
+        while True:
+            first, second = self.read_exactly(2)
+            fin, opcode = first & 0x80, first & 0x0F
+            length = second & 0x7F
+            if length == 126:
+                length = struct.unpack('>H', self.read_exactly(2))[0]
+            elif length == 127:
+                length = struct.unpack('>Q', self.read_exactly(8))[0]
+            mask = self.read_exactly(4) if second & 0x80 else None
+            payload = self.read_exactly(length)
+            if mask:
+                payload = mask_payload(payload, mask)
+
+            if opcode == OP_PING:
+                self.send(OP_PONG, payload)
+            elif opcode == OP_CLOSE:
+                try:
+                    self.send(OP_CLOSE, payload[:2])
+                except OSError:
+                    pass
+                raise ConnectionError("WebSocket closed by peer")
+            elif opcode == OP_PONG:
+                continue
+            else:
+                if opcode != OP_CONTINUATION:
+                    message_opcode = opcode
+                fragments.append(payload)
+                if fin:
+                    return message_opcode, b''.join(fragments)
+
+    def close(self):
+        try:
+            self.send(OP_CLOSE, struct.pack('>H', 1000))
+        except OSError:
+            pass
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+def connect_websocket(address, timeout, origin="Test"):
+    # Open a client connection to ws://address/, e.g., "10.0.0.1:9002"
+    host, _, port = address.rpartition(':')
+    sock = socket.create_connection((host, int(port)), timeout=timeout)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    key = base64.b64encode(os.urandom(16)).decode()
+    sock.sendall((f"GET / HTTP/1.1\r\nHost: {address}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                  f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\nOrigin: {origin}\r\n\r\n").encode())
+    response = b''
+    while b'\r\n\r\n' not in response:
+        data = sock.recv(4096)
+        if not data:
+            sock.close()
+            raise ConnectionError(f"WebSocket handshake with {address} failed")
+        response += data
+    head, _, rest = response.partition(b'\r\n\r\n')
+    lines = head.decode(errors='replace').split('\r\n')
+    headers = {name.strip().lower(): value.strip() for name, _, value in (line.partition(':') for line in lines[1:])}
+    if lines[0].split()[1:2] != ['101'] or headers.get('sec-websocket-accept') != accept_key(key):
+        sock.close()
+        raise ConnectionError(f"WebSocket handshake with {address} failed: {lines[0]}")
+    sock.settimeout(None)
+    connection = WebSocketConnection(sock, masked=True)
+    connection.buffer = rest
+    return connection
+
+class AmarisoftClient:
+    # Persistent connection to the remote API of an Amarisoft component,
+    # e.g., the Callbox (callbox_ip:9001) or the UEbox (uebox_ip:9002). A
+    # reader thread routes responses to their requests by message_id, so
+    # several requests may be in flight at once; other messages (e.g.,
+    # events registered for) are handed to the listeners.
+    def __init__(self, address, password=None, timeout=ws_timeout):
+        self.address = address
+        self.password = password
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.connection = None
+        self.ready = None
+        self.reader = None
+        self.pending = {}
+        self.listeners = []
+        self.message_id = 0
+        self.connects = 0
+        self.requests = 0
+        self.latency = 0.0
+
+    def connected(self):
+        return self.connection is not None and self.ready is not None and self.ready.is_set()
+
+    def connect(self):
+        # (Re)connect and wait for the component to be ready
+        with self.lock:
+            if self.connected():
+                return
+            self.disconnect()
+            start_time = time.time()
+            connection = connect_websocket(self.address, self.timeout)
+            ready = threading.Event()
+            self.connection, self.ready = connection, ready
+            self.reader = threading.Thread(target=self.read, args=(connection, ready),
+                                           name=f"ws-{self.address}", daemon=True)
+            self.reader.start()
+        if not ready.wait(self.timeout):
+            self.disconnect()
+            raise TimeoutError(f"{self.address} not ready within {self.timeout} seconds")
+        self.connects += 1
+        if debug_mode: print(f"[wsclient] Connected to {self.address} in {time.time() - start_time:.3f} seconds")
+
+    def read(self, connection, ready):
+        try:
+            while True:
+                opcode, payload = connection.receive()
+                if opcode != OP_TEXT:
+                    # Binary messages (e.g., of log_get) are not used
+                    continue
+                message = json.loads(payload)
+                if isinstance(message, dict) and message.get('message') == 'ready':
+                    ready.set()
+                elif isinstance(message, dict) and message.get('message') == 'authenticate':
+                    if message.get('ready'):
+                        ready.set()
+                    elif self.password and not message.get('error'):
+                        digest = hmac.new(f"{message['type']}:{self.password}:{message['name']}".encode(),
+                                          message['challenge'].encode(), hashlib.sha256).hexdigest()
+                        connection.send_text(json.dumps({'message': 'authenticate', 'res': digest}))
+                    else:
+                        print(f"[wsclient] Authentication with {self.address} failed: {message.get('error')}")
+                        break
+                else:
+                    self.dispatch(message)
+        except (OSError, ValueError, ConnectionError) as e:
+            if debug_mode: print(f"[wsclient] {self.address}: {e}")
+        finally:
+            with self.lock:
+                if self.connection is connection:
+                    self.connection = None
+                pending, self.pending = self.pending, {}
+            # Wake up the requests still waiting on this connection
+            for slot in pending.values():
+                slot['event'].set()
+
+    def dispatch(self, message):
+        slot = self.pending.get(message.get('message_id')) if isinstance(message, dict) else None
+        if slot is not None and not message.get('notification'):
+            slot['response'] = message
+            slot['event'].set()
+            return
+        if isinstance(message, dict) and 'message_id' in message and not message.get('notification'):
+            # Late response to a request that timed out
+            return
+        for listener in list(self.listeners):
+            listener(message)
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def send(self, message):
+        # Send a message without waiting; return its waiting slot
+        self.connect()
+        message = dict(message)
+        with self.lock:
+            if 'message_id' not in message:
+                self.message_id += 1
+                message['message_id'] = f"id#{self.message_id}"
+            slot = {'event': threading.Event(), 'response': None, 'sent': time.time(),
+                    'message_id': message['message_id']}
+            self.pending[message['message_id']] = slot
+            connection = self.connection
+        try:
+            connection.send_text(json.dumps(message))
+        except (OSError, AttributeError) as e:
+            self.pending.pop(message['message_id'], None)
+            self.disconnect()
+            raise ConnectionError(f"Sending to {self.address} failed: {e}")
+        return slot
+
+    def wait(self, slot, timeout=None):
+        # Return the response of a sent message
+        timeout = self.timeout if timeout is None else timeout
+        answered = slot['event'].wait(timeout)
+        self.pending.pop(slot['message_id'], None)
+        if not answered:
+            raise TimeoutError(f"No response from {self.address} to {slot['message_id']} within {timeout} seconds")
+        if slot['response'] is None:
+            raise ConnectionError(f"Connection to {self.address} lost")
+        self.requests += 1
+        self.latency += time.time() - slot['sent']
+        return slot['response']
+
+    def request(self, message, timeout=None):
+        return self.wait(self.send(message), timeout)
+
+    def disconnect(self):
+        connection, self.connection = self.connection, None
+        if connection is not None:
+            connection.close()
+
+class WebSocketPool:
+    # One persistent AmarisoftClient per address, reconnected on demand, so
+    # that the rounds' API calls need no process launch or handshake
+    def __init__(self, password=None, timeout=ws_timeout, retries=1):
+        self.password = password
+        self.timeout = timeout
+        self.retries = retries
+        self.clients = {}
+        self.lock = threading.Lock()
+        self.failures = defaultdict(int)
+
+    def client(self, address):
+        with self.lock:
+            if address not in self.clients:
+                self.clients[address] = AmarisoftClient(address, self.password, self.timeout)
+            return self.clients[address]
+
+    def redirect(self, address, target):
+        # Serve address from another one, e.g., a local stand-in
+        with self.lock:
+            self.clients[address] = AmarisoftClient(target, self.password, self.timeout)
+
+    def request(self, address, message, timeout=None):
+        # Send a message and return its response; a broken or silent
+        # connection is reopened and the message sent again, up to retries times
+        client = self.client(address)
+        for attempt in range(self.retries + 1):
+            try:
+                return client.request(message, timeout)
+            except (OSError, ConnectionError, TimeoutError) as e:
+                self.failures[address] += 1
+                client.disconnect()
+                if attempt == self.retries:
+                    raise
+                if debug_mode: print(f"[wsclient] Retrying {message.get('message')} on {address}: {e}")
+
+    def send(self, address, message):
+        # Send a message without waiting, reconnecting as in request();
+        # return the client and slot to wait on
+        client = self.client(address)
+        for attempt in range(self.retries + 1):
+            try:
+                return client, client.send(message)
+            except (OSError, ConnectionError, TimeoutError) as e:
+                self.failures[address] += 1
+                client.disconnect()
+                if attempt == self.retries:
+                    raise
+
+    def report(self):
+        for address, client in sorted(self.clients.items()):
+            mean_latency = client.latency / client.requests * 1000 if client.requests else 0
+            print(f"[wsclient] {address}: {client.requests} requests over {client.connects} connections, "
+                  f"{self.failures[address]} failures, {mean_latency:.1f} ms mean latency")
+
+    def close_all(self):
+        for client in self.clients.values():
+            client.disconnect()
+
+# Persistent remote API connections shared by all rounds
+ws_pool = WebSocketPool()
+
+class StandInServer:
+    # Local stand-in for an Amarisoft remote API: announces itself ready and
+    # answers each message with responses.get(message) (or an empty
+    # response) after delay seconds, echoing message and message_id; a
+    # callable response is called with the message, e.g., to keep state
+    def __init__(self, responses=None, delay=0.0, name="UE"):
+        self.responses = responses or {}
+        self.delay = delay
+        self.name = name
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen()
+        self.address = f"127.0.0.1:{self.listener.getsockname()[1]}"
+        self.connections = []
+        self.messages = 0
+        threading.Thread(target=self.accept, daemon=True).start()
+
+    def accept(self):
+        while True:
+            try:
+                sock, _ = self.listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.serve, args=(sock,), daemon=True).start()
+
+    def serve(self, sock):
+        request = b''
+        while b'\r\n\r\n' not in request:
+            data = sock.recv(4096)
+            if not data:
+                return
+            request += data
+        lines = request.decode().split('\r\n')
+        headers = {name.strip().lower(): value.strip() for name, _, value in (line.partition(':') for line in lines[1:])}
+        sock.sendall((f"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {accept_key(headers['sec-websocket-key'])}\r\n\r\n").encode())
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        connection = WebSocketConnection(sock, masked=False)
+        self.connections.append(connection)
+        connection.send_text(json.dumps({'message': 'ready', 'type': self.name, 'name': self.name,
+                                         'version': '2021-09-18'}))
+        try:
+            while True:
+                _, payload = connection.receive()
+                messages = json.loads(payload)
+                for message in messages if isinstance(messages, list) else [messages]:
+                    self.messages += 1
+                    if self.delay:
+                        time.sleep(self.delay)
+                    response = self.responses.get(message.get('message'), {})
+                    response = dict(response(message) if callable(response) else response)
+                    response.update({'message': message.get('message'), 'message_id': message.get('message_id')})
+                    connection.send_text(json.dumps(response))
+        except (OSError, ValueError, ConnectionError):
+            pass
+
+    def drop_connections(self):
+        # Simulate a restart of the component
+        for connection in self.connections:
+            connection.close()
+        self.connections = []
+
+    def close(self):
+        self.listener.close()
+        self.drop_connections()
+
+if __name__ == "__main__":
+    # Per-call latency of the pooled client vs a node util/ws.js launch per
+    # call, against a local stand-in serving util/ws.out's ue_get, e.g.:
+    # python3 -m util.wsclient 100
+    import subprocess
+    import statistics
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ws.out')) as file:
+        output = file.read()
+    ue_get = json.loads(output[output.find('{'):output.rfind('}') + 1])
+    server = StandInServer({'ue_get': ue_get})
+    pool = WebSocketPool(timeout=2)
+
+    def summary(name, latencies):
+        latencies = sorted(latencies)
+        print(f"[wsclient] {name}: median {statistics.median(latencies) * 1000:.2f} ms, "
+              f"p90 {latencies[int(0.9 * (len(latencies) - 1))] * 1000:.2f} ms over {len(latencies)} calls")
+
+    start_time = time.time()
+    response = pool.request(server.address, {'message': 'ue_get'})
+    print(f"[wsclient] First call (connect included): {(time.time() - start_time) * 1000:.2f} ms, "
+          f"{len(response['ue_list'])} UEs, same JSON: {response['ue_list'] == ue_get['ue_list']}")
+    latencies = []
+    for _ in range(calls):
+        start_time = time.time()
+        pool.request(server.address, {'message': 'ue_get'})
+        latencies.append(time.time() - start_time)
+    summary("pooled Python client", latencies)
+
+    # Reconnection after the component drops the connection
+    server.drop_connections()
+    time.sleep(0.1)
+    start_time = time.time()
+    pool.request(server.address, {'message': 'config_set'})
+    print(f"[wsclient] Call after a dropped connection: {(time.time() - start_time) * 1000:.2f} ms, "
+          f"{pool.clients[server.address].connects} connections")
+
+    # Concurrent requests over the one connection
+    client = pool.client(server.address)
+    start_time = time.time()
+    slots = [client.send({'message': 'ue_get'}) for _ in range(10)]
+    responses = [client.wait(slot) for slot in slots]
+    print(f"[wsclient] 10 concurrent requests: {(time.time() - start_time) * 1000:.2f} ms, "
+          f"correlated: {[r['message_id'] for r in responses] == [s['message_id'] for s in slots]}")
+
+    node_calls = min(calls, 20)
+    node_check = subprocess.run(["node", "-e", "require('nodejs-websocket')"], capture_output=True)
+    if node_check.returncode == 0:
+        latencies = []
+        for _ in range(node_calls):
+            start_time = time.time()
+            subprocess.run(["node", "util/ws.js", server.address, json.dumps({'message': 'ue_get'})],
+                           capture_output=True, text=True, check=True)
+            latencies.append(time.time() - start_time)
+        summary("node util/ws.js per call", latencies)
+    else:
+        # Without the nodejs-websocket module, node's start-up bounds the former path from below
+        latencies = []
+        for _ in range(node_calls):
+            start_time = time.time()
+            subprocess.run(["node", "-e", ""], capture_output=True)
+            latencies.append(time.time() - start_time)
+        summary("node start-up alone (nodejs-websocket not installed)", latencies)
+    pool.report()
+    pool.close_all()
+    server.close()